@@ -0,0 +1,60 @@
+"""Core placement quality: the old random cpuset against spread and pack.
+
+Launches the same sequence of containers onto a simulated host, each
+asking for 1-4 cores and putting a fixed load on each of them (a few
+heavy, most light). Before every launch the placement sees the per-core
+load of the containers placed so far, as ``recent_core_load`` would
+report it. Prints, averaged over ``runs`` seeds, the busiest core, the
+number of cores over 100% and the cores left idle. Usage::
+
+    python -m benchmarks.placement [cores] [containers] [runs]
+"""
+import os
+import random
+import sys
+from collections import Counter
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'docker_box.settings')
+import django  # noqa: E402
+django.setup()
+
+from dockit.placement import choose_cores  # noqa: E402
+
+
+def random_cores(count, load, pinned):
+    return sorted(random.sample(range(len(load)), count))
+
+
+def simulate(place, cores, workload):
+    load = [0.] * cores
+    pinned = Counter()
+    for count, per_core in workload:
+        chosen = place(count, [min(value, 100.) for value in load], pinned)
+        for core in chosen:
+            load[core] += per_core
+        pinned.update(chosen)
+    return max(load), sum(1 for value in load if value > 100), sum(1 for value in load if not value)
+
+
+def main(cores=16, containers=12, runs=50):
+    policies = [
+        ('random', random_cores),
+        ('spread', lambda count, load, pinned: choose_cores(count, load, pinned, 'spread')),
+        ('pack', lambda count, load, pinned: choose_cores(count, load, pinned, 'pack')),
+    ]
+    totals = dict((name, [0, 0, 0]) for name, _ in policies)
+    for seed in range(runs):
+        rng = random.Random(seed)
+        workload = [(rng.randint(1, 4), rng.choice([80., 10., 10., 5.])) for _ in range(containers)]
+        for name, place in policies:
+            random.seed(seed)
+            for i, value in enumerate(simulate(place, cores, workload)):
+                totals[name][i] += value
+    print('policy  busiest core  cores > 100%  idle cores')
+    for name, _ in policies:
+        busiest, overloaded, idle = (value / runs for value in totals[name])
+        print('%-6s  %11.1f%%  %12.2f  %10.2f' % (name, busiest, overloaded, idle))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,65 @@
+"""Credential provisioning time against the number of SSH users.
+
+Compares installing every user's key plus the root password in one exec
+session (``provision``) with the old pattern of one exec per user and one
+more for the password. Runs against an in-process stand-in daemon that
+adds ``latency`` seconds to every API call, roughly what dockerd spends
+setting up an exec. Usage::
+
+    python -m benchmarks.provisioning [latency]
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'docker_box.settings')
+import django  # noqa: E402
+django.setup()
+
+from dockit import client as client_module  # noqa: E402
+from dockit.client import DockerClient  # noqa: E402
+from dockit.models import Container, User  # noqa: E402
+from benchmarks.standin import StandInDaemon  # noqa: E402
+
+
+def one_exec(container, users):
+    container.provision(users, set_password=True)
+
+
+def exec_per_user(container, users):
+    for user in users:
+        container.provision([user])
+    container.provision(set_password=True)
+
+
+def measure(provision, container, users, rounds=5):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        provision(container, users)
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main(latency=0.005):
+    socket_path = os.path.join(tempfile.mkdtemp(), 'docker.sock')
+    daemon = StandInDaemon(socket_path=socket_path).start()
+    daemon.add_container('a' * 64)
+    daemon.delay = latency
+    client_module._client = DockerClient('unix', socket_path=socket_path, timeout=5)
+    container = Container(container_id='a' * 64)
+    try:
+        print('users  one exec  exec per user')
+        for count in (0, 1, 2, 5, 10, 20):
+            users = [User(email='user%d@example.com' % i, ssh_pub_key='ssh-ed25519 KEY%d user%d' % (i, i))
+                     for i in range(count)]
+            print('%5d  %6.1fms  %11.1fms' % (
+                count, measure(one_exec, container, users) * 1e3, measure(exec_per_user, container, users) * 1e3))
+    finally:
+        client_module._client.close()
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.005)
@@ -0,0 +1,401 @@
+import os
+import re
+import json
+import socket
+import threading
+import time
+import uuid
+from queue import Queue, Empty
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super(StandInHandler, self).setup()
+        self.server.daemon.connections += 1
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, payload = self.server.daemon.handle(method, url.path, parse_qs(url.query), body)
+        if isinstance(payload, StandInStream):
+            self.stream(status, payload)
+            return
+        data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self, status, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for item in payload:
+                data = json.dumps(item).encode('utf-8') + b'\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def address_string(self):
+        return 'standin'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInStream(object):
+    """Chunked JSON stream fed from a queue or a generator; a ``None``
+    item ends the stream."""
+
+    def __init__(self, items=None, timeout=None, source=None):
+        self.queue = Queue()
+        self.timeout = timeout
+        self.source = source
+        for item in items or []:
+            self.queue.put(item)
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def __iter__(self):
+        if self.source is not None:
+            for item in self.source:
+                yield item
+            return
+        while True:
+            try:
+                item = self.queue.get(timeout=self.timeout)
+            except Empty:
+                return
+            if item is None:
+                return
+            yield item
+
+
+class ThreadingTCPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        request, address = super(ThreadingTCPServer, self).get_request()
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return request, address
+
+
+class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    # a full unix backlog fails non-blocking connects outright, and async
+    # clients open many connections at once
+    request_queue_size = 128
+
+    def get_request(self):
+        request, _ = super(ThreadingUnixServer, self).get_request()
+        return request, ('standin', 0)
+
+
+class StandInDaemon(object):
+    """Minimal in-process imitation of the Docker Engine API.
+
+    Serves canned container and image data over TCP, a unix socket or both,
+    so clients, benchmarks and tests can run without a real dockerd.
+    """
+
+    def __init__(self, port=None, socket_path=None):
+        self.port = port
+        self.socket_path = socket_path
+        self.containers = {}
+        self.images = {}
+        self.search_results = []
+        self.search_log = []
+        # pullable images: name -> layer sizes in bytes
+        self.registry = {}
+        self.processes = {}
+        self.changes = {}
+        # exec sessions by id; started ones are also appended to exec_log
+        self.execs = {}
+        self.exec_log = []
+        self.stats_interval = 1
+        # simulated per-request latency, in seconds
+        self.delay = 0
+        # client connections accepted so far, and every (method, path) served
+        self.connections = 0
+        self.requests = []
+        # container ids whose inspect answers with an empty, unparseable body
+        self.broken = set()
+        self.stopped = threading.Event()
+        self.event_log = []
+        self.event_streams = []
+        self.servers = []
+        self.routes = [
+            ('GET', r'^/_ping$', self.ping),
+            ('GET', r'^/containers/json$', self.list_containers),
+            ('GET', r'^/containers/(?P<id>[^/]+)/json$', self.inspect_container),
+            ('GET', r'^/containers/(?P<id>[^/]+)/stats$', self.container_stats),
+            ('GET', r'^/containers/(?P<id>[^/]+)/top$', self.container_top),
+            ('GET', r'^/containers/(?P<id>[^/]+)/changes$', self.container_changes),
+            ('POST', r'^/containers/create$', self.create_container),
+            ('POST', r'^/containers/(?P<id>[^/]+)/(?P<action>start|stop|restart)$', self.container_action),
+            ('DELETE', r'^/containers/(?P<id>[^/]+)$', self.remove_container),
+            ('POST', r'^/containers/(?P<id>[^/]+)/exec$', self.create_exec),
+            ('POST', r'^/exec/(?P<id>[^/]+)/start$', self.start_exec),
+            ('GET', r'^/exec/(?P<id>[^/]+)/json$', self.inspect_exec),
+            ('GET', r'^/events$', self.events),
+            ('GET', r'^/images/json$', self.list_images),
+            ('GET', r'^/images/search$', self.search_images),
+            ('POST', r'^/images/create$', self.create_image),
+            ('GET', r'^/images/(?P<name>.+)/json$', self.inspect_image),
+        ]
+
+    def start(self):
+        if self.port is not None:
+            self.servers.append(ThreadingTCPServer(('127.0.0.1', self.port), StandInHandler))
+            self.port = self.servers[-1].server_address[1]
+        if self.socket_path is not None:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.servers.append(ThreadingUnixServer(self.socket_path, StandInHandler))
+        for server in self.servers:
+            server.daemon = self
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.drop_events()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def handle(self, method, path, query, body):
+        self.requests.append((method, path))
+        if self.delay:
+            time.sleep(self.delay)
+        for route_method, pattern, view in self.routes:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                return view(query, body, **match.groupdict())
+        return 404, {'message': 'page not found'}
+
+    def find_container(self, container_id):
+        for full_id, container in self.containers.items():
+            if full_id.startswith(container_id):
+                return container
+        return None
+
+    def add_container(self, container_id, running=True, memory=0, cpuset='', ip_addr='', network='dbox_macvlan'):
+        self.containers[container_id] = {
+            'Id': container_id,
+            'Created': '2017-03-01T09:25:00.000000000Z',
+            'State': {'Running': running, 'Status': 'running' if running else 'exited'},
+            'HostConfig': {'Memory': memory, 'CpusetCpus': cpuset},
+            'NetworkSettings': {'Networks': {network: {'IPAddress': ip_addr}}},
+        }
+        return self.containers[container_id]
+
+    def add_image(self, image_id, tags, size=0):
+        self.images[image_id] = {
+            'Id': image_id,
+            'RepoTags': tags,
+            'Created': '2017-03-01T09:25:00.000000000Z',
+            'Size': size,
+        }
+        for tag in tags:
+            self.images[tag] = self.images[image_id]
+        return self.images[image_id]
+
+    def emit(self, type, action, actor_id, **attributes):
+        event = {'Type': type, 'Action': action, 'Actor': {'ID': actor_id, 'Attributes': attributes},
+                 'time': int(time.time()), 'timeNano': int(time.time() * 1e9)}
+        self.event_log.append(event)
+        for stream in self.event_streams:
+            stream.put(event)
+
+    def drop_events(self):
+        for stream in self.event_streams:
+            stream.put(None)
+        self.event_streams = []
+
+    def events(self, query, body):
+        since = int(query.get('since', ['0'])[0])
+        stream = StandInStream([event for event in self.event_log if since and event['time'] >= since])
+        self.event_streams.append(stream)
+        return 200, stream
+
+    def list_images(self, query, body):
+        images = dict((image['Id'], image) for image in self.images.values())
+        return 200, [{
+            'Id': image['Id'],
+            'RepoTags': image['RepoTags'],
+            'Created': 1488360300,
+            'Size': image['Size'],
+        } for image in images.values()]
+
+    def ping(self, query, body):
+        return 200, 'OK'
+
+    def list_containers(self, query, body):
+        containers = self.containers.values()
+        if query.get('all', ['0'])[0] in ('0', 'false'):
+            containers = [c for c in containers if c['State']['Running']]
+        return 200, [{
+            'Id': c['Id'],
+            'Created': 1488360300,
+            'State': c['State']['Status'],
+            'Status': c['State']['Status'],
+            'NetworkSettings': c['NetworkSettings'],
+        } for c in containers]
+
+    def inspect_container(self, query, body, id):
+        container = self.find_container(id)
+        if container is None:
+            return 404, {'message': 'No such container: %s' % id}
+        if container['Id'] in self.broken:
+            return 200, None
+        return 200, container
+
+    def container_stats(self, query, body, id):
+        container = self.find_container(id)
+        if container is None:
+            return 404, {'message': 'No such container: %s' % id}
+        return 200, StandInStream(source=self.stats_frames(container['Id']))
+
+    def container_top(self, query, body, id):
+        container = self.find_container(id)
+        if container is None:
+            return 404, {'message': 'No such container: %s' % id}
+        return 200, {'Titles': ['UID', 'PID', 'CMD'], 'Processes': self.processes.get(container['Id'], [])}
+
+    def container_changes(self, query, body, id):
+        container = self.find_container(id)
+        if container is None:
+            return 404, {'message': 'No such container: %s' % id}
+        return 200, self.changes.get(container['Id'], [])
+
+    def stats_frames(self, container_id):
+        usage = system = received = sent = 0
+        previous = None
+        while not self.stopped.is_set() and container_id in self.containers:
+            usage += 25000000
+            system += 1000000000
+            received += 4096
+            sent += 1024
+            frame = {
+                'read': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()) + '.%06dZ' % (time.time() % 1 * 1e6),
+                'cpu_stats': {'cpu_usage': {'total_usage': usage}, 'system_cpu_usage': system, 'online_cpus': 2},
+                'precpu_stats': previous or {'cpu_usage': {'total_usage': 0}},
+                'memory_stats': {'usage': 64 * 1024 * 1024, 'limit': self.containers[container_id]['HostConfig']['Memory'],
+                                 'stats': {'cache': 16 * 1024 * 1024}},
+                'networks': {'eth0': {'rx_bytes': received, 'tx_bytes': sent}},
+            }
+            previous = frame['cpu_stats']
+            yield frame
+            self.stopped.wait(self.stats_interval)
+
+    def create_container(self, query, body):
+        config = json.loads(body.decode('utf-8'))
+        if config['Image'] not in self.images and config['Image'] + ':latest' not in self.images:
+            return 404, {'message': 'No such image: %s' % config['Image']}
+        network, endpoint = list(config['NetworkingConfig']['EndpointsConfig'].items())[0]
+        container = self.add_container(
+            uuid.uuid4().hex * 2, running=False, memory=config['HostConfig']['Memory'],
+            cpuset=config['HostConfig']['CpusetCpus'], ip_addr=endpoint['IPAMConfig']['IPv4Address'], network=network)
+        container['Config'] = {'Hostname': config['Hostname'], 'Image': config['Image']}
+        return 201, {'Id': container['Id'], 'Warnings': None}
+
+    def container_action(self, query, body, id, action):
+        container = self.find_container(id)
+        if container is None:
+            return 404, {'message': 'No such container: %s' % id}
+        running = action != 'stop'
+        if action != 'restart' and container['State']['Running'] == running:
+            return 304, None
+        container['State'] = {'Running': running, 'Status': 'running' if running else 'exited'}
+        return 204, None
+
+    def remove_container(self, query, body, id):
+        container = self.find_container(id)
+        if container is None:
+            return 404, {'message': 'No such container: %s' % id}
+        del self.containers[container['Id']]
+        return 204, None
+
+    def create_exec(self, query, body, id):
+        container = self.find_container(id)
+        if container is None:
+            return 404, {'message': 'No such container: %s' % id}
+        config = json.loads(body.decode('utf-8'))
+        exec_id = uuid.uuid4().hex
+        self.execs[exec_id] = {'ID': exec_id, 'ContainerID': container['Id'], 'Running': False, 'ExitCode': None,
+                               'Cmd': config['Cmd'], 'Env': config.get('Env') or []}
+        return 201, {'Id': exec_id}
+
+    def start_exec(self, query, body, id):
+        if id not in self.execs:
+            return 404, {'message': 'No such exec instance: %s' % id}
+        self.execs[id]['ExitCode'] = 0
+        self.exec_log.append(self.execs[id])
+        return 200, None
+
+    def inspect_exec(self, query, body, id):
+        if id not in self.execs:
+            return 404, {'message': 'No such exec instance: %s' % id}
+        return 200, self.execs[id]
+
+    def search_images(self, query, body):
+        term = query.get('term', [''])[0]
+        limit = int(query.get('limit', ['25'])[0])
+        self.search_log.append(term)
+        return 200, [r for r in self.search_results if term in r['name'] or term in r.get('description', '')][:limit]
+
+    def create_image(self, query, body):
+        name, tag = query['fromImage'][0], query.get('tag', ['latest'])[0]
+        if name not in self.registry:
+            return 404, {'message': 'pull access denied for %s, repository does not exist' % name}
+        return 200, StandInStream(source=self.pull_lines(name, tag))
+
+    def pull_lines(self, name, tag):
+        layers = ['%012x' % (index + 1) for index in range(len(self.registry[name]))]
+        yield {'status': 'Pulling from library/%s' % name, 'id': tag}
+        for layer in layers:
+            yield {'status': 'Pulling fs layer', 'progressDetail': {}, 'id': layer}
+        for layer, size in zip(layers, self.registry[name]):
+            for current in range(0, size + 1, max(size // 4, 1)):
+                yield {'status': 'Downloading', 'progressDetail': {'current': current, 'total': size}, 'id': layer}
+            yield {'status': 'Download complete', 'progressDetail': {}, 'id': layer}
+            yield {'status': 'Pull complete', 'progressDetail': {}, 'id': layer}
+        image_id = 'sha256:' + uuid.uuid4().hex * 2
+        self.add_image(image_id, ['%s:%s' % (name, tag)], sum(self.registry[name]))
+        yield {'status': 'Digest: ' + image_id}
+        yield {'status': 'Status: Downloaded newer image for %s:%s' % (name, tag)}
+
+    def inspect_image(self, query, body, name):
+        image = self.images.get(name)
+        if image is None:
+            return 404, {'message': 'No such image: %s' % name}
+        return 200, image
@@ -0,0 +1,52 @@
+"""Per-call latency of the TCP and unix-socket Docker transports.
+
+Runs against an in-process stand-in daemon listening on both a loopback
+TCP port and a unix socket, so the numbers only reflect transport and
+client overhead. Usage::
+
+    python -m benchmarks.transport [calls]
+"""
+import os
+import sys
+import tempfile
+import time
+from dockit.client import DockerClient
+from benchmarks.standin import StandInDaemon
+
+
+def measure(client, calls):
+    client.get('/_ping')
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        client.get('/containers/abc/json')
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings
+
+
+def report(name, timings):
+    mean = sum(timings) / len(timings)
+    p50 = timings[len(timings) // 2]
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print('%-5s mean %7.1fus  p50 %7.1fus  p99 %7.1fus' % (name, mean * 1e6, p50 * 1e6, p99 * 1e6))
+
+
+def main(calls=2000):
+    socket_path = os.path.join(tempfile.mkdtemp(), 'docker.sock')
+    daemon = StandInDaemon(port=0, socket_path=socket_path).start()
+    daemon.add_container('abc', memory=200 * 1000000, cpuset='0,1', ip_addr='10.0.0.2')
+    try:
+        clients = [
+            ('tcp', DockerClient('tcp', base_url='http://127.0.0.1:%s' % daemon.port, pool_size=1, timeout=5)),
+            ('unix', DockerClient('unix', socket_path=socket_path, pool_size=1, timeout=5)),
+        ]
+        for name, client in clients:
+            report(name, measure(client, calls))
+            client.close()
+    finally:
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,22 @@
+"""
+ASGI config for docker_box project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The stats streams are served by coroutines; every other request is passed to
+the regular WSGI application in a thread, e.g.::
+
+    uvicorn docker_box.asgi:application
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "docker_box.settings")
+
+django_application = get_wsgi_application()
+
+from dockit.async_views import StatsStreamRouter  # noqa: E402 (needs the app registry)
+
+application = StatsStreamRouter(WsgiToAsgi(django_application))
@@ -33,6 +33,7 @@ MIDDLEWARE_CLASSES = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'dockit.middleware.RequestStoreMiddleware',
 ]
 
 ROOT_URLCONF = 'docker_box.urls'
@@ -124,3 +125,72 @@ LOGGING = {
 
 DOCKER_API_PORT = '2375'
 HOST_IP_ADDR = ''
+DOCKER_API_POOL_SIZE = 10
+DOCKER_API_CONNECT_TIMEOUT = 3
+DOCKER_API_READ_TIMEOUT = 60
+# 'tcp' talks to localhost:DOCKER_API_PORT, which install.sh sets up; 'unix'
+# to DOCKER_SOCKET_PATH, which is faster but needs the web and celery users in
+# the docker group
+DOCKER_API_TRANSPORT = 'tcp'
+DOCKER_SOCKET_PATH = '/var/run/docker.sock'
+DOCKER_MIRROR_ENABLED = True
+DOCKER_MIRROR_RETRY_INTERVAL = 5
+DOCKER_MIRROR_IDLE_RESYNC = 300
+DOCKER_INSPECT_CACHE_SIZE = 1000
+DOCKER_INSPECT_CACHE_TTL = 10
+HOST_STATS_INTERVAL = 1
+HOST_STATS_BUFFER_SIZE = 600
+STATS_SUBSCRIBER_QUEUE_SIZE = 16
+# (step seconds, slots): 1s for 10 minutes, 1m for a day, 1h for a month
+METRICS_TIERS = [(1, 600), (60, 1440), (3600, 720)]
+METRICS_MAX_SERIES = 500
+METRICS_DEFAULT_RANGE = 600
+METRICS_HISTORY_POINTS = 1000
+# directory for the on-disk history, outside the checkout (install.sh uses
+# /var/lib/docker_box/metrics); None keeps metrics in memory only
+METRICS_ARCHIVE_DIR = None
+METRICS_ARCHIVE_STEP = 10
+METRICS_ARCHIVE_RETENTION = 180 * 86400
+METRICS_ARCHIVE_COMPACT_AFTER = 7 * 86400
+METRICS_ARCHIVE_COMPACT_STEP = 300
+METRICS_ARCHIVE_COMPACT_INTERVAL = 86400
+STATS_HEARTBEAT_INTERVAL = 5
+STATS_KEYFRAME_INTERVAL = 60
+STATS_STREAM_MAX_AGE = 4 * 3600
+STATS_STREAM_IDLE_TIMEOUT = 120
+STATS_STREAMS_PER_USER = 4
+LIVE_POLL_INTERVAL = 5
+DOCKER_API_CONCURRENCY = 20
+# Docker calls in flight per bulk start/stop/restart/remove; the client pool
+# (DOCKER_API_POOL_SIZE) makes anything beyond it wait for a connection
+BULK_ACTION_PARALLELISM = 10
+# image pulls run in celery workers and publish their progress to this cache,
+# which web workers read; it must be shared between processes and is kept in
+# memcached so progress updates never hit the disk
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'pulls': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': '127.0.0.1:11211'},
+}
+PULL_PROGRESS_CACHE = 'pulls'
+PULL_PROGRESS_INTERVAL = 1
+PULL_PROGRESS_TTL = 3600
+# distinct image pulls running at once; further pulls wait in the queue
+PULL_CONCURRENCY = 2
+PULL_RETRY_INTERVAL = 5
+# a pull's in-flight key and concurrency slot expire this many seconds after
+# its last progress update, so a worker that dies mid-pull frees them
+PULL_LOCK_TTL = 60
+# registry search results: fresh for IMAGE_SEARCH_TTL, then served stale
+# while refreshed in the background until IMAGE_SEARCH_STALE_TTL
+IMAGE_SEARCH_CACHE_SIZE = 500
+IMAGE_SEARCH_TTL = 300
+IMAGE_SEARCH_STALE_TTL = 3600
+IMAGE_SEARCH_LIMIT = 25
+# cpuset placement: 'spread' picks the least-loaded cores, 'pack' fills
+# cores already in use up to PLACEMENT_PACK_THRESHOLD percent first
+PLACEMENT_POLICY = 'spread'
+PLACEMENT_PACK_THRESHOLD = 60
+# expected load, in percent of a core, of each container pinned to it
+PLACEMENT_PIN_WEIGHT = 25
+# seconds of host samples averaged into per-core load
+PLACEMENT_LOAD_WINDOW = 60
@@ -0,0 +1,200 @@
+import json
+import asyncio
+from urllib.parse import urlencode, quote
+from django.conf import settings
+
+
+class AsyncResponse(object):
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8')) if self.content else None
+
+
+class AsyncDockerClient(object):
+    """asyncio client for the Docker Engine API.
+
+    Speaks just enough HTTP/1.1 over a unix socket or TCP connection for
+    the Engine API: keep-alive connections (at most ``pool_size`` at once),
+    ``Content-Length`` and chunked bodies. Use it as an async context
+    manager so idle connections are closed on exit::
+
+        async with AsyncDockerClient() as client:
+            states = await gather_bounded([client.inspect_container(i) for i in ids])
+
+    The methods mirror the calls ``ContainerMixin`` and ``ImageMixin``
+    make through the blocking ``DockerClient``.
+    """
+
+    def __init__(self, transport=None, socket_path=None, port=None, pool_size=None, timeout=None):
+        self.transport = transport or settings.DOCKER_API_TRANSPORT
+        self.socket_path = socket_path or settings.DOCKER_SOCKET_PATH
+        self.port = port or settings.DOCKER_API_PORT
+        self.timeout = timeout or settings.DOCKER_API_READ_TIMEOUT
+        self.slots = asyncio.Semaphore(pool_size or settings.DOCKER_API_POOL_SIZE)
+        self.idle = []
+        if self.transport not in ('unix', 'tcp'):
+            raise ValueError('Unknown docker transport: %s' % self.transport)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def connect(self):
+        if self.idle:
+            return self.idle.pop()
+        connect = (asyncio.open_unix_connection(self.socket_path) if self.transport == 'unix'
+                   else asyncio.open_connection('localhost', int(self.port)))
+        return await asyncio.wait_for(connect, settings.DOCKER_API_CONNECT_TIMEOUT)
+
+    async def request(self, method, path, params=None, json_body=None, timeout=None):
+        if params:
+            path += '?' + urlencode(params)
+        body = json.dumps(json_body).encode('utf-8') if json_body is not None else b''
+        head = '%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n' % (method, path, len(body))
+        if json_body is not None:
+            head += 'Content-Type: application/json\r\n'
+        data = head.encode('latin-1') + b'\r\n' + body
+        async with self.slots:
+            while True:
+                reused = bool(self.idle)
+                reader, writer = await self.connect()
+                try:
+                    writer.write(data)
+                    response, keep_alive = await asyncio.wait_for(self.read_response(reader), timeout or self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        # the daemon closed an idle keep-alive connection
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+            if keep_alive:
+                self.idle.append((reader, writer))
+            else:
+                writer.close()
+        return response
+
+    async def read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('docker closed the connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if not size:
+                    break
+                content += chunk[:-2]
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        elif status in (204, 304) or status < 200:
+            content = b''
+        else:
+            content = await reader.read()
+            return AsyncResponse(status, headers, content), False
+        return AsyncResponse(status, headers, content), headers.get('connection', '').lower() != 'close'
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def close(self):
+        while self.idle:
+            self.idle.pop()[1].close()
+
+    # containers
+
+    async def containers(self, all=True):
+        return (await self.get('/containers/json', params={'all': int(all)})).json()
+
+    async def inspect_container(self, container_id):
+        response = await self.get('/containers/%s/json' % container_id)
+        return response.json() if response.status_code == 200 else None
+
+    async def start_container(self, container_id):
+        return (await self.post('/containers/%s/start' % container_id)).status_code
+
+    async def stop_container(self, container_id):
+        return (await self.post('/containers/%s/stop' % container_id)).status_code
+
+    async def restart_container(self, container_id):
+        return (await self.post('/containers/%s/restart' % container_id)).status_code
+
+    async def remove_container(self, container_id):
+        return (await self.delete('/containers/%s' % container_id, params={'v': 1, 'force': 1})).status_code
+
+    async def commit_container(self, container_id, repo, tag='latest'):
+        response = await self.post('/commit', params={'container': container_id, 'repo': repo, 'tag': tag})
+        return response.status_code, response.json()
+
+    async def container_top(self, container_id):
+        response = await self.get('/containers/%s/top' % container_id)
+        return response.json() if response.status_code == 200 else None
+
+    async def container_changes(self, container_id):
+        response = await self.get('/containers/%s/changes' % container_id)
+        return (response.json() or []) if response.status_code == 200 else []
+
+    # images
+
+    async def images(self):
+        return (await self.get('/images/json')).json()
+
+    async def inspect_image(self, name):
+        response = await self.get('/images/%s/json' % quote(name, safe=':'))
+        return response.json() if response.status_code == 200 else None
+
+    async def remove_image(self, name):
+        return (await self.delete('/images/%s' % quote(name, safe=':'))).status_code
+
+
+async def gather_bounded(coroutines, limit=None, return_exceptions=False):
+    """Like ``asyncio.gather`` but with at most ``limit`` coroutines in
+    flight at a time; results come back in the order given."""
+    slots = asyncio.Semaphore(limit or settings.DOCKER_API_CONCURRENCY)
+
+    async def bounded(coroutine):
+        async with slots:
+            return await coroutine
+    return await asyncio.gather(*[bounded(c) for c in coroutines], return_exceptions=return_exceptions)
+
+
+def fan_out(operation, items, limit=None, return_exceptions=False):
+    """Run ``operation(client, item)`` for every item concurrently and return
+    the results in order. For use from synchronous code such as views; the
+    calls run on a private event loop and connection pool."""
+    items = list(items)
+    if not items:
+        return []
+
+    async def run():
+        async with AsyncDockerClient() as client:
+            return await gather_bounded([operation(client, item) for item in items], limit, return_exceptions)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
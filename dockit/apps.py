@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class dockitConfig(AppConfig):
     name = 'dockit'
+
+    def ready(self):
+        # keep the image catalog in step with docker events
+        from dockit.catalog import sync_on_event
+        from dockit.mirror import mirror_listeners
+        mirror_listeners.append(sync_on_event)
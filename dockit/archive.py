@@ -0,0 +1,283 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import logging
+import threading
+from django.conf import settings
+
+MAGIC = b'DBXM'
+VERSION = 1
+# magic, version, number of fields, step of the raw records
+HEADER = struct.Struct('<4sHHI4x')
+SUFFIX = '.metrics'
+
+logger = logging.getLogger(__name__)
+
+
+def series_name(key):
+    return '-'.join(key) + SUFFIX
+
+
+def series_key(name):
+    return tuple(name[:-len(SUFFIX)].split('-', 1))
+
+
+class SeriesFile(object):
+    """Append-only file of fixed-width ``(time, value...)`` records.
+
+    Records are little-endian doubles, written in time order, so a range
+    query is a binary search over the memory-mapped file followed by one
+    sequential read. Writers take an exclusive ``flock``; compaction swaps
+    in a rewritten file, so an appender that finds its inode replaced simply
+    reopens the path.
+    """
+
+    def __init__(self, path, fields, step):
+        self.path = path
+        self.fields = fields
+        self.step = step
+        self.record = struct.Struct('<%dd' % (len(fields) + 1))
+
+    def append(self, rows):
+        data = b''.join(self.record.pack(*row) for row in rows)
+        while True:
+            with open(self.path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                if not self.same_file(f):
+                    continue
+                size = os.fstat(f.fileno()).st_size
+                if size < HEADER.size:
+                    f.truncate(0)
+                    f.write(HEADER.pack(MAGIC, VERSION, len(self.fields), self.step))
+                elif (size - HEADER.size) % self.record.size:
+                    # drop a record torn by a crash mid-write
+                    f.truncate(size - (size - HEADER.size) % self.record.size)
+                f.write(data)
+                return
+
+    def same_file(self, f):
+        try:
+            return os.stat(self.path).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def read(self, start=None, end=None):
+        """Return the records with ``start <= time <= end``."""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return []
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            count = (size - HEADER.size) // self.record.size
+            if count <= 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self.check(data)
+                first = 0 if start is None else self.bisect(data, count, start)
+                last = count if end is None else self.bisect(data, count, end, right=True)
+                if first >= last:
+                    return []
+                offset = HEADER.size + first * self.record.size
+                return list(self.record.iter_unpack(data[offset:offset + (last - first) * self.record.size]))
+
+    def check(self, data):
+        magic, version, fields, step = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or fields != len(self.fields):
+            raise ValueError('%s is not a metrics archive for %s' % (self.path, ', '.join(self.fields)))
+
+    def bisect(self, data, count, timestamp, right=False):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            value = struct.unpack_from('<d', data, HEADER.size + middle * self.record.size)[0]
+            if value < timestamp or (right and value == timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def rewrite(self, transform):
+        """Replace the records with ``transform(records)``; an empty result
+        removes the file. Returns the record counts before and after."""
+        while True:
+            with open(self.path, 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                if not self.same_file(f):
+                    continue
+                records = self.read()
+                kept = transform(records)
+                if not kept:
+                    os.unlink(self.path)
+                    return len(records), 0
+                temp = '%s.%d.tmp' % (self.path, os.getpid())
+                with open(temp, 'wb') as out:
+                    out.write(HEADER.pack(MAGIC, VERSION, len(self.fields), self.step))
+                    out.write(b''.join(self.record.pack(*row) for row in kept))
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(temp, self.path)
+                return len(records), len(kept)
+
+    def info(self):
+        rows = self.read()
+        return {
+            'records': len(rows),
+            'bytes': os.stat(self.path).st_size,
+            'first': rows[0][0] if rows else None,
+            'last': rows[-1][0] if rows else None,
+        }
+
+
+def downsample(records, step):
+    # average the records of every step-wide bucket
+    rows = []
+    bucket = None
+    for record in records:
+        start = record[0] // step * step
+        if start != bucket:
+            bucket, total, count = start, list(record), 1
+            rows.append(None)
+        else:
+            total = [a + b for a, b in zip(total, record)]
+            count += 1
+        rows[-1] = (start,) + tuple(value / count for value in total[1:])
+    return rows
+
+
+class MetricsArchive(object):
+    """Durable per-series metrics history under ``METRICS_ARCHIVE_DIR``.
+
+    Samples are averaged in memory over ``step`` seconds and appended as one
+    fixed-width record per step, so a restart loses at most one step.
+    Records older than ``compact_after`` are folded into ``compact_step``
+    buckets and records older than ``retention`` are dropped. A background
+    compactor does this for every series once per ``compact_interval`` and
+    removes the series of containers Docker no longer has, off the threads
+    that write samples; ``manage.py metrics_archive compact`` does the same
+    on demand.
+    """
+
+    def __init__(self, directory=None, step=None, retention=None, compact_after=None, compact_step=None,
+                 compact_interval=None):
+        self.directory = directory or settings.METRICS_ARCHIVE_DIR
+        self.step = step or settings.METRICS_ARCHIVE_STEP
+        self.retention = retention or settings.METRICS_ARCHIVE_RETENTION
+        self.compact_after = compact_after or settings.METRICS_ARCHIVE_COMPACT_AFTER
+        self.compact_step = compact_step or settings.METRICS_ARCHIVE_COMPACT_STEP
+        self.compact_interval = compact_interval or settings.METRICS_ARCHIVE_COMPACT_INTERVAL
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.compactor = None
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def series(self, key, fields):
+        return SeriesFile(os.path.join(self.directory, series_name(key)), fields, self.step)
+
+    def add(self, key, fields, timestamp, values):
+        bucket = timestamp // self.step * self.step
+        row = [values[field] for field in fields]
+        with self.lock:
+            pending = self.pending.get(key)
+            if pending is not None and pending[1] == bucket:
+                count = pending[3] + 1
+                pending[2] = [(a * (count - 1) + b) / count for a, b in zip(pending[2], row)]
+                pending[3] = count
+                return
+            self.pending[key] = [fields, bucket, row, 1]
+        if pending is not None:
+            self.write(key, pending)
+
+    def write(self, key, pending):
+        fields, bucket, row, count = pending
+        self.series(key, fields).append([[bucket] + row])
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for key, entry in pending.items():
+            self.write(key, entry)
+
+    def query(self, key, fields, start, end, step=None):
+        rows = self.series(key, fields).read(start, end)
+        step = max(step or self.step, self.step)
+        if step > self.step:
+            rows = downsample(rows, step)
+        result = {'time': [row[0] for row in rows], 'step': step}
+        for index, field in enumerate(fields, 1):
+            result[field] = [round(row[index], 2) for row in rows]
+        return result
+
+    def compact_series(self, series, now=None):
+        now = now or time.time()
+        expired = now - self.retention
+        boundary = (now - self.compact_after) // self.compact_step * self.compact_step
+
+        def transform(records):
+            old = [r for r in records if expired <= r[0] < boundary]
+            recent = [r for r in records if r[0] >= boundary]
+            return downsample(old, self.compact_step) + recent
+        try:
+            return series.rewrite(transform)
+        except FileNotFoundError:
+            return 0, 0
+
+    def remove(self, key, fields):
+        with self.lock:
+            self.pending.pop(key, None)
+        try:
+            return self.series(key, fields).rewrite(lambda records: [])
+        except FileNotFoundError:
+            return 0, 0
+
+    def compact(self, fields_for, live=None, now=None, keys=None):
+        """Compact ``keys``, or every series, removing those of containers
+        not in ``live`` (short ids) when it is given. Returns ``(key,
+        before, after)`` record counts per series."""
+        results = []
+        for key in keys or self.keys():
+            if live is not None and key[0] == 'container' and key[1] not in live:
+                results.append((key,) + self.remove(key, fields_for(key)))
+            else:
+                results.append((key,) + self.compact_series(self.series(key, fields_for(key)), now))
+        return results
+
+    def start_compactor(self, fields_for, live):
+        # live() returns the short ids of existing containers, or raises
+        # when Docker cannot say; series are then only compacted
+        def run():
+            while not self.stopped.wait(self.compact_interval):
+                try:
+                    containers = live()
+                except Exception as e:
+                    logger.warning('metrics compactor cannot list containers: %s', e)
+                    containers = None
+                try:
+                    self.compact(fields_for, containers)
+                except Exception:
+                    logger.exception('metrics compaction failed')
+        self.compactor = threading.Thread(target=run, name='metrics-compactor')
+        self.compactor.daemon = True
+        self.compactor.start()
+        return self
+
+    def keys(self):
+        return sorted(series_key(name) for name in os.listdir(self.directory) if name.endswith(SUFFIX))
+
+
+_metrics_archive = None
+_metrics_archive_lock = threading.Lock()
+
+
+def get_metrics_archive():
+    # None when METRICS_ARCHIVE_DIR is unset
+    global _metrics_archive
+    if _metrics_archive is None and settings.METRICS_ARCHIVE_DIR:
+        with _metrics_archive_lock:
+            if _metrics_archive is None:
+                _metrics_archive = MetricsArchive()
+    return _metrics_archive
@@ -0,0 +1,239 @@
+import json
+import asyncio
+from importlib import import_module
+from http.cookies import SimpleCookie
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpRequest, QueryDict
+from django.http.request import split_domain_port, validate_host
+from django.utils.six.moves.urllib.parse import urlparse
+from django.contrib.auth import get_user
+from django.core.urlresolvers import resolve, Resolver404
+from dockit.models import Container
+from dockit.streams import (FrameEncoder, async_stream_frames, async_topic_updates, stream_format, stream_fields,
+                            CONTENT_TYPES, HOST_STREAM_FIELDS, CONTAINER_STREAM_FIELDS, PROTOCOL_VERSION)
+
+
+def build_request(scope):
+    # just enough of an HttpRequest for sessions, auth and the stream helpers
+    request = HttpRequest()
+    request.path = request.path_info = scope['path']
+    request.method = scope.get('method', 'GET')
+    request.GET = QueryDict(scope.get('query_string', b'').decode('latin-1'))
+    for name, value in scope.get('headers', []):
+        request.META['HTTP_' + name.decode('latin-1').upper().replace('-', '_')] = value.decode('latin-1')
+    cookies = SimpleCookie(request.META.get('HTTP_COOKIE', ''))
+    request.COOKIES = dict((name, morsel.value) for name, morsel in cookies.items())
+    return request
+
+
+def same_origin(request):
+    """Whether a WebSocket handshake comes from one of our own pages.
+
+    Browsers send the session cookie with cross-site WebSocket handshakes
+    and do not apply CORS to them, so the ``Origin`` must match the
+    ``Host`` the request was sent to or one of ``ALLOWED_HOSTS``; the
+    ``'*'`` wildcard does not count. Clients that send no ``Origin`` are
+    not browsers and are let through to the session check."""
+    origin = request.META.get('HTTP_ORIGIN')
+    if origin is None:
+        return True
+    netloc = urlparse(origin).netloc
+    if not netloc:
+        return False
+    if netloc == request.META.get('HTTP_HOST'):
+        return True
+    domain, port = split_domain_port(netloc)
+    return bool(domain) and validate_host(domain, [host for host in settings.ALLOWED_HOSTS if host != '*'])
+
+
+def authorize(request, view_name, kwargs):
+    """Return the stats key the request may stream and the user id, or None
+    to let the WSGI view answer (login redirect or no_access page)."""
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    user = get_user(request)
+    if not user.is_authenticated():
+        return None
+    if view_name == 'host_stats':
+        return ('host',), user.pk
+    container = Container.objects.get_container(kwargs['container_id'], user)
+    if container:
+        return ('container', container.container_id[:12]), user.pk
+    return None
+
+
+async def stream_stats(scope, receive, send, key, user_id):
+    request = build_request(scope)
+    kind = key[0]
+    fmt = stream_format(request)
+    fields = stream_fields(request, HOST_STREAM_FIELDS if kind == 'host' else CONTAINER_STREAM_FIELDS)
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', CONTENT_TYPES[fmt].encode('latin-1')),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    frames = async_stream_frames(key, FrameEncoder(kind, fields, fmt), user_id)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        while True:
+            frame = asyncio.ensure_future(frames.__anext__())
+            await asyncio.wait([frame, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            if not frame.done():
+                frame.cancel()
+                try:
+                    await frame
+                except asyncio.CancelledError:
+                    pass
+                break
+            try:
+                data = frame.result()
+            except StopAsyncIteration:
+                break
+            try:
+                await send_within(send, {'type': 'http.response.body', 'body': data.encode('utf-8'), 'more_body': True})
+            except asyncio.TimeoutError:
+                # the client stopped reading, do not wait on it again
+                return
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        await frames.aclose()
+
+
+async def send_within(send, message, timeout=None):
+    # a client that stops reading holds a send until the idle timeout, then
+    # its stream is dropped
+    await asyncio.wait_for(send(message), timeout or settings.STATS_STREAM_IDLE_TIMEOUT)
+
+
+async def wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+LIVE_CHANNELS = ('stats', 'top', 'diff')
+
+
+class LiveChannel(object):
+    """One container page's WebSocket, multiplexing stats, top and diff.
+
+    The client sends ``{"watch": [channel, ...]}`` to choose what it shows;
+    the server answers with ``{"channel": ..., "frame": ...}`` messages for
+    stats (protocol v1 frames) and ``{"channel": ..., "data": ...}`` for top
+    and diff, which are pushed only when they change.
+    """
+
+    def __init__(self, send, container_id, user_id):
+        self.send = send
+        self.container_id = container_id
+        self.user_id = user_id
+        self.tasks = {}
+
+    def watch(self, channels):
+        for channel in [c for c, task in self.tasks.items() if task.done()]:
+            del self.tasks[channel]
+        for channel in [c for c in self.tasks if c not in channels]:
+            self.tasks.pop(channel).cancel()
+        for channel in [c for c in channels if c in LIVE_CHANNELS and c not in self.tasks]:
+            self.tasks[channel] = asyncio.ensure_future(self.pump(channel))
+
+    async def pump(self, channel):
+        if channel == 'stats':
+            encoder = FrameEncoder('container', CONTAINER_STREAM_FIELDS, None)
+            updates = async_stream_frames(('container', self.container_id), encoder, self.user_id)
+        else:
+            updates = async_topic_updates((channel, self.container_id))
+        try:
+            async for update in updates:
+                message = {'channel': channel}
+                message['frame' if channel == 'stats' else 'data'] = update
+                await send_within(self.send, {'type': 'websocket.send', 'text': json.dumps(message, separators=(',', ':'))})
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await updates.aclose()
+
+    def close(self):
+        self.watch(())
+
+
+async def live_channel(scope, receive, send, key, user_id):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+    await send({'type': 'websocket.send', 'text': json.dumps(
+        {'channel': None, 'v': PROTOCOL_VERSION, 'channels': list(LIVE_CHANNELS)})})
+    live = LiveChannel(send, key[1], user_id)
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message['type'] == 'websocket.receive' and message.get('text'):
+                try:
+                    live.watch(json.loads(message['text']).get('watch') or ())
+                except (ValueError, AttributeError):
+                    pass
+    finally:
+        live.close()
+
+
+class StatsStreamRouter(object):
+    """ASGI app that serves ``host_stats`` and ``container_stats`` as
+    coroutines, accepts the ``container_live`` WebSocket and hands every
+    other request to the wrapped Django app.
+
+    An open dashboard then costs one coroutine and one queue instead of a
+    WSGI worker thread for as long as the tab stays open.
+    """
+
+    streaming_views = ('host_stats', 'container_stats')
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'websocket':
+            return await self.websocket(scope, receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            try:
+                match = resolve(scope['path'])
+            except Resolver404:
+                match = None
+            if match is not None and match.url_name in self.streaming_views:
+                allowed = await sync_to_async(authorize)(build_request(scope), match.url_name, match.kwargs)
+                if allowed is not None:
+                    return await stream_stats(scope, receive, send, *allowed)
+        return await self.application(scope, receive, send)
+
+    async def websocket(self, scope, receive, send):
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            match = None
+        request = build_request(scope)
+        if match is not None and match.url_name == 'container_live' and same_origin(request):
+            allowed = await sync_to_async(authorize)(request, match.url_name, match.kwargs)
+            if allowed is not None:
+                return await live_channel(scope, receive, send, *allowed)
+        await send({'type': 'websocket.close', 'code': 4403})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.conf import settings
+from dockit.models import Container
+from dockit.utils import container_states
+
+BULK_ACTIONS = ('start', 'stop', 'restart', 'remove')
+
+
+def select_containers(user, container_ids=None, state=None, image=None):
+    """Containers ``user`` may act on, narrowed to ``container_ids`` and/or
+    the ``state`` ('running' or 'stopped') and ``image`` filters. ``user``
+    None means every container (management commands)."""
+    if user is None or user.is_superuser:
+        containers = Container.objects.all()
+    else:
+        containers = Container.objects.filter(user=user)
+    if container_ids:
+        containers = containers.filter(container_id__in=container_ids)
+    if image:
+        containers = containers.filter(image__name=image)
+    containers = list(containers.select_related('ip').distinct())
+    if state in ('running', 'stopped'):
+        states = container_states()
+        running = state == 'running'
+        containers = [
+            container for container in containers
+            if (states.get(container.container_id[:12]) or {'State': {'Running': False}})['State']['Running'] == running]
+    return containers
+
+
+def run_bulk_action(containers, action, parallelism=None):
+    """Run ``action`` on every container, ``parallelism`` Docker calls at a
+    time, and return ``{container_id: status_code}``; the status is None
+    when dockerd could not be reached. Removed containers give back their
+    IP and are deleted like ``delete_container`` does."""
+    if action not in BULK_ACTIONS:
+        raise ValueError('Unknown bulk action: %s' % action)
+    if not containers:
+        return {}
+    parallelism = parallelism or settings.BULK_ACTION_PARALLELISM
+
+    def call(container):
+        try:
+            return getattr(container, action)()
+        except requests.RequestException:
+            return None
+    with ThreadPoolExecutor(max_workers=min(parallelism, len(containers))) as executor:
+        status_codes = list(executor.map(call, containers))
+    results = {}
+    for container, status_code in zip(containers, status_codes):
+        results[container.container_id] = status_code
+        if action == 'remove' and status_code == 204:
+            container.ip.is_available = True
+            container.ip.save()
+            container.delete()
+    return results
@@ -0,0 +1,121 @@
+import time
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+
+class LRUCache(object):
+    """Thread-safe mapping bounded by ``maxsize`` entries.
+
+    The least recently used entry is evicted first. When ``ttl`` is set,
+    entries older than ``ttl`` seconds are treated as missing.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ImageCache(object):
+    """Image inspect data keyed by image ID, plus a ``name:tag`` index.
+
+    The size and creation date of an image never change for a given ID, so
+    entries have no TTL. Data is only dropped when the image is removed or
+    loses its last reference; the ref index is updated on pull, commit,
+    tag and untag.
+    """
+
+    def __init__(self):
+        self.images = {}
+        self.refs = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, ref):
+        with self.lock:
+            return self.images.get(self.refs.get(ref))
+
+    def get(self, image_id):
+        return self.images.get(image_id)
+
+    def put(self, image, refs=()):
+        with self.lock:
+            image = self.images.setdefault(image['Id'], image)
+            for ref in refs:
+                self.refs[ref] = image['Id']
+        return image
+
+    def tag(self, ref, image_id):
+        with self.lock:
+            self.refs[ref] = image_id
+
+    def retag(self, image_id, refs):
+        # replace every ref that points at image_id with refs
+        with self.lock:
+            for ref in [r for r, i in self.refs.items() if i == image_id and r not in refs]:
+                del self.refs[ref]
+            for ref in refs:
+                self.refs[ref] = image_id
+
+    def forget_ref(self, ref):
+        with self.lock:
+            image_id = self.refs.pop(ref, None)
+            if image_id is not None and image_id not in self.refs.values():
+                self.images.pop(image_id, None)
+
+    def evict(self, image_id):
+        with self.lock:
+            self.images.pop(image_id, None)
+            for ref in [r for r, i in self.refs.items() if i == image_id]:
+                del self.refs[ref]
+
+    def reset(self, images):
+        # rebuild the ref index from a full (image, refs) listing
+        with self.lock:
+            self.refs = {}
+            for image, refs in images:
+                image = self.images.setdefault(image['Id'], image)
+                for ref in refs:
+                    self.refs[ref] = image['Id']
+            live = set(self.refs.values())
+            for image_id in [i for i in self.images if i not in live]:
+                del self.images[image_id]
+
+
+# raw /containers/{id}/json results keyed by short container id
+inspect_cache = LRUCache(settings.DOCKER_INSPECT_CACHE_SIZE, settings.DOCKER_INSPECT_CACHE_TTL)
+
+# immutable image inspect data keyed by image ID
+image_cache = ImageCache()
@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+import requests
+from django.db import transaction, DatabaseError, IntegrityError, OperationalError
+from dockit.client import get_client
+from dockit.models import CatalogImage
+from dockit.mirror import IMAGE_REFRESH_ACTIONS, get_mirror
+
+logger = logging.getLogger(__name__)
+
+# the mirror thread and request threads sync one at a time
+_sync_lock = threading.Lock()
+
+
+def catalog_rows(images):
+    # (name, tag) -> (image id, size, created) for every tagged image
+    rows = {}
+    for image in images:
+        created = datetime.fromtimestamp(image['Created'], timezone.utc)
+        for ref in image.get('RepoTags') or []:
+            if ref != '<none>:<none>':
+                name, tag = ref.rsplit(':', 1)
+                rows[(name, tag)] = (image['Id'], image['Size'], created)
+    return rows
+
+
+def sync_image_catalog(images=None, attempts=3):
+    """Bring ``CatalogImage`` in line with one ``/images/json`` listing, in
+    one transaction. Returns the number of rows created, updated and
+    deleted.
+
+    Syncs in one process run one at a time. A sync that collides with one
+    in another process, such as a celery worker (a locked sqlite database,
+    or a row the other sync inserted first), is retried up to ``attempts``
+    times against a fresh listing.
+    """
+    with _sync_lock:
+        for attempt in range(attempts):
+            try:
+                return apply_catalog(get_client().get('/images/json').json() if images is None else images)
+            except (IntegrityError, OperationalError) as e:
+                if attempt == attempts - 1:
+                    raise
+                logger.info('image catalog sync collided, retrying: %s', e)
+                time.sleep(0.1 * (attempt + 1))
+
+
+def apply_catalog(images):
+    rows = catalog_rows(images)
+    with transaction.atomic():
+        existing = dict(((row.name, row.tag), row) for row in CatalogImage.objects.select_for_update())
+        CatalogImage.objects.bulk_create([
+            CatalogImage(name=name, tag=tag, image_id=image_id, size=size, created=created)
+            for (name, tag), (image_id, size, created) in rows.items() if (name, tag) not in existing])
+        updated = 0
+        for key, row in existing.items():
+            if key in rows and (row.image_id, row.size, row.created) != rows[key]:
+                image_id, size, created = rows[key]
+                CatalogImage.objects.filter(pk=row.pk).update(image_id=image_id, size=size, created=created)
+                updated += 1
+        gone = [row.pk for key, row in existing.items() if key not in rows]
+        CatalogImage.objects.filter(pk__in=gone).delete()
+    return len([key for key in rows if key not in existing]), updated, len(gone)
+
+
+def ensure_image_catalog():
+    """Sync the catalog now unless the mirror is following Docker events
+    and has filled it already. When Docker or the database cannot be
+    reached the catalog is left as it is."""
+    if get_mirror().synced.is_set() and CatalogImage.objects.exists():
+        return
+    try:
+        sync_image_catalog()
+    except (requests.RequestException, DatabaseError) as e:
+        logger.warning('image catalog sync failed: %r', e)
+
+
+def sync_on_event(event_type, event):
+    # DockerMirror listener: resync after every mirror resync and image change
+    if event_type == 'resync' or (event_type == 'image' and (
+            event.get('Action') or event.get('status')) in IMAGE_REFRESH_ACTIONS + ('delete',)):
+        sync_image_catalog()
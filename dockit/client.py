@@ -0,0 +1,120 @@
+import socket
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from django.conf import settings
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        self.socket_path = kwargs.pop('socket_path')
+        super(UnixHTTPConnection, self).__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = UnixHTTPConnection
+
+
+class UnixAdapter(HTTPAdapter):
+    """Transport adapter that sends every request over a unix socket."""
+
+    def __init__(self, socket_path, pool_size, block=True):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.block = block
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        super(UnixAdapter, self).__init__()
+
+    def get_connection(self, url, proxies=None):
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = UnixHTTPConnectionPool(
+                    'localhost', maxsize=self.pool_size, block=self.block, socket_path=self.socket_path)
+            return self.pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self.get_connection(request.url, proxies)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        super(UnixAdapter, self).close()
+
+
+class DockerClient(object):
+    """Keep-alive client for the Docker Engine API.
+
+    A single ``requests.Session`` backed by a bounded urllib3 connection pool
+    is shared by every caller, so repeated calls reuse open connections
+    instead of paying TCP setup and teardown each time. The pool is
+    thread-safe; ``pool_block`` makes callers wait for a free connection
+    rather than opening more than ``pool_size`` at once. Long-lived streams
+    (events, stats, pulls) go through ``stream()``, which uses a separate
+    non-blocking pool so they never starve regular calls.
+
+    ``transport`` is either ``'unix'`` (talk to ``DOCKER_SOCKET_PATH``) or
+    ``'tcp'`` (talk to ``localhost:DOCKER_API_PORT``).
+    """
+
+    def __init__(self, transport=None, base_url=None, socket_path=None, pool_size=None, timeout=None):
+        self.transport = transport or settings.DOCKER_API_TRANSPORT
+        self.pool_size = pool_size or settings.DOCKER_API_POOL_SIZE
+        self.timeout = timeout or (settings.DOCKER_API_CONNECT_TIMEOUT, settings.DOCKER_API_READ_TIMEOUT)
+        self.session = requests.Session()
+        self.stream_session = requests.Session()
+        if self.transport == 'unix':
+            self.socket_path = socket_path or settings.DOCKER_SOCKET_PATH
+            self.base_url = 'http+unix://localhost'
+            self.session.mount('http+unix://', UnixAdapter(self.socket_path, self.pool_size))
+            self.stream_session.mount('http+unix://', UnixAdapter(self.socket_path, self.pool_size, block=False))
+        elif self.transport == 'tcp':
+            self.base_url = base_url or 'http://localhost:' + settings.DOCKER_API_PORT
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+            self.session.mount('http://', adapter)
+            self.stream_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+        else:
+            raise ValueError('Unknown docker transport: %s' % self.transport)
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, self.base_url + path, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def stream(self, method, path, **kwargs):
+        # no read timeout by default: streams may stay quiet for a long time
+        kwargs.setdefault('timeout', (self.timeout[0] if isinstance(self.timeout, tuple) else self.timeout, None))
+        return self.stream_session.request(method, self.base_url + path, stream=True, **kwargs)
+
+    def close(self):
+        self.session.close()
+        self.stream_session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = DockerClient()
+    return _client
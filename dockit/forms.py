@@ -1,8 +1,8 @@
-from random import sample as random_sample
 from psutil import cpu_count
 from django import forms
 from dockit.models import User, IP, Container
 from .utils import DHost
+from .placement import PLACEMENT_POLICIES, place_cores
 
 
 class UserForm(forms.ModelForm):
@@ -44,7 +44,8 @@ class IPForm(forms.ModelForm):
 
 class ContainerForm(forms.ModelForm):
     ram = forms.IntegerField(required=False)
-    cores = forms.IntegerField(required=False)
+    cores = forms.IntegerField(required=False, min_value=0)
+    placement = forms.ChoiceField(choices=[(policy, policy) for policy in PLACEMENT_POLICIES], required=False)
     class Meta:
         model = Container
         fields = ('hostname', 'ip', 'image')
@@ -61,10 +62,13 @@ class ContainerForm(forms.ModelForm):
         ram = self.cleaned_data.get('ram', None)
         cores = self.cleaned_data.get('cores', None)
 
-        if cores:
-            cores = random_sample(range(0, cpu_count()), cores)
-            cores = ','.join(map(str, cores))
-            self.cleaned_data['cores'] = cores
+        self.placement = None
+        if cores and cores > cpu_count():
+            raise forms.ValidationError("Only %d cores available" % cpu_count())
+        if cores and 'edit_field' not in self.data:
+            # only a new container is placed; an edit leaves its cpuset alone
+            self.placement = place_cores(cores, self.cleaned_data.get('placement'))
+            self.cleaned_data['cores'] = self.placement.cores
         else:
             cores = cpu_count()
             cores = str(list(range(0, cores))).strip('[]').replace(" ", "")
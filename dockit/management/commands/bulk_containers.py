@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from dockit.bulk import BULK_ACTIONS, select_containers, run_bulk_action
+
+
+class Command(BaseCommand):
+    help = 'Start, stop, restart or remove many containers at once, e.g. to drain a host.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=BULK_ACTIONS)
+        parser.add_argument('container_id', nargs='*', type=str)
+        parser.add_argument('--state', choices=['running', 'stopped'], help='only containers in this state')
+        parser.add_argument('--image', help='only containers launched from this image')
+        parser.add_argument('--all', action='store_true', help='every container, when no id or filter is given')
+        parser.add_argument('--parallelism', type=int, help='Docker calls in flight at once')
+
+    def handle(self, *args, **options):
+        container_ids = options['container_id']
+        if not (container_ids or options['state'] or options['image'] or options['all']):
+            raise CommandError('Give container ids, --state, --image or --all.')
+        containers = select_containers(None, container_ids, options['state'], options['image'])
+        results = run_bulk_action(containers, options['action'], options['parallelism'])
+        for container_id, status_code in sorted(results.items()):
+            self.stdout.write('%s %s' % (container_id, status_code))
+        for container_id in container_ids:
+            if container_id not in results:
+                self.stderr.write('%s not found' % container_id)
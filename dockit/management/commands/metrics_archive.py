@@ -0,0 +1,55 @@
+import time
+from datetime import datetime
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from dockit.archive import MetricsArchive, series_key
+from dockit.metrics import fields_for, live_containers
+
+
+def when(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else '-'
+
+
+class Command(BaseCommand):
+    help = 'List, show or compact the on-disk metrics archives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'show', 'compact'])
+        parser.add_argument('series', nargs='*', type=str,
+                            help='e.g. host or container-<short id>; all series when omitted')
+        parser.add_argument('--since', type=int, default=3600, help='seconds of history to show')
+        parser.add_argument('--keep-removed', action='store_true',
+                            help='compact, rather than delete, the series of containers that no longer exist')
+
+    def handle(self, *args, **options):
+        if not settings.METRICS_ARCHIVE_DIR:
+            raise CommandError('METRICS_ARCHIVE_DIR is not set; metrics are kept in memory only')
+        try:
+            archive = MetricsArchive()
+        except OSError as e:
+            raise CommandError(e)
+        keys = [series_key(name + '.metrics') for name in options['series']] or archive.keys()
+        if options['action'] == 'list':
+            for key in keys:
+                info = archive.series(key, fields_for(key)).info()
+                self.stdout.write('%-24s %8d records %10d bytes  %s .. %s' % (
+                    '-'.join(key), info['records'], info['bytes'], when(info['first']), when(info['last'])))
+        elif options['action'] == 'show':
+            now = time.time()
+            for key in keys:
+                fields = fields_for(key)
+                rows = archive.query(key, fields, now - options['since'], now)
+                self.stdout.write('%s (step %ss)' % ('-'.join(key), rows['step']))
+                self.stdout.write('  '.join(['time'.ljust(19)] + [field.rjust(10) for field in fields]))
+                for index, timestamp in enumerate(rows['time']):
+                    self.stdout.write('  '.join([when(timestamp)] + ['%10.2f' % rows[field][index] for field in fields]))
+        else:
+            live = None
+            if not options['keep_removed']:
+                try:
+                    live = live_containers()
+                except (requests.RequestException, ValueError) as e:
+                    raise CommandError('Cannot list containers (%s); use --keep-removed' % e)
+            for key, before, after in archive.compact(fields_for, live, keys=keys):
+                self.stdout.write('%s: %d -> %d records' % ('-'.join(key), before, after))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from dockit.catalog import sync_image_catalog
+
+
+class Command(BaseCommand):
+    help = 'Refresh the local image catalog from one /images/json call.'
+
+    def handle(self, *args, **options):
+        created, updated, deleted = sync_image_catalog()
+        self.stdout.write('%d created, %d updated, %d deleted' % (created, updated, deleted))
@@ -0,0 +1,169 @@
+import time
+import threading
+from array import array
+from collections import OrderedDict
+from django.conf import settings
+from dockit.archive import get_metrics_archive
+from dockit.utils import container_states
+
+HOST_FIELDS = ('cpu', 'memory', 'memTotal', 'netDow', 'netUp', 'diskUsed')
+CONTAINER_FIELDS = ('cpu', 'memory', 'memTotal', 'netDow', 'netUp')
+
+
+def fields_for(key):
+    return HOST_FIELDS if key[0] == 'host' else CONTAINER_FIELDS
+
+
+def live_containers():
+    # short ids of every container Docker still has
+    return set(container_states())
+
+
+def host_values(sample):
+    return {
+        'cpu': sample['cpu'],
+        'memory': sample['memory'],
+        'memTotal': sample['memTotal'],
+        'netDow': sum(sample['net_stats_down'].values()),
+        'netUp': sum(sample['net_stats_up'].values()),
+        'diskUsed': sample['disk']['Used'],
+    }
+
+
+def container_values(sample):
+    return dict((field, sample[field]) for field in CONTAINER_FIELDS)
+
+
+class RoundRobinArchive(object):
+    """Fixed-size ring of ``slots`` buckets, each ``step`` seconds wide.
+
+    Samples falling into the same bucket are averaged. A bucket is reused
+    once its slot comes round again, so memory stays constant and every
+    append is O(1).
+    """
+
+    def __init__(self, step, slots, fields):
+        self.step = step
+        self.slots = slots
+        self.fields = fields
+        self.starts = array('d', [0.0]) * slots
+        self.counts = array('L', [0]) * slots
+        self.values = dict((field, array('d', [0.0]) * slots) for field in fields)
+
+    def add(self, timestamp, values):
+        bucket = int(timestamp // self.step)
+        index = bucket % self.slots
+        start = float(bucket * self.step)
+        if self.starts[index] != start:
+            self.starts[index] = start
+            self.counts[index] = 0
+        count = self.counts[index]
+        for field in self.fields:
+            column = self.values[field]
+            column[index] = (column[index] * count + values[field]) / (count + 1) if count else values[field]
+        self.counts[index] = count + 1
+
+    def covers(self, start, now):
+        return start >= now - self.step * self.slots
+
+    def range(self, start, end):
+        first = int(start // self.step)
+        last = int(end // self.step)
+        if last - first >= self.slots:
+            first = last - self.slots + 1
+        rows = {'time': []}
+        rows.update((field, []) for field in self.fields)
+        for bucket in range(first, last + 1):
+            index = bucket % self.slots
+            if self.counts[index] and self.starts[index] == bucket * self.step:
+                rows['time'].append(self.starts[index])
+                for field in self.fields:
+                    rows[field].append(round(self.values[field][index], 2))
+        return rows
+
+
+class MetricsStore(object):
+    """Downsampled host and container history held in round-robin tiers.
+
+    Every series keeps one archive per ``(step, slots)`` tier, e.g. one
+    second resolution for ten minutes, one minute for a day and one hour
+    for a month. Range queries are answered from the finest tier that
+    still covers the start of the range. The number of container series is
+    bounded; the least recently fed one is dropped first.
+
+    Every sample is also handed to the on-disk ``archive``. Ranges that
+    reach back before this process started feeding a series are read from
+    there, so history survives restarts.
+    """
+
+    def __init__(self, tiers=None, max_series=None, archive=None, points=None):
+        self.tiers = tiers or settings.METRICS_TIERS
+        self.max_series = max_series or settings.METRICS_MAX_SERIES
+        self.archive = archive if archive is not None else get_metrics_archive()
+        self.points = points or settings.METRICS_HISTORY_POINTS
+        self.series = OrderedDict()
+        self.since = {}
+        self.lock = threading.Lock()
+
+    def record(self, key, sample):
+        if key[0] == 'host':
+            fields, values = HOST_FIELDS, host_values(sample)
+        else:
+            fields, values = CONTAINER_FIELDS, container_values(sample)
+        with self.lock:
+            archives = self.series.get(key)
+            if archives is None:
+                archives = self.series[key] = [RoundRobinArchive(step, slots, fields) for step, slots in self.tiers]
+                self.since[key] = sample['time']
+                while len(self.series) > self.max_series:
+                    self.since.pop(self.series.popitem(last=False)[0], None)
+            self.series.move_to_end(key)
+            for archive in archives:
+                archive.add(sample['time'], values)
+        if self.archive is not None:
+            self.archive.add(key, fields, sample['time'], values)
+
+    def history(self, key, start, end=None):
+        now = time.time()
+        end = end or now
+        with self.lock:
+            archives = self.series.get(key)
+            fed_since = self.since.get(key)
+        if archives is not None and fed_since <= start + archives[0].step:
+            return self.recent(archives, start, end, now)
+        if self.archive is not None:
+            rows = self.archive.query(key, fields_for(key), start, end, step=(end - start) / self.points)
+            if rows['time']:
+                return rows
+        if archives is None:
+            return None
+        return self.recent(archives, start, end, now)
+
+    def recent(self, archives, start, end, now):
+        with self.lock:
+            for archive in archives:
+                if archive.covers(start, now):
+                    break
+            rows = archive.range(start, end)
+        rows['step'] = archive.step
+        return rows
+
+    def forget(self, key):
+        with self.lock:
+            self.series.pop(key, None)
+            self.since.pop(key, None)
+
+
+_metrics_store = None
+_metrics_store_lock = threading.Lock()
+
+
+def get_metrics_store():
+    global _metrics_store
+    if _metrics_store is None:
+        with _metrics_store_lock:
+            if _metrics_store is None:
+                _metrics_store = MetricsStore()
+                if _metrics_store.archive is not None:
+                    _metrics_store.archive.start_compactor(fields_for, live_containers)
+    return _metrics_store
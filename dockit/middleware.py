@@ -0,0 +1,15 @@
+from django.utils.deprecation import MiddlewareMixin
+from dockit.utils import request_store
+
+
+class RequestStoreMiddleware(MiddlewareMixin):
+    """Give each request a fresh store for memoized Docker state."""
+
+    def process_request(self, request):
+        request_store.containers = {}
+        request_store.pending = set()
+
+    def process_response(self, request, response):
+        request_store.containers = None
+        request_store.pending = None
+        return response
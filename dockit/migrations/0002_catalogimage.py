@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 15:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dockit', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('tag', models.CharField(max_length=200)),
+                ('image_id', models.CharField(db_index=True, max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('created', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='catalogimage',
+            unique_together=set([('name', 'tag')]),
+        ),
+    ]
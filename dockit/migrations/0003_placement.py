@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 15:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dockit', '0002_catalogimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Placement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('policy', models.CharField(max_length=10)),
+                ('requested', models.PositiveIntegerField()),
+                ('cores', models.CharField(max_length=200)),
+                ('load', models.TextField()),
+                ('pinned', models.TextField()),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('container', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='placements', to='dockit.Container')),
+            ],
+        ),
+    ]
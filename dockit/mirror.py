@@ -0,0 +1,227 @@
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.conf import settings
+from dockit.client import get_client
+from dockit.cache import inspect_cache, image_cache
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_REFRESH_ACTIONS = ('create', 'start', 'restart', 'stop', 'die', 'kill', 'pause', 'unpause',
+                             'oom', 'update', 'rename')
+IMAGE_REFRESH_ACTIONS = ('pull', 'tag', 'untag', 'import', 'load', 'commit')
+
+
+def iso_from_epoch(epoch):
+    return datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def compact_container(inspect):
+    # the subset of an inspect result the views and template tags read
+    return {
+        'Id': inspect['Id'],
+        'Name': inspect.get('Name', ''),
+        'Created': inspect['Created'],
+        'State': {'Status': inspect['State']['Status'], 'Running': inspect['State']['Running']},
+        'HostConfig': {
+            'Memory': inspect['HostConfig']['Memory'],
+            'CpusetCpus': inspect['HostConfig']['CpusetCpus'],
+        },
+        'NetworkSettings': {'Networks': dict(
+            (name, {'IPAddress': network['IPAddress']})
+            for name, network in inspect['NetworkSettings']['Networks'].items())},
+    }
+
+
+def compact_summary(summary):
+    # a /containers/json entry has no HostConfig limits; those are filled in
+    # later from a full inspect.
+    running = summary['State'] == 'running' if 'State' in summary else summary['Status'].startswith('Up')
+    names = summary.get('Names') or ['']
+    return {
+        'Id': summary['Id'],
+        'Name': names[0],
+        'Created': iso_from_epoch(summary['Created']),
+        'State': {'Status': 'running' if running else 'exited', 'Running': running},
+        'HostConfig': None,
+        'NetworkSettings': {'Networks': dict(
+            (name, {'IPAddress': network['IPAddress']})
+            for name, network in summary['NetworkSettings']['Networks'].items())},
+    }
+
+
+def compact_image(image):
+    # RepoTags change over an image's life, so they live in the image_cache
+    # ref index rather than in the data itself.
+    created = image['Created']
+    return {
+        'Id': image['Id'],
+        'Size': image['Size'],
+        'Created': iso_from_epoch(created) if isinstance(created, int) else created,
+    }
+
+
+class DockerMirror(object):
+    """In-process, id-indexed mirror of Docker container and image state.
+
+    A background thread seeds the mirror from one ``/containers/json`` and one
+    ``/images/json`` call, fills in the container limits that only a full
+    inspect has, and then follows ``/events`` to keep entries current. When
+    the event stream drops, the thread resyncs from the list calls and
+    reconnects. Readers get ``None`` until the first sync has finished and
+    fall back to a live inspect. Image state is kept in ``image_cache``.
+    """
+
+    def __init__(self, client=None, retry_interval=None, idle_resync=None):
+        self.client = client or get_client()
+        self.retry_interval = retry_interval or settings.DOCKER_MIRROR_RETRY_INTERVAL
+        self.idle_resync = idle_resync or settings.DOCKER_MIRROR_IDLE_RESYNC
+        self.containers = {}
+        self.lock = threading.RLock()
+        self.synced = threading.Event()
+        self.stopped = threading.Event()
+        self.listeners = []
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='docker-mirror')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                since = self.resync()
+                self.follow(since)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                logger.warning('docker event stream dropped: %s', e)
+            except Exception:
+                logger.exception('docker mirror failed, resyncing')
+            finally:
+                # never serve state that stopped following the events
+                self.synced.clear()
+            self.stopped.wait(self.retry_interval)
+
+    def resync(self):
+        since = int(time.time())
+        summaries = self.client.get('/containers/json', params={'all': 1}).json()
+        images = self.client.get('/images/json').json()
+        with self.lock:
+            previous = self.containers
+            self.containers = {}
+            for summary in summaries:
+                state = compact_summary(summary)
+                known = previous.get(summary['Id'][:12])
+                if known is not None and known['Id'] == state['Id']:
+                    state['HostConfig'] = known['HostConfig']
+                self.containers[summary['Id'][:12]] = state
+        image_cache.reset((compact_image(image), image.get('RepoTags') or []) for image in images)
+        unknown = [state['Id'] for state in list(self.containers.values()) if state['HostConfig'] is None]
+        if unknown:
+            with ThreadPoolExecutor(max_workers=min(settings.DOCKER_API_POOL_SIZE, len(unknown))) as executor:
+                list(executor.map(self.refresh_container, unknown))
+        self.synced.set()
+        self.notify('resync', None)
+        return since
+
+    def follow(self, since):
+        response = self.client.stream('GET', '/events', params={'since': since},
+                                      timeout=(settings.DOCKER_API_CONNECT_TIMEOUT, self.idle_resync))
+        try:
+            for line in response.iter_lines():
+                if self.stopped.is_set():
+                    return
+                if line:
+                    self.apply_event(json.loads(line.decode('utf-8')))
+        finally:
+            response.close()
+
+    def apply_event(self, event):
+        event_type = event.get('Type')
+        action = event.get('Action') or event.get('status', '')
+        actor_id = event.get('Actor', {}).get('ID') or event.get('id')
+        if event_type == 'container':
+            inspect_cache.invalidate(actor_id[:12])
+            if action == 'destroy':
+                self.forget_container(actor_id)
+            elif action.split(':')[0] in CONTAINER_REFRESH_ACTIONS:
+                self.refresh_container(actor_id)
+        elif event_type == 'network' and action in ('connect', 'disconnect'):
+            self.refresh_container(event['Actor']['Attributes']['container'])
+        elif event_type == 'image':
+            if action == 'delete':
+                image_cache.evict(actor_id)
+            elif action in IMAGE_REFRESH_ACTIONS:
+                self.refresh_image(actor_id)
+        self.notify(event_type, event)
+
+    def notify(self, event_type, event):
+        for listener in self.listeners:
+            try:
+                listener(event_type, event)
+            except Exception:
+                logger.exception('docker mirror listener failed')
+
+    def refresh_container(self, container_id):
+        response = self.client.get('/containers/%s/json' % container_id)
+        if response.status_code == 404:
+            self.forget_container(container_id)
+        elif response.status_code == 200:
+            self.put_container(compact_container(response.json()))
+
+    def refresh_image(self, image_id):
+        response = self.client.get('/images/%s/json' % image_id.replace('/', '%2F'))
+        if response.status_code == 200:
+            image = response.json()
+            image_cache.put(compact_image(image))
+            image_cache.retag(image['Id'], image.get('RepoTags') or [])
+
+    def put_container(self, state):
+        with self.lock:
+            self.containers[state['Id'][:12]] = state
+        return state
+
+    def forget_container(self, container_id):
+        with self.lock:
+            self.containers.pop(container_id[:12], None)
+
+    def container(self, container_id):
+        if not self.synced.is_set():
+            return None
+        state = self.containers.get(container_id[:12])
+        if state is None or state['HostConfig'] is None:
+            return None
+        return state
+
+    def container_states(self):
+        if not self.synced.is_set():
+            return None
+        with self.lock:
+            return dict(self.containers)
+
+
+# called with (event_type, event) by every mirror get_mirror() creates
+mirror_listeners = []
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_mirror():
+    global _mirror
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None:
+                _mirror = DockerMirror()
+                _mirror.listeners.extend(mirror_listeners)
+                if settings.DOCKER_MIRROR_ENABLED:
+                    _mirror.start()
+    return _mirror
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, UserManager, PermissionsMixin
 from dockit.utils import ImageMixin, ContainerMixin
@@ -75,8 +76,14 @@ class Image(models.Model, ImageMixin):
 
 class ContainerManager(models.Manager):
     def get_container(self, container_id, user):
+        # rows hold the 12-character ids of older launches or the full ids
+        # run_container returns; a url may carry either form
         try:
-            container = Container.objects.get(container_id=container_id)
+            if len(container_id) < 12:
+                raise ObjectDoesNotExist
+            container = Container.objects.filter(
+                Q(container_id=container_id) | Q(container_id=container_id[:12]) |
+                Q(container_id__startswith=container_id)).earliest('pk')
             if user == container.user or user.is_superuser:
                 return container
             else:
@@ -95,3 +102,39 @@ class Container(models.Model, ContainerMixin):
 
     def __str__(self):
         return self.container_id
+
+
+class CatalogImage(models.Model):
+    """A local image tag as ``/images/json`` lists it; kept in step with
+    dockerd by ``dockit.catalog``, so pages can show images without
+    asking Docker."""
+    name = models.CharField(max_length=200)
+    tag = models.CharField(max_length=200)
+    image_id = models.CharField(max_length=100, db_index=True)
+    size = models.BigIntegerField()
+    created = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('name', 'tag')
+
+    def __str__(self):
+        return '%s:%s' % (self.name, self.tag)
+
+    @property
+    def size_mb(self):
+        return self.size / 1000000
+
+
+class Placement(models.Model):
+    """A cpuset chosen by ``dockit.placement`` for a launched container,
+    with the per-core load and pin counts it was chosen from."""
+    container = models.ForeignKey(Container, models.SET_NULL, blank=True, null=True, related_name='placements')
+    policy = models.CharField(max_length=10)
+    requested = models.PositiveIntegerField()
+    cores = models.CharField(max_length=200)
+    load = models.TextField()
+    pinned = models.TextField()
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return '%s %s' % (self.policy, self.cores)
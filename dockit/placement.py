@@ -0,0 +1,80 @@
+import json
+import time
+from collections import Counter
+import psutil
+from django.conf import settings
+from dockit.models import Container, Placement
+from dockit.stats import get_host_sampler
+from dockit.utils import inspect_states
+
+PLACEMENT_POLICIES = ('spread', 'pack')
+
+
+def parse_cpuset(cpuset):
+    # '0-2,5' -> [0, 1, 2, 5]; an empty cpuset means no pinning
+    cores = []
+    for part in (cpuset or '').split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cores.extend(range(int(first), int(last) + 1))
+        elif part.strip():
+            cores.append(int(part))
+    return cores
+
+
+def pinned_cores():
+    # core -> number of dbox containers whose cpuset includes it
+    states = inspect_states(Container.objects.values_list('container_id', flat=True))
+    pinned = Counter()
+    for state in states.values():
+        pinned.update(parse_cpuset(state['HostConfig']['CpusetCpus']))
+    return pinned
+
+
+def recent_core_load(window=None):
+    """Per-core utilization in percent, averaged over the host samples of
+    the last ``window`` seconds, or zero for every core when there are
+    none yet."""
+    window = window or settings.PLACEMENT_LOAD_WINDOW
+    since = time.time() - window
+    samples = [sample['cpus'] for sample in get_host_sampler().history() if sample['time'] >= since]
+    if not samples:
+        # measuring here would block the request, and psutil's baseline is
+        # shared with the host sampler; pins alone decide until it samples
+        return [0.] * psutil.cpu_count()
+    return [sum(column) / len(samples) for column in zip(*samples)]
+
+
+def choose_cores(count, load, pinned, policy=None):
+    """Pick ``count`` of the ``len(load)`` cores.
+
+    Each core is scored by its recent load plus ``PLACEMENT_PIN_WEIGHT``
+    for every container already pinned to it. ``spread`` takes the lowest
+    scores. ``pack`` first fills pinned cores still scoring under
+    ``PLACEMENT_PACK_THRESHOLD``, busiest first, to keep the other cores
+    free for later containers, then takes the lowest scores.
+    """
+    policy = policy or settings.PLACEMENT_POLICY
+    if policy not in PLACEMENT_POLICIES:
+        raise ValueError('unknown placement policy %r' % policy)
+    if not 0 < count <= len(load):
+        raise ValueError('cannot place %d cores on %d' % (count, len(load)))
+    scores = [load[core] + settings.PLACEMENT_PIN_WEIGHT * pinned.get(core, 0) for core in range(len(load))]
+    order = sorted(range(len(load)), key=lambda core: (scores[core], core))
+    if policy == 'pack':
+        shared = [core for core in order if pinned.get(core) and scores[core] < settings.PLACEMENT_PACK_THRESHOLD]
+        order = shared[::-1] + [core for core in order if core not in shared]
+    return sorted(order[:count])
+
+
+def place_cores(count, policy=None):
+    """Choose a cpuset of ``count`` cores for a new container from the
+    current pins and recent load. Returns an unsaved ``Placement`` to be
+    saved once the container exists."""
+    policy = policy or settings.PLACEMENT_POLICY
+    load = recent_core_load()
+    pinned = pinned_cores()
+    cores = choose_cores(count, load, pinned, policy)
+    return Placement(policy=policy, requested=count, cores=','.join(map(str, cores)),
+                     load=json.dumps([round(value, 1) for value in load]),
+                     pinned=json.dumps([pinned.get(core, 0) for core in range(len(load))]))
@@ -0,0 +1,150 @@
+import json
+import time
+import logging
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+from dockit.client import get_client
+from dockit.models import User, Image
+from dockit.utils import refresh_image
+from dockit.catalog import sync_image_catalog
+
+logger = logging.getLogger(__name__)
+
+
+def pull_cache():
+    return caches[settings.PULL_PROGRESS_CACHE]
+
+
+def get_pull_progress(ref):
+    return pull_cache().get('pull:' + ref)
+
+
+def set_pull_progress(ref, progress):
+    pull_cache().set('pull:' + ref, progress, settings.PULL_PROGRESS_TTL)
+
+
+def begin_pull(ref, user_id):
+    # cache.add only succeeds for the first of concurrent callers
+    return pull_cache().add('pull-flight:' + ref, user_id, settings.PULL_LOCK_TTL)
+
+
+def hold_pull(ref, user_id, slot=None):
+    # keep the in-flight key, and the slot once there is one, from expiring
+    pull_cache().set('pull-flight:' + ref, user_id, settings.PULL_LOCK_TTL)
+    if slot is not None:
+        pull_cache().set('pull-slot:%d' % slot, True, settings.PULL_LOCK_TTL)
+
+
+def end_pull(ref):
+    pull_cache().delete('pull-flight:' + ref)
+
+
+def acquire_pull_slot():
+    # one of PULL_CONCURRENCY slots, or None when that many pulls are running
+    for slot in range(settings.PULL_CONCURRENCY):
+        if pull_cache().add('pull-slot:%d' % slot, True, settings.PULL_LOCK_TTL):
+            return slot
+    return None
+
+
+def release_pull_slot(slot):
+    pull_cache().delete('pull-slot:%d' % slot)
+
+
+class PullProgress(object):
+    """Folds the JSON lines of an ``/images/create`` stream into per-layer
+    progress.
+
+    ``snapshot()`` gives the state a poll returns: the pull ``status``
+    (``pulling``, ``done`` or ``error``), the last status ``message``, the
+    overall ``progress`` in percent over the layers whose size is known so
+    far, and each layer's ``status``, ``current`` and ``total`` bytes.
+    """
+
+    def __init__(self, name, tag):
+        self.name = name
+        self.tag = tag
+        self.status = 'pulling'
+        self.message = ''
+        self.layers = {}
+
+    def feed(self, output):
+        if 'error' in output:
+            self.status = 'error'
+            self.message = output['error']
+            return
+        self.message = output.get('status', '')
+        if 'id' not in output or output['id'] == self.tag:
+            return
+        layer = self.layers.setdefault(output['id'], {'status': '', 'current': 0, 'total': 0})
+        layer['status'] = self.message
+        detail = output.get('progressDetail') or {}
+        if self.message == 'Downloading' and detail.get('total'):
+            layer['current'], layer['total'] = detail.get('current', 0), detail['total']
+        elif self.message in ('Download complete', 'Pull complete', 'Already exists') and layer['total']:
+            layer['current'] = layer['total']
+
+    def progress(self):
+        total = sum(layer['total'] for layer in self.layers.values())
+        if self.status == 'done':
+            return 100
+        return int(sum(layer['current'] for layer in self.layers.values()) * 100 / total) if total else 0
+
+    def snapshot(self):
+        return {'status': self.status, 'image': '%s:%s' % (self.name, self.tag), 'message': self.message,
+                'progress': self.progress(), 'layers': self.layers}
+
+
+def run_pull(name, tag='latest', user_id=None, interval=None, slot=None):
+    """Pull ``name:tag``, publishing progress at most every ``interval``
+    seconds, register the image for ``user_id`` when it succeeds, then
+    publish and return the final snapshot. The final snapshot is published
+    even when registering the image fails, so pollers never wait on a pull
+    that is over.
+
+    Every progress update also refreshes the pull's in-flight key and its
+    concurrency ``slot``; both are released when the pull ends."""
+    interval = settings.PULL_PROGRESS_INTERVAL if interval is None else interval
+    ref = '%s:%s' % (name, tag)
+    progress = PullProgress(name, tag)
+    published = time.monotonic()
+    try:
+        response = get_client().stream('POST', '/images/create', params={'fromImage': name, 'tag': tag})
+        try:
+            if response.status_code != 200:
+                progress.feed({'error': response.json().get('message', 'pull failed')})
+            else:
+                for line in response.iter_lines():
+                    if line:
+                        progress.feed(json.loads(line.decode('utf-8')))
+                    if time.monotonic() - published >= interval:
+                        set_pull_progress(ref, progress.snapshot())
+                        hold_pull(ref, user_id, slot)
+                        published = time.monotonic()
+        finally:
+            response.close()
+        if progress.status != 'error':
+            if user_id is not None and not Image.objects.filter(name=name, tag=tag, is_snapshot=False).exists():
+                # one row per name:tag, owned by whoever asked first; snapshot
+                # rows of the same name are container backups, not pulls
+                Image.objects.create(name=name, tag=tag, user=User.objects.get(pk=user_id))
+            refresh_image(name, tag)
+            try:
+                sync_image_catalog()
+            except (requests.RequestException, DatabaseError) as e:
+                # the image is there; the mirror syncs the catalog on its pull event
+                logger.warning('image catalog sync after pulling %s failed: %r', ref, e)
+            progress.status = 'done'
+    except requests.RequestException as e:
+        progress.feed({'error': str(e)})
+    except Exception as e:
+        progress.feed({'error': 'pull failed: %s' % e})
+        raise
+    finally:
+        set_pull_progress(ref, progress.snapshot())
+        if slot is not None:
+            release_pull_slot(slot)
+        end_pull(ref)
+    return progress.snapshot()
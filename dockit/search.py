@@ -0,0 +1,140 @@
+import bisect
+import threading
+import time
+import requests
+from django.conf import settings
+from dockit.cache import LRUCache
+from dockit.client import get_client
+from dockit.models import CatalogImage
+
+
+class SearchIndex(object):
+    """Repository names seen in search results or in the image catalog,
+    sorted for prefix lookups, each with the last result record seen for
+    it."""
+
+    def __init__(self):
+        self.names = []
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def add(self, records):
+        with self.lock:
+            for record in records:
+                if record['name'] not in self.records:
+                    bisect.insort(self.names, record['name'])
+                self.records[record['name']] = record
+
+    def prefix(self, term):
+        with self.lock:
+            start = bisect.bisect_left(self.names, term)
+            end = bisect.bisect_left(self.names, term + '\uffff')
+            return [self.records[name] for name in self.names[start:end]]
+
+
+def matches(record, term):
+    # what /images/search matches on: the name or the description
+    return term in record['name'].lower() or term in (record.get('description') or '').lower()
+
+
+class RegistrySearch(object):
+    """Cache in front of ``/images/search``.
+
+    Results are kept per term for ``ttl`` seconds, then served stale for up
+    to ``stale_ttl`` while one background request refreshes them. A term
+    that extends a cached term whose results were complete (fewer than
+    ``limit``) is answered by filtering those results, without asking the
+    registry. Concurrent searches for the same term share one request.
+    When the registry cannot be reached, names from the index that start
+    with the term are returned instead.
+    """
+
+    def __init__(self, client=None, maxsize=None, ttl=None, stale_ttl=None, limit=None):
+        self.client = client
+        self.ttl = ttl or settings.IMAGE_SEARCH_TTL
+        self.limit = limit or settings.IMAGE_SEARCH_LIMIT
+        self.results = LRUCache(maxsize or settings.IMAGE_SEARCH_CACHE_SIZE, stale_ttl or settings.IMAGE_SEARCH_STALE_TTL)
+        self.index = SearchIndex()
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def search(self, term):
+        term = term.strip().lower()
+        if not term:
+            return []
+        cached = self.results.get(term)
+        if cached is not None:
+            results, fetched_at = cached
+            if time.monotonic() - fetched_at > self.ttl:
+                self.refresh(term)
+            return results
+        results = self.refine(term)
+        if results is not None:
+            return results
+        results = self.fetch(term)
+        if results is None:
+            self.index.add({'name': name, 'description': '', 'star_count': 0, 'local': True}
+                           for name in CatalogImage.objects.values_list('name', flat=True).distinct())
+            return [record for record in self.index.prefix(term) if matches(record, term)]
+        return results
+
+    def refine(self, term):
+        # the longest fresh cached prefix with complete results answers locally
+        for length in range(len(term) - 1, 0, -1):
+            cached = self.results.get(term[:length])
+            if cached is None:
+                continue
+            results, fetched_at = cached
+            if len(results) >= self.limit or time.monotonic() - fetched_at > self.ttl:
+                return None
+            results = [record for record in results if matches(record, term)]
+            self.results.set(term, (results, fetched_at))
+            return results
+        return None
+
+    def fetch(self, term):
+        # one request per term at a time; later callers wait for its result
+        with self.lock:
+            done = self.inflight.get(term)
+            leader = done is None
+            if leader:
+                done = self.inflight[term] = threading.Event()
+        if not leader:
+            done.wait(settings.DOCKER_API_READ_TIMEOUT)
+            cached = self.results.get(term)
+            return cached[0] if cached is not None else None
+        try:
+            response = (self.client or get_client()).get('/images/search', params={'term': term, 'limit': self.limit})
+            if response.status_code != 200:
+                return None
+            results = response.json()
+            self.results.set(term, (results, time.monotonic()))
+            self.index.add(results)
+            return results
+        except (requests.RequestException, ValueError):
+            return None
+        finally:
+            with self.lock:
+                del self.inflight[term]
+            done.set()
+
+    def refresh(self, term):
+        with self.lock:
+            if term in self.inflight:
+                return
+        thread = threading.Thread(target=self.fetch, args=(term,), name='image-search-refresh')
+        thread.daemon = True
+        thread.start()
+
+
+_registry_search = None
+_registry_search_lock = threading.Lock()
+
+
+def get_registry_search():
+    global _registry_search
+    if _registry_search is None:
+        with _registry_search_lock:
+            if _registry_search is None:
+                _registry_search = RegistrySearch()
+    return _registry_search
@@ -0,0 +1,371 @@
+import json
+import time
+import asyncio
+import calendar
+import logging
+import threading
+from os import statvfs
+from collections import deque
+from queue import Queue, Full, Empty
+import psutil
+from django.conf import settings
+from dockit.client import get_client
+from dockit.metrics import get_metrics_store
+from dockit.utils import container_top, container_changes, summarize_changes
+
+logger = logging.getLogger(__name__)
+
+# yielded by polling sources when nothing changed since the last poll
+UNCHANGED = object()
+
+
+class HostSampler(object):
+    """Process-wide sampler of host CPU, memory, network and disk usage.
+
+    One thread takes a sample every ``interval`` seconds into a fixed-size
+    ring buffer. Readers never sample themselves; they read the buffer or
+    block until the next sample lands, so any number of viewers costs the
+    same as one.
+    """
+
+    def __init__(self, interval=None, size=None):
+        self.interval = interval or settings.HOST_STATS_INTERVAL
+        self.samples = deque(maxlen=size or settings.HOST_STATS_BUFFER_SIZE)
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='host-sampler')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        psutil.cpu_percent()
+        psutil.cpu_percent(percpu=True)
+        net = psutil.net_io_counters(pernic=True)
+        taken_at = time.time()
+        while not self.stopped.wait(self.interval):
+            net1 = psutil.net_io_counters(pernic=True)
+            now = time.time()
+            self.add(self.sample(net, net1, now - taken_at, now))
+            net, taken_at = net1, now
+
+    def sample(self, net, net1, elapsed, now):
+        net_stat_download = {}
+        net_stat_upload = {}
+        for k, v1 in net1.items():
+            v = net.get(k)
+            if v is not None:
+                net_stat_download[k] = (v1.bytes_recv - v.bytes_recv) / 1000. / elapsed
+                net_stat_upload[k] = (v1.bytes_sent - v.bytes_sent) / 1000. / elapsed
+        ds = statvfs('/')
+        memory = psutil.virtual_memory()
+        return {
+            'time': now,
+            'cpu': psutil.cpu_percent(),
+            'cpus': psutil.cpu_percent(percpu=True),
+            'memory': memory.used,
+            'memTotal': memory.free,
+            'net_stats_down': net_stat_download,
+            'net_stats_up': net_stat_upload,
+            'disk': {"Used": ((ds.f_blocks - ds.f_bfree) * ds.f_frsize) / 10 ** 9,
+                     "Unused": (ds.f_bavail * ds.f_frsize) / 10 ** 9},
+        }
+
+    def add(self, sample):
+        get_metrics_store().record(('host',), sample)
+        with self.condition:
+            self.seq += 1
+            self.samples.append(sample)
+            self.condition.notify_all()
+
+    def latest(self):
+        with self.condition:
+            return self.samples[-1] if self.samples else None
+
+    def history(self):
+        with self.condition:
+            return list(self.samples)
+
+    def wait_next(self, seq, timeout=None):
+        # returns (seq, sample) for the first sample newer than seq
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > seq, timeout):
+                return seq, None
+            return self.seq, self.samples[-1]
+
+
+def container_sample(raw, previous):
+    """Turn one /containers/{id}/stats frame into numeric CPU, memory and
+    network figures, using the previous frame for network rates."""
+    cpu_stats = raw['cpu_stats']
+    precpu_stats = raw['precpu_stats']
+    cpu_delta = cpu_stats['cpu_usage']['total_usage'] - precpu_stats['cpu_usage']['total_usage']
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+    online_cpus = cpu_stats.get('online_cpus') or len(cpu_stats['cpu_usage'].get('percpu_usage') or []) or 1
+    cpu = cpu_delta / system_delta * online_cpus * 100. if system_delta > 0 and cpu_delta > 0 else 0.
+
+    memory_stats = raw['memory_stats']
+    memory_detail = memory_stats.get('stats', {})
+    cache = memory_detail.get('cache', memory_detail.get('inactive_file', 0))
+    memory = memory_stats.get('usage', 0) - cache
+    limit = memory_stats.get('limit', 0)
+
+    rx, tx = network_totals(raw)
+    net_down = net_up = 0.
+    if previous is not None:
+        elapsed = frame_time(raw) - frame_time(previous)
+        prev_rx, prev_tx = network_totals(previous)
+        if elapsed > 0:
+            net_down = max(rx - prev_rx, 0) / 1000. / elapsed
+            net_up = max(tx - prev_tx, 0) / 1000. / elapsed
+    return {
+        'time': frame_time(raw),
+        'cpu': round(cpu, 2),
+        'memory': round(memory / 1024. / 1024., 2),
+        'memTotal': round(limit / 1024. / 1024., 2),
+        'netDow': round(net_down, 2),
+        'netDowUnit': 'kB/s',
+        'netUp': round(net_up, 2),
+        'netUpUnit': 'kB/s',
+    }
+
+
+def network_totals(raw):
+    networks = (raw.get('networks') or {}).values()
+    return sum(n['rx_bytes'] for n in networks), sum(n['tx_bytes'] for n in networks)
+
+
+def frame_time(raw):
+    # "2017-03-01T09:25:00.123456789Z"; sub-second precision is enough here
+    stamp, _, fraction = raw['read'].rstrip('Z').partition('.')
+    seconds = calendar.timegm(time.strptime(stamp, '%Y-%m-%dT%H:%M:%S'))
+    return seconds + float('0.' + (fraction or '0')[:6])
+
+
+def stream_container_samples(container_id):
+    """Yield numeric samples from one long-lived stats stream, recording
+    each into the metrics history."""
+    response = get_client().stream('GET', '/containers/%s/stats' % container_id, params={'stream': 1})
+    metrics = get_metrics_store()
+    previous = None
+    try:
+        for line in response.iter_lines():
+            if line:
+                raw = json.loads(line.decode('utf-8'))
+                sample = container_sample(raw, previous)
+                metrics.record(('container', container_id[:12]), sample)
+                yield sample
+                previous = raw
+    finally:
+        response.close()
+
+
+def poll_changes(fetch, interval=None):
+    """Call ``fetch`` every ``interval`` seconds, yielding its result when it
+    differs from the previous one and ``UNCHANGED`` otherwise."""
+    interval = interval or settings.LIVE_POLL_INTERVAL
+    last = UNCHANGED
+    while True:
+        value = fetch()
+        yield UNCHANGED if value == last else value
+        last = value
+        time.sleep(interval)
+
+
+def top_samples(container_id):
+    return poll_changes(lambda: container_top(container_id) or {'Titles': None, 'Processes': None})
+
+
+def diff_samples(container_id):
+    return poll_changes(lambda: summarize_changes(container_changes(container_id), 10))
+
+
+_host_sampler = None
+_host_sampler_lock = threading.Lock()
+
+
+def get_host_sampler():
+    global _host_sampler
+    if _host_sampler is None:
+        with _host_sampler_lock:
+            if _host_sampler is None:
+                _host_sampler = HostSampler().start()
+    return _host_sampler
+
+
+def host_samples():
+    sampler = get_host_sampler()
+    seq = 0
+    while True:
+        seq, sample = sampler.wait_next(seq)
+        yield sample
+
+
+class Subscription(object):
+    """One viewer's bounded queue of samples from a broker topic.
+
+    A slow viewer loses its oldest samples rather than holding up the
+    collector. ``None`` marks the end of the stream.
+    """
+
+    def __init__(self, topic, size):
+        self.topic = topic
+        self.queue = Queue(maxsize=size)
+
+    def put(self, sample):
+        while True:
+            try:
+                self.queue.put_nowait(sample)
+                return
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                except Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+    def close(self):
+        self.topic.broker.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """Subscription read from an asyncio event loop.
+
+    The collector thread hands samples to the loop, so waiting for the next
+    one costs a coroutine rather than a thread.
+    """
+
+    def __init__(self, topic, size, loop):
+        self.topic = topic
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=size)
+
+    def put(self, sample):
+        try:
+            self.loop.call_soon_threadsafe(self.put_latest, sample)
+        except RuntimeError:
+            # the loop has been closed
+            pass
+
+    def put_latest(self, sample):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(sample)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Topic(object):
+    def __init__(self, broker, key, source):
+        self.broker = broker
+        self.key = key
+        self.source = source
+        self.subscribers = []
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stats-%s' % '-'.join(key))
+        self.thread.daemon = True
+
+    def run(self):
+        try:
+            for sample in self.source:
+                if sample is not UNCHANGED:
+                    self.last = sample
+                    for subscription in list(self.subscribers):
+                        subscription.put(sample)
+                if self.stopped.is_set():
+                    break
+        except Exception as e:
+            logger.warning('stats collector %s failed: %s', self.key, e)
+        finally:
+            self.source.close()
+            self.broker.finished(self)
+
+
+class StatsBroker(object):
+    """Fan-out of stats samples: one upstream collector per watched key.
+
+    The first subscriber to a key starts its collector; later subscribers
+    share it, so Docker and psutil load does not grow with the number of
+    open dashboards. The collector is stopped when the last subscriber
+    leaves, and subscribers get ``None`` when the collector ends.
+
+    Besides stats, ``('top', id)`` and ``('diff', id)`` poll a container's
+    processes and file changes and publish only when they change; a new
+    subscriber starts from the topic's last sample.
+    """
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or settings.STATS_SUBSCRIBER_QUEUE_SIZE
+        self.topics = {}
+        self.lock = threading.Lock()
+
+    def source(self, key):
+        if key[0] == 'host':
+            return host_samples()
+        if key[0] == 'top':
+            return top_samples(key[1])
+        if key[0] == 'diff':
+            return diff_samples(key[1])
+        return stream_container_samples(key[1])
+
+    def subscribe(self, key, loop=None):
+        # pass the running event loop to get an AsyncSubscription
+        with self.lock:
+            topic = self.topics.get(key)
+            if topic is None or topic.stopped.is_set():
+                topic = self.topics[key] = Topic(self, key, self.source(key))
+                topic.thread.start()
+            if loop is None:
+                subscription = Subscription(topic, self.queue_size)
+            else:
+                subscription = AsyncSubscription(topic, self.queue_size, loop)
+            if topic.last is not None:
+                subscription.put(topic.last)
+            topic.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        topic = subscription.topic
+        with self.lock:
+            if subscription in topic.subscribers:
+                topic.subscribers.remove(subscription)
+            if not topic.subscribers:
+                topic.stopped.set()
+                if self.topics.get(topic.key) is topic:
+                    del self.topics[topic.key]
+
+    def finished(self, topic):
+        with self.lock:
+            if self.topics.get(topic.key) is topic:
+                del self.topics[topic.key]
+            subscribers, topic.subscribers = topic.subscribers, []
+        for subscription in subscribers:
+            subscription.put(None)
+
+    def watchers(self):
+        with self.lock:
+            return dict((key, len(topic.subscribers)) for key, topic in self.topics.items())
+
+
+_stats_broker = None
+_stats_broker_lock = threading.Lock()
+
+
+def get_stats_broker():
+    global _stats_broker
+    if _stats_broker is None:
+        with _stats_broker_lock:
+            if _stats_broker is None:
+                _stats_broker = StatsBroker()
+    return _stats_broker
@@ -0,0 +1,272 @@
+import json
+import time
+import asyncio
+import threading
+from collections import Counter
+from queue import Empty
+from django.conf import settings
+from dockit.stats import get_stats_broker
+
+PROTOCOL_VERSION = 1
+
+HOST_STREAM_FIELDS = ('cpu', 'memory', 'memTotal', 'net_stats_down', 'net_stats_up', 'disk')
+CONTAINER_STREAM_FIELDS = ('cpu', 'memory', 'memTotal', 'netDow', 'netUp')
+
+UNITS = {
+    'host': {'cpu': '%', 'memory': 'B', 'memTotal': 'B', 'net_stats_down': 'kB/s', 'net_stats_up': 'kB/s',
+             'disk': 'GB'},
+    'container': {'cpu': '%', 'memory': 'MiB', 'memTotal': 'MiB', 'netDow': 'kB/s', 'netUp': 'kB/s'},
+}
+
+CONTENT_TYPES = {'sse': 'text/event-stream', 'ndjson': 'application/x-ndjson'}
+
+
+def stream_format(request):
+    fmt = request.GET.get('format')
+    if fmt in CONTENT_TYPES:
+        return fmt
+    return 'ndjson' if 'application/x-ndjson' in request.META.get('HTTP_ACCEPT', '') else 'sse'
+
+
+def stream_fields(request, available):
+    # ?fields=cpu,memory picks a subset; unknown names are ignored
+    wanted = [field for field in request.GET.get('fields', '').split(',') if field in available]
+    return tuple(wanted) or available
+
+
+class FrameEncoder(object):
+    """Encodes one connection's samples as protocol frames.
+
+    Every frame is a JSON object with a ``type``: ``hello`` (protocol
+    version, fields, units), ``sample``, ``heartbeat`` or ``end`` (with the
+    ``reason`` the server closed the stream). Numbers are sent
+    as numbers. Per-key fields such as per-NIC rates are delta-encoded:
+    only keys whose value changed since the previous frame are sent (the
+    field is left out when nothing changed), and a frame with
+    ``"key": true`` carries the full state, which the client must replace
+    rather than merge. A key frame is sent first, whenever the
+    set of keys changes and every ``keyframe_interval`` samples.
+
+    ``fmt`` is ``'sse'`` (Server-Sent Events, ``event:``/``data:`` lines),
+    ``'ndjson'`` (one JSON object per line) or ``None`` for the frame
+    dicts themselves, which the live WebSocket wraps in its own messages.
+    """
+
+    def __init__(self, kind, fields, fmt='sse', keyframe_interval=None):
+        self.kind = kind
+        self.fields = fields
+        self.fmt = fmt
+        self.keyframe_interval = keyframe_interval or settings.STATS_KEYFRAME_INTERVAL
+        self.last = {}
+        self.count = 0
+
+    def encode(self, frame):
+        if self.fmt is None:
+            return frame
+        data = json.dumps(frame, separators=(',', ':'))
+        if self.fmt == 'sse':
+            return 'event: %s\ndata: %s\n\n' % (frame['type'], data)
+        return data + '\n'
+
+    def hello(self):
+        return self.encode({
+            'type': 'hello',
+            'v': PROTOCOL_VERSION,
+            'stream': self.kind,
+            'fields': list(self.fields),
+            'units': dict((field, UNITS[self.kind][field]) for field in self.fields),
+        })
+
+    def heartbeat(self):
+        return self.encode({'type': 'heartbeat', 't': round(time.time(), 3)})
+
+    def end(self, reason):
+        return self.encode({'type': 'end', 'reason': reason})
+
+    def sample(self, sample):
+        keyframe = self.count % self.keyframe_interval == 0
+        for field in self.fields:
+            if isinstance(sample[field], dict) and set(sample[field]) != set(self.last.get(field, ())):
+                keyframe = True
+        frame = {'type': 'sample', 't': round(sample['time'], 3)}
+        if keyframe:
+            frame['key'] = True
+        for field in self.fields:
+            value = sample[field]
+            if isinstance(value, dict):
+                value = dict((name, round(v, 2)) for name, v in value.items())
+                previous = self.last.get(field, {})
+                self.last[field] = value
+                if not keyframe:
+                    value = dict((name, v) for name, v in value.items() if previous.get(name) != v)
+                    if not value:
+                        continue
+            else:
+                value = round(value, 2)
+            frame[field] = value
+        self.count += 1
+        return self.encode(frame)
+
+
+class StreamSession(object):
+    def __init__(self, user_id, key):
+        self.user_id = user_id
+        self.key = key
+        self.started = self.last_write = time.monotonic()
+        self.ended = None
+
+    def wrote(self):
+        # the client took the last frame; a stalled source keeps a stream
+        # alive through heartbeats, a client that stops reading does not
+        self.last_write = time.monotonic()
+
+    def expired(self, max_age, idle_timeout):
+        # the reason this stream must end now, if any
+        now = time.monotonic()
+        if self.ended:
+            return self.ended
+        if now - self.started > max_age:
+            return 'max_age'
+        if now - self.last_write > idle_timeout:
+            return 'idle'
+        return None
+
+
+class StreamRegistry(object):
+    """Book-keeping for open stats streams.
+
+    Caps the streams one user may hold open: opening one more ends that
+    user's oldest stream, which is usually a tab closed without the server
+    noticing yet. Counts streams opened and closed, by reason, so abandoned
+    dashboards show up in ``counters()``.
+    """
+
+    def __init__(self, per_user=None, max_age=None, idle_timeout=None):
+        self.per_user = per_user or settings.STATS_STREAMS_PER_USER
+        self.max_age = max_age or settings.STATS_STREAM_MAX_AGE
+        self.idle_timeout = idle_timeout or settings.STATS_STREAM_IDLE_TIMEOUT
+        self.sessions = {}
+        self.totals = Counter()
+        self.lock = threading.Lock()
+
+    def open(self, user_id, key):
+        session = StreamSession(user_id, key)
+        with self.lock:
+            sessions = self.sessions.setdefault(user_id, [])
+            if user_id is not None:
+                for oldest in sessions[:max(len(sessions) - self.per_user + 1, 0)]:
+                    oldest.ended = 'replaced'
+            sessions.append(session)
+            self.totals['opened'] += 1
+        return session
+
+    def close(self, session, reason):
+        if reason == 'disconnect' and self.expired(session) == 'idle':
+            # closed while its last frame sat unread for the idle timeout
+            reason = 'idle'
+        with self.lock:
+            sessions = self.sessions.get(session.user_id, [])
+            if session in sessions:
+                sessions.remove(session)
+                self.totals['closed_' + reason] += 1
+            if not sessions:
+                self.sessions.pop(session.user_id, None)
+
+    def expired(self, session):
+        return session.expired(self.max_age, self.idle_timeout)
+
+    def counters(self):
+        with self.lock:
+            counters = dict(self.totals)
+            counters['active'] = sum(len(sessions) for sessions in self.sessions.values())
+            counters['users'] = len([user_id for user_id in self.sessions if user_id is not None])
+        return counters
+
+
+_stream_registry = None
+_stream_registry_lock = threading.Lock()
+
+
+def get_stream_registry():
+    global _stream_registry
+    if _stream_registry is None:
+        with _stream_registry_lock:
+            if _stream_registry is None:
+                _stream_registry = StreamRegistry()
+    return _stream_registry
+
+
+def stream_frames(key, encoder, user_id=None, heartbeat=None):
+    """Yield encoded frames for one stats broker key until its collector
+    ends, the client goes away or the stream outlives its limits. A
+    heartbeat is sent whenever no sample arrived for ``heartbeat`` seconds,
+    so a closed connection is noticed at the next write at the latest.
+    Every time the consumer comes back for the next frame counts as a
+    write the client took."""
+    heartbeat = heartbeat or settings.STATS_HEARTBEAT_INTERVAL
+    registry = get_stream_registry()
+    session = registry.open(user_id, key)
+    subscription = get_stats_broker().subscribe(key)
+    reason = 'disconnect'
+    try:
+        yield encoder.hello()
+        while True:
+            session.wrote()
+            try:
+                sample = subscription.get(timeout=heartbeat)
+            except Empty:
+                sample = False
+            if sample is None:
+                reason = 'source_ended'
+                return
+            expired = registry.expired(session)
+            if expired:
+                reason = expired
+                yield encoder.end(reason)
+                return
+            yield encoder.sample(sample) if sample else encoder.heartbeat()
+    finally:
+        subscription.close()
+        registry.close(session, reason)
+
+
+async def async_stream_frames(key, encoder, user_id=None, heartbeat=None):
+    """Coroutine counterpart of ``stream_frames`` for the ASGI app."""
+    heartbeat = heartbeat or settings.STATS_HEARTBEAT_INTERVAL
+    registry = get_stream_registry()
+    session = registry.open(user_id, key)
+    subscription = get_stats_broker().subscribe(key, loop=asyncio.get_event_loop())
+    reason = 'disconnect'
+    try:
+        yield encoder.hello()
+        while True:
+            session.wrote()
+            try:
+                sample = await subscription.get(timeout=heartbeat)
+            except asyncio.TimeoutError:
+                sample = False
+            if sample is None:
+                reason = 'source_ended'
+                return
+            expired = registry.expired(session)
+            if expired:
+                reason = expired
+                yield encoder.end(reason)
+                return
+            yield encoder.sample(sample) if sample else encoder.heartbeat()
+    finally:
+        subscription.close()
+        registry.close(session, reason)
+
+
+async def async_topic_updates(key):
+    """Yield every sample a polling broker topic (top, diff) publishes."""
+    subscription = get_stats_broker().subscribe(key, loop=asyncio.get_event_loop())
+    try:
+        while True:
+            sample = await subscription.get()
+            if sample is None:
+                return
+            yield sample
+    finally:
+        subscription.close()
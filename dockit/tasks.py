@@ -0,0 +1,26 @@
+from celery import shared_task
+from django.conf import settings
+from dockit.pulls import run_pull, begin_pull, hold_pull, set_pull_progress, acquire_pull_slot
+
+
+def start_pull(name, tag, user_id):
+    """Queue a pull of ``name:tag`` unless one is already in flight, in
+    which case the caller just follows that pull's progress. Returns True
+    when this call queued the pull."""
+    ref = '%s:%s' % (name, tag)
+    if not begin_pull(ref, user_id):
+        return False
+    set_pull_progress(ref, {'status': 'queued', 'image': ref, 'message': '', 'progress': 0, 'layers': {}})
+    pull_image.delay(name, tag, user_id)
+    return True
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=None)
+def pull_image(self, name, tag, user_id):
+    # at most PULL_CONCURRENCY distinct pulls at once; the rest wait queued
+    slot = acquire_pull_slot()
+    if slot is None:
+        # still queued: keep other requests following this pull
+        hold_pull('%s:%s' % (name, tag), user_id)
+        raise self.retry(countdown=settings.PULL_RETRY_INTERVAL)
+    run_pull(name, tag, user_id, slot=slot)
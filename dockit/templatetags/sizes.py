@@ -1,8 +1,6 @@
 import datetime
 from django import template
-import requests
-from dockit.utils import DHost
-from django.conf import settings
+from dockit.utils import DHost, request_container_state
 from dateutil import parser
 
 register = template.Library()
@@ -27,15 +25,19 @@ def epoch_to_datetime(epoch):
 
 @register.filter
 def container_ram(container_id):
-    container = requests.get('http://localhost:' + settings.DOCKER_API_PORT + '/containers/' + container_id + '/json')
-    return format(container.json()['HostConfig']['Memory'] / 1024 / 1024, '.0f')
+    container = request_container_state(container_id)
+    if container is None or container['HostConfig'] is None:
+        return None
+    return format(container['HostConfig']['Memory'] / 1024 / 1024, '.0f')
 
 
 @register.filter
 def container_cores(container_id):
-    container = requests.get('http://localhost:' + settings.DOCKER_API_PORT + '/containers/' + container_id + '/json')
-    if container.json()['HostConfig']['CpusetCpus']:
-        return len([a for a in container.json()['HostConfig']['CpusetCpus'].split(',')])
+    container = request_container_state(container_id)
+    if container is None or container['HostConfig'] is None:
+        return None
+    if container['HostConfig']['CpusetCpus']:
+        return len([a for a in container['HostConfig']['CpusetCpus'].split(',')])
     return None
 
 
@@ -1,13 +1,43 @@
+import asyncio
 import json
 import os
+import shutil
+import tempfile
+import threading
 import requests
 import time
+from queue import Queue
 
-from django.test import TestCase, Client
+from django.conf import settings
+from django.db import connection as db_connection
+from django.test import TestCase, TransactionTestCase, Client
 from django.core.urlresolvers import reverse
 
 from dockit.views import stream_host_stats
-from dockit.models import User, IP, Image, Container
+from dockit.forms import ContainerForm
+from dockit.models import User, IP, Image, Container, CatalogImage, Placement
+from dockit.cache import LRUCache, ImageCache, inspect_cache, image_cache
+from dockit.metrics import RoundRobinArchive, MetricsStore, fields_for
+from dockit import metrics as metrics_module
+from dockit.archive import MetricsArchive
+from dockit.streams import FrameEncoder, StreamRegistry, stream_frames, HOST_STREAM_FIELDS
+from dockit import streams as streams_module
+from dockit.stats import poll_changes, UNCHANGED, HostSampler, StatsBroker, stream_container_samples
+from dockit import stats as stats_module
+from benchmarks.standin import StandInDaemon
+from dockit.aioclient import AsyncDockerClient, fan_out
+from dockit.utils import inspect_states, container_states, defer_inspects, request_container_state
+from dockit.middleware import RequestStoreMiddleware
+from dockit.templatetags.sizes import container_ram, container_cores
+from dockit import client as client_module
+from dockit.client import DockerClient
+from dockit.search import RegistrySearch
+from dockit.catalog import sync_image_catalog, sync_on_event
+from dockit.placement import parse_cpuset, pinned_cores, recent_core_load, choose_cores, place_cores
+from dockit.pulls import (PullProgress, run_pull, get_pull_progress, pull_cache, begin_pull, hold_pull,
+                          acquire_pull_slot, release_pull_slot)
+from dockit import mirror as mirror_module
+from docker_box.asgi import application as asgi_application
 
 
 class TestIndexView(TestCase):
@@ -251,9 +281,39 @@ class TestHostStatsView(TestCase):
 class TestStreamHostStats(TestCase):
 
     def test_stream_host_stats(self):
-        streaming_data = next(stream_host_stats())
-        l = json.loads(streaming_data[:-1])
-        self.assertTrue(isinstance(l, list))
+        frames = stream_host_stats(('cpu', 'net_stats_down'), 'ndjson')
+        hello = json.loads(next(frames))
+        self.assertEqual(hello['v'], 1)
+        self.assertEqual(hello['fields'], ['cpu', 'net_stats_down'])
+        sample = json.loads(next(frames))
+        self.assertEqual(sample['type'], 'sample')
+        self.assertTrue(sample['key'])
+        self.assertTrue(isinstance(sample['cpu'], float))
+        self.assertFalse('memory' in sample)
+        frames.close()
+        # nothing is written to disk unless an archive directory is configured
+        self.assertIsNone(metrics_module.get_metrics_store().archive)
+
+
+class TestFrameEncoder(TestCase):
+
+    def test_delta_encoding(self):
+        encoder = FrameEncoder('host', ('cpu', 'net_stats_down'), 'ndjson', keyframe_interval=60)
+        sample = {'time': 1, 'cpu': 1.234, 'net_stats_down': {'eth0': 1.0, 'lo': 2.0}}
+        frame = json.loads(encoder.sample(sample))
+        self.assertEqual(frame, {'type': 'sample', 't': 1, 'key': True, 'cpu': 1.23,
+                                 'net_stats_down': {'eth0': 1.0, 'lo': 2.0}})
+        sample = {'time': 2, 'cpu': 2, 'net_stats_down': {'eth0': 3.0, 'lo': 2.0}}
+        frame = json.loads(encoder.sample(sample))
+        self.assertEqual(frame['net_stats_down'], {'eth0': 3.0})
+        self.assertFalse('key' in frame)
+        sample = {'time': 3, 'cpu': 2, 'net_stats_down': {'eth0': 3.0}}
+        frame = json.loads(encoder.sample(sample))
+        self.assertEqual(frame['net_stats_down'], {'eth0': 3.0})
+        self.assertTrue(frame['key'])
+
+        encoder = FrameEncoder('host', ('cpu',), 'sse')
+        self.assertTrue(encoder.hello().startswith('event: hello\ndata: {'))
 
 
 class TestDockerImagesView(TestCase):
@@ -436,9 +496,16 @@ class TestPullImageProgressView(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+# pull progress lives in memcached in production; tests use an in-process cache
+LOCAL_PULL_CACHES = dict(settings.CACHES, pulls={
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pulls'})
+
+
 class TestPullImageView(TestCase):
 
     def setUp(self):
+        self.cache_settings = self.settings(CACHES=LOCAL_PULL_CACHES)
+        self.cache_settings.enable()
         self.client = Client()
         self.admin = User.objects.create(
             email="daniel@micropyramid.com",
@@ -451,6 +518,9 @@ class TestPullImageView(TestCase):
         self.admin.save()
         self.uuid_token = "6a19ec28-db5f-4375-aeda-a5d15245d77c"
 
+    def tearDown(self):
+        self.cache_settings.disable()
+
     def test_pull_image(self):
         login = self.client.login(username=self.admin.email, password=self.password)
         self.assertTrue(login)
@@ -458,7 +528,15 @@ class TestPullImageView(TestCase):
         url = reverse("docker_box:pull-image", kwargs={"uuid_token": self.uuid_token})
         response = self.client.post(url, {"imageName": "ubuntu-upstart"})
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertEqual(response.json(), {'status': 'queued'})
+
+        # a second request for the same image follows the pull in flight
+        response = self.client.post(url, {"imageName": "ubuntu-upstart"})
+        self.assertEqual(response.json(), {'status': 'attached'})
+
+        url = reverse("docker_box:pull-image-progress", kwargs={"uuid_token": self.uuid_token})
+        response = self.client.get(url, {"imageName": "ubuntu-upstart"})
+        self.assertEqual(response.json()['status'], 'queued')
 
 
 class TestRemoveImage(TestCase):
@@ -1507,3 +1585,955 @@ class TestDeleteIP(TestCase):
         redirect_url = reverse("docker_box:ip-list")
         self.assertRedirects(response, redirect_url, 302)
         self.assertEqual(IP.objects.count(), 0)
+
+
+class TestLRUCache(TestCase):
+
+    def test_lru_eviction(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_ttl_and_invalidate(self):
+        cache = LRUCache(10, ttl=0.05)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.invalidate("b")
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.1)
+        self.assertEqual(cache.get("a"), None)
+
+
+class TestRoundRobinArchive(TestCase):
+
+    def test_downsample_and_wrap(self):
+        archive = RoundRobinArchive(60, 3, ('cpu',))
+        archive.add(0, {'cpu': 10})
+        archive.add(30, {'cpu': 20})
+        archive.add(60, {'cpu': 40})
+        rows = archive.range(0, 119)
+        self.assertEqual(rows['time'], [0.0, 60.0])
+        self.assertEqual(rows['cpu'], [15.0, 40.0])
+
+        archive.add(180, {'cpu': 50})
+        rows = archive.range(0, 239)
+        self.assertEqual(rows['time'], [60.0, 180.0])
+        self.assertEqual(rows['cpu'], [40.0, 50.0])
+
+
+class TestMetricsArchive(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = MetricsArchive(self.directory, step=10, retention=3600, compact_after=600,
+                                      compact_step=60, compact_interval=86400)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_query_and_compact(self):
+        now = time.time() // 60 * 60
+        for offset in range(-4000, 1, 5):
+            self.archive.add(('container', 'abc'), ('cpu',), now + offset, {'cpu': offset % 10})
+        self.archive.flush()
+        series = self.archive.series(('container', 'abc'), ('cpu',))
+        self.assertEqual(series.info()['records'], 401)
+
+        rows = self.archive.query(('container', 'abc'), ('cpu',), now - 30, now)
+        self.assertEqual(rows['time'], [now - 30, now - 20, now - 10, now])
+        self.assertEqual(rows['cpu'], [2.5, 2.5, 2.5, 0.0])
+
+        self.assertEqual(self.archive.compact_series(series, now), (401, 61 + 50))
+        rows = self.archive.query(('container', 'abc'), ('cpu',), now - 3600, now - 600)
+        self.assertEqual(rows['time'][:2], [now - 3600, now - 3540])
+        self.assertEqual(rows['time'][-2:], [now - 660, now - 600])
+        self.assertEqual(rows['time'][-1] - rows['time'][-2], 60)
+
+    def test_compact_drops_removed_containers(self):
+        now = time.time() // 60 * 60
+        for key in (('host',), ('container', 'abc'), ('container', 'gone')):
+            fields = fields_for(key)
+            for offset in range(-4000, 1, 10):
+                self.archive.add(key, fields, now + offset, dict((field, 1) for field in fields))
+        self.archive.flush()
+        # writing never compacts
+        self.assertEqual(self.archive.series(('host',), fields_for(('host',))).info()['records'], 401)
+
+        results = self.archive.compact(fields_for, live={'abc'}, now=now)
+        self.assertEqual(results, [(('container', 'abc'), 401, 111), (('container', 'gone'), 401, 0),
+                                   (('host',), 401, 111)])
+        self.assertEqual(self.archive.keys(), [('container', 'abc'), ('host',)])
+
+
+
+class TestStreamRegistry(TestCase):
+
+    def test_limits_and_counters(self):
+        registry = StreamRegistry(per_user=2, max_age=3600, idle_timeout=60)
+        first = registry.open(1, ('host',))
+        second = registry.open(1, ('host',))
+        registry.open(2, ('host',))
+        self.assertEqual(registry.expired(first), None)
+        third = registry.open(1, ('host',))
+        self.assertEqual(registry.expired(first), 'replaced')
+        self.assertEqual(registry.expired(second), None)
+
+        third.last_write -= 61
+        self.assertEqual(registry.expired(third), 'idle')
+        second.started -= 3601
+        self.assertEqual(registry.expired(second), 'max_age')
+
+        registry.close(first, 'replaced')
+        registry.close(second, 'disconnect')
+        counters = registry.counters()
+        self.assertEqual(counters['opened'], 4)
+        self.assertEqual(counters['active'], 2)
+        self.assertEqual(counters['users'], 2)
+        self.assertEqual(counters['closed_replaced'], 1)
+        self.assertEqual(counters['closed_disconnect'], 1)
+
+
+class TestStreamIdle(TestCase):
+
+    def setUp(self):
+        # a source that never publishes after being subscribed
+        class Broker(StatsBroker):
+            def source(self, key):
+                return iter(Queue().get, None)
+
+        self.registry, self.broker = streams_module._stream_registry, stats_module._stats_broker
+        streams_module._stream_registry = StreamRegistry(idle_timeout=0.3)
+        stats_module._stats_broker = Broker(queue_size=10)
+
+    def tearDown(self):
+        streams_module._stream_registry, stats_module._stats_broker = self.registry, self.broker
+
+    def test_stalled_source_keeps_reading_client(self):
+        frames = stream_frames(('host',), FrameEncoder('host', HOST_STREAM_FIELDS, 'ndjson'), heartbeat=0.05)
+        sent = [json.loads(next(frames)) for i in range(15)]
+        self.assertEqual(set(frame['type'] for frame in sent[1:]), {'heartbeat'})
+        frames.close()
+        self.assertEqual(streams_module._stream_registry.counters()['closed_disconnect'], 1)
+
+    def test_client_that_stops_reading_is_idle(self):
+        frames = stream_frames(('host',), FrameEncoder('host', HOST_STREAM_FIELDS, 'ndjson'), heartbeat=0.05)
+        next(frames)
+        next(frames)
+        time.sleep(0.4)
+        frames.close()
+        self.assertEqual(streams_module._stream_registry.counters()['closed_idle'], 1)
+
+
+class TestPollChanges(TestCase):
+
+    def test_only_changes_are_published(self):
+        values = iter([{'a': 1}, {'a': 1}, {'a': 2}, {'a': 2}])
+        polled = poll_changes(lambda: next(values), interval=0.001)
+        self.assertEqual([next(polled) for i in range(4)], [{'a': 1}, UNCHANGED, {'a': 2}, UNCHANGED])
+
+class TestStatsStreamRouter(TransactionTestCase):
+    # the router looks the session up from a worker thread, which cannot see
+    # the uncommitted data of a TestCase transaction
+
+    def setUp(self):
+        self.admin = User.objects.create(
+            email="samule@micropyramid.com",
+            first_name="Samule",
+            is_superuser=True,
+            is_admin=True
+        )
+        self.password = "secret"
+        self.admin.set_password(self.password)
+        self.admin.save()
+
+    def call(self, path, cookie=b'', seconds=0.1):
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.sleep(seconds)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path,
+                 'root_path': '', 'query_string': b'format=ndjson', 'server': ('testserver', 80),
+                 'headers': [(b'host', b'testserver'), (b'cookie', cookie)]}
+        asyncio.get_event_loop().run_until_complete(asgi_application(scope, receive, send))
+        return sent
+
+    def test_host_stats(self):
+        sent = self.call('/host_stats/')
+        self.assertEqual(sent[0]['status'], 302)
+
+        self.client.login(username=self.admin.email, password=self.password)
+        cookie = ('sessionid=%s' % self.client.cookies['sessionid'].value).encode()
+        sent = self.call('/host_stats/', cookie)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(json.loads(sent[1]['body'].decode())['type'], 'hello')
+
+    def connect(self, path, cookie, origin):
+        messages = [{'type': 'websocket.disconnect', 'code': 1000}, {'type': 'websocket.connect'}]
+        sent = []
+
+        async def receive():
+            return messages.pop()
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'websocket', 'scheme': 'ws', 'path': path, 'root_path': '', 'query_string': b'',
+                 'server': ('testserver', 80), 'subprotocols': [],
+                 'headers': [(b'host', b'testserver'), (b'origin', origin), (b'cookie', cookie)]}
+        asyncio.get_event_loop().run_until_complete(asgi_application(scope, receive, send))
+        return sent
+
+    def test_live_channel_origin(self):
+        ip = IP.objects.create(ip_addr="79.137.106.65", is_active=True, is_available=True,
+                               mac_addr="68:5d:43:b9:83:b8")
+        image = Image.objects.create(name="ubuntu-upstart", tag="latest", user=self.admin)
+        container = Container.objects.create(hostname="micro.com", container_id='a' * 64, image=image, ip=ip)
+        self.client.login(username=self.admin.email, password=self.password)
+        cookie = ('sessionid=%s' % self.client.cookies['sessionid'].value).encode()
+        path = reverse('docker_box:container_live', kwargs={'container_id': container.container_id})
+
+        sent = self.connect(path, cookie, b'http://testserver')
+        self.assertEqual(sent[0]['type'], 'websocket.accept')
+        # a page on another site riding the session cookie
+        sent = self.connect(path, cookie, b'http://evil.example.com')
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 4403}])
+        with self.settings(ALLOWED_HOSTS=['.micropyramid.com']):
+            sent = self.connect(path, cookie, b'https://dbox.micropyramid.com')
+            self.assertEqual(sent[0]['type'], 'websocket.accept')
+
+
+class StandInMixin(object):
+    """Runs a stand-in Docker daemon for every test and points the shared
+    client, the async clients and the mirror at it. The mirror is never
+    started, so every lookup goes to the stand-in."""
+
+    def setUp(self):
+        super(StandInMixin, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.daemon = StandInDaemon(socket_path=os.path.join(self.directory, 'docker.sock')).start()
+        self.docker_settings = self.settings(DOCKER_API_TRANSPORT='unix', DOCKER_SOCKET_PATH=self.daemon.socket_path)
+        self.docker_settings.enable()
+        self.saved_client, self.saved_mirror = client_module._client, mirror_module._mirror
+        self.docker_client = client_module._client = DockerClient('unix', socket_path=self.daemon.socket_path)
+        mirror_module._mirror = mirror_module.DockerMirror(self.docker_client)
+        inspect_cache.clear()
+
+    def tearDown(self):
+        self.docker_client.close()
+        client_module._client, mirror_module._mirror = self.saved_client, self.saved_mirror
+        self.docker_settings.disable()
+        self.daemon.stop()
+        shutil.rmtree(self.directory)
+        super(StandInMixin, self).tearDown()
+
+
+class TestAsyncDockerClient(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestAsyncDockerClient, self).setUp()
+        for i in range(8):
+            self.daemon.add_container('%012d' % i)
+
+    def test_fan_out(self):
+        ids = ['%012d' % i for i in range(8)] + ['missing']
+        self.daemon.delay = 0.3
+
+        def inspect(client, container_id):
+            return client.inspect_container(container_id)
+        started = time.time()
+        inspects = fan_out(inspect, ids)
+        elapsed = time.time() - started
+        self.assertEqual([i and i['Id'] for i in inspects], ids[:8] + [None])
+        self.assertLess(elapsed, 1.5)
+
+    def test_inspect_states_skips_failures(self):
+        # one container vanished after being listed, one answers garbage
+        del self.daemon.containers['%012d' % 1]
+        self.daemon.broken.add('%012d' % 2)
+        states = inspect_states(['%012d' % i for i in range(4)])
+        self.assertEqual(sorted(states), ['%012d' % 0, '%012d' % 3])
+
+    def test_keep_alive(self):
+        async def run():
+            async with AsyncDockerClient('unix', self.daemon.socket_path, pool_size=1) as client:
+                first = await client.containers()
+                second = await client.inspect_container('%012d' % 3)
+                return first, second, len(client.idle)
+        loop = asyncio.new_event_loop()
+        try:
+            containers, inspect, idle = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual(len(containers), 8)
+        self.assertEqual(inspect['Id'], '%012d' % 3)
+        self.assertEqual(idle, 1)
+
+
+
+class TestBulkContainerAction(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestBulkContainerAction, self).setUp()
+        self.client = Client()
+        self.admin = User.objects.create(email="daniel@micropyramid.com", first_name="Daniel", is_superuser=True)
+        self.password = "secret"
+        self.admin.set_password(self.password)
+        self.admin.save()
+        self.image = Image.objects.create(name="ubuntu-upstart", tag="latest", user=self.admin)
+        for i in range(6):
+            ip = IP.objects.create(ip_addr="10.0.0.%d" % (i + 1), is_available=False)
+            container = Container.objects.create(hostname="c%d" % i, container_id=str(i) * 64, image=self.image, ip=ip)
+            container.user.add(self.admin)
+            self.daemon.add_container(str(i) * 64, running=i < 4)
+
+    def test_bulk_stop(self):
+        self.client.login(username=self.admin.email, password=self.password)
+        self.daemon.delay = 0.3
+        url = reverse("docker_box:bulk-container-action")
+        started = time.time()
+        response = self.client.post(url, {'action': 'stop', 'state': 'running'})
+        self.assertLess(time.time() - started, 1.2)
+        self.assertEqual(response.json()['results'], dict((str(i) * 64, 204) for i in range(4)))
+
+        response = self.client.post(url, {'action': 'stop', 'container_id': ['0' * 64, 'missing']})
+        self.assertEqual(response.json()['results'], {'0' * 64: 304})
+        self.assertEqual(response.json()['missing'], ['missing'])
+
+        response = self.client.post(url, {'action': 'stop'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_remove(self):
+        self.client.login(username=self.admin.email, password=self.password)
+        url = reverse("docker_box:bulk-container-action")
+        ids = ['4' * 64, '5' * 64]
+        response = self.client.post(url, {'action': 'remove', 'container_id': ids, 'passphrase': 'wrong'})
+        self.assertEqual(response.json(), {'perror': True})
+
+        response = self.client.post(url, {'action': 'remove', 'container_id': ids, 'passphrase': self.password})
+        self.assertEqual(response.json()['results'], dict((container_id, 204) for container_id in ids))
+        self.assertFalse(Container.objects.filter(container_id__in=ids).exists())
+        self.assertEqual(IP.objects.filter(is_available=True).count(), 2)
+
+
+class TestRunContainer(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestRunContainer, self).setUp()
+        self.admin = User.objects.create(email="daniel@micropyramid.com", first_name="Daniel", is_superuser=True)
+        self.daemon.add_image('sha256:' + 'a' * 64, ['ubuntu-upstart:latest'])
+
+    def test_run_bridge(self):
+        image = Image.objects.create(name="ubuntu-upstart", tag="latest", user=self.admin)
+        container_id = image.run_bridge('0,1', '200', '10.0.0.2', 'micro.com')
+        self.assertIsInstance(container_id, str)
+        self.assertEqual(len(container_id), 64)
+        container = self.daemon.containers[container_id]
+        self.assertTrue(container['State']['Running'])
+        self.assertEqual(container['HostConfig'], {'Memory': 200 * 1024 * 1024, 'CpusetCpus': '0,1'})
+        self.assertEqual(container['NetworkSettings']['Networks'], {'dbox_bridge': {'IPAddress': '10.0.0.2'}})
+
+    def test_missing_image(self):
+        image = Image.objects.create(name="missing", tag="latest", user=self.admin)
+        with self.assertRaises(requests.HTTPError):
+            image.run_macvlan('0', '200', '10.0.0.3', '02:42:0a:00:00:03', 'micro.com')
+        self.assertEqual(self.daemon.containers, {})
+
+    def test_full_id_rows(self):
+        image = Image.objects.create(name="ubuntu-upstart", tag="latest", user=self.admin)
+        ip = IP.objects.create(ip_addr="10.0.0.2", is_available=False)
+        container_id = image.run_bridge('0,1', '200', ip.ip_addr, 'micro.com')
+        Container.objects.create(hostname='micro.com', container_id=container_id, image=image, ip=ip)
+        Container.objects.create(hostname='old.com', container_id='b' * 12, image=image, ip=ip)
+        for lookup in (container_id, container_id[:12]):
+            self.assertEqual(Container.objects.get_container(lookup, self.admin).container_id, container_id)
+        self.assertEqual(Container.objects.get_container('b' * 64, self.admin).container_id, 'b' * 12)
+        self.assertIsNone(Container.objects.get_container(container_id[:4], self.admin))
+
+        client = Client()
+        self.admin.set_password('secret')
+        self.admin.save()
+        client.login(username=self.admin.email, password='secret')
+        response = client.get(reverse('docker_box:container-details', kwargs={'container_id': container_id}))
+        for name in ('stop-container', 'start-container', 'container_history'):
+            self.assertContains(response, reverse('docker_box:' + name, kwargs={'container_id': container_id}))
+
+
+class TestProvision(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestProvision, self).setUp()
+        self.admin = User.objects.create(email="daniel@micropyramid.com", first_name="Daniel", is_superuser=True)
+        self.daemon.add_container('a' * 64)
+        self.container = Container(container_id='a' * 64)
+
+    def test_one_exec_for_all_keys(self):
+        users = [User(email='user%d@micropyramid.com' % i, ssh_pub_key='ssh-ed25519 KEY%d user%d\n' % (i, i))
+                 for i in range(5)] + [User(email='nokey@micropyramid.com')]
+        passphrase = self.container.provision(users, set_password=True)
+        self.assertEqual(len(passphrase), 15)
+        self.assertEqual(len(self.daemon.exec_log), 1)
+        session = self.daemon.exec_log[0]
+        self.assertEqual(session['ContainerID'], 'a' * 64)
+        self.assertEqual(session['Cmd'][:2], ['sh', '-c'])
+        env = dict(item.split('=', 1) for item in session['Env'])
+        self.assertEqual(env['DBOX_SSH_KEYS'].split('\n'), ['ssh-ed25519 KEY%d user%d' % (i, i) for i in range(5)])
+        self.assertEqual(env['DBOX_PASSPHRASE'], passphrase)
+        # neither secret is part of the command itself
+        self.assertNotIn(passphrase, session['Cmd'][2])
+
+    def test_nothing_to_provision(self):
+        self.assertIsNone(self.container.provision([User(email='nokey@micropyramid.com')]))
+        self.assertEqual(self.daemon.exec_log, [])
+
+
+class TestRunPull(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestRunPull, self).setUp()
+        self.cache_settings = self.settings(CACHES=LOCAL_PULL_CACHES)
+        self.cache_settings.enable()
+        pull_cache().clear()
+        self.client = Client()
+        self.admin = User.objects.create(email="daniel@micropyramid.com", first_name="Daniel", is_superuser=True)
+        self.password = "secret"
+        self.admin.set_password(self.password)
+        self.admin.save()
+        self.daemon.registry['busybox'] = [1000, 3000]
+
+    def tearDown(self):
+        self.cache_settings.disable()
+        super(TestRunPull, self).tearDown()
+
+    def test_layer_progress(self):
+        progress = PullProgress('busybox', 'latest')
+        progress.feed({'status': 'Pulling from library/busybox', 'id': 'latest'})
+        progress.feed({'status': 'Downloading', 'progressDetail': {'current': 250, 'total': 1000}, 'id': 'a'})
+        progress.feed({'status': 'Downloading', 'progressDetail': {'current': 0, 'total': 3000}, 'id': 'b'})
+        self.assertEqual(progress.progress(), 6)
+        progress.feed({'status': 'Pull complete', 'progressDetail': {}, 'id': 'a'})
+        self.assertEqual(progress.progress(), 25)
+        self.assertEqual(sorted(progress.snapshot()['layers']), ['a', 'b'])
+
+    def test_run_pull(self):
+        snapshot = run_pull('busybox', user_id=self.admin.pk, interval=0)
+        self.assertEqual(snapshot['status'], 'done')
+        self.assertEqual(snapshot['progress'], 100)
+        self.assertEqual(len(snapshot['layers']), 2)
+        self.assertIn('busybox:latest', self.daemon.images)
+        self.assertTrue(CatalogImage.objects.filter(name='busybox', tag='latest').exists())
+        run_pull('busybox', user_id=self.admin.pk)
+        self.assertEqual(Image.objects.filter(name='busybox', tag='latest').count(), 1)
+
+        self.client.login(username=self.admin.email, password=self.password)
+        url = reverse("docker_box:pull-image-progress", kwargs={"uuid_token": "6a19ec28-db5f-4375-aeda-a5d15245d77c"})
+        response = self.client.get(url, {"imageName": "busybox"})
+        self.assertEqual(response.json()['status'], 'done')
+
+        snapshot = run_pull('missing')
+        self.assertEqual(snapshot['status'], 'error')
+        self.assertIn('pull access denied', snapshot['message'])
+
+    def test_existing_rows(self):
+        # a backup of a container saved under the same name is not the pull
+        Image.objects.create(name='busybox', tag='latest', user=self.admin, is_snapshot=True)
+        run_pull('busybox', user_id=self.admin.pk, interval=0)
+        self.assertEqual(Image.objects.filter(name='busybox', tag='latest', is_snapshot=False).count(), 1)
+        # rows left over from before pulls were deduplicated
+        Image.objects.create(name='busybox', tag='latest', user=self.admin)
+        snapshot = run_pull('busybox', user_id=self.admin.pk, interval=0)
+        self.assertEqual(snapshot['status'], 'done')
+        self.assertEqual(Image.objects.filter(name='busybox', tag='latest').count(), 3)
+
+    def test_final_progress_on_failure(self):
+        with self.assertRaises(User.DoesNotExist):
+            run_pull('busybox', user_id=0, interval=0)
+        self.assertEqual(get_pull_progress('busybox:latest')['status'], 'error')
+
+    def test_pull_slots(self):
+        with self.settings(PULL_CONCURRENCY=2):
+            slots = [acquire_pull_slot(), acquire_pull_slot()]
+            self.assertEqual(sorted(slots), [0, 1])
+            self.assertIsNone(acquire_pull_slot())
+            release_pull_slot(slots[0])
+            self.assertEqual(acquire_pull_slot(), slots[0])
+
+    def test_pull_releases_its_locks(self):
+        self.assertTrue(begin_pull('busybox:latest', self.admin.pk))
+        slot = acquire_pull_slot()
+        run_pull('busybox', user_id=self.admin.pk, interval=0, slot=slot)
+        self.assertEqual(acquire_pull_slot(), slot)
+        self.assertTrue(begin_pull('busybox:latest', self.admin.pk))
+
+    def test_locks_expire_unless_held(self):
+        with self.settings(PULL_LOCK_TTL=1):
+            # a worker that died mid-pull
+            self.assertTrue(begin_pull('nginx:latest', self.admin.pk))
+            slot = acquire_pull_slot()
+            time.sleep(0.6)
+            hold_pull('nginx:latest', self.admin.pk, slot)
+            time.sleep(0.6)
+            self.assertFalse(begin_pull('nginx:latest', self.admin.pk))
+            self.assertNotEqual(acquire_pull_slot(), slot)
+            time.sleep(1.1)
+            self.assertTrue(begin_pull('nginx:latest', self.admin.pk))
+
+
+class TestRegistrySearch(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestRegistrySearch, self).setUp()
+        self.daemon.search_results = [
+            {'name': 'ubuntu', 'description': 'Ubuntu base image', 'star_count': 10},
+            {'name': 'ubuntu-upstart', 'description': 'Ubuntu with upstart', 'star_count': 3},
+            {'name': 'nginx', 'description': 'web server', 'star_count': 7},
+        ]
+
+    def test_refined_terms_are_answered_locally(self):
+        search = RegistrySearch(self.docker_client, maxsize=10, ttl=60, stale_ttl=600, limit=25)
+        self.assertEqual([r['name'] for r in search.search('ub')], ['ubuntu', 'ubuntu-upstart'])
+        self.assertEqual([r['name'] for r in search.search('ubuntu-up')], ['ubuntu-upstart'])
+        self.assertEqual([r['name'] for r in search.search('UB ')], ['ubuntu', 'ubuntu-upstart'])
+        self.assertEqual(self.daemon.search_log, ['ub'])
+
+        # a full page may have more matches behind it, so it is not refined
+        search = RegistrySearch(self.docker_client, maxsize=10, ttl=60, stale_ttl=600, limit=2)
+        search.search('u')
+        search.search('ubuntu')
+        self.assertEqual(self.daemon.search_log, ['ub', 'u', 'ubuntu'])
+
+    def test_stale_while_revalidate(self):
+        search = RegistrySearch(self.docker_client, maxsize=10, ttl=0.1, stale_ttl=600, limit=25)
+        self.assertEqual(len(search.search('nginx')), 1)
+        time.sleep(0.2)
+        self.daemon.search_results.append({'name': 'nginx-proxy', 'description': '', 'star_count': 1})
+        self.assertEqual(len(search.search('nginx')), 1)
+        for _ in range(50):
+            if len(search.search('nginx')) == 2:
+                break
+            time.sleep(0.02)
+        self.assertEqual(len(search.search('nginx')), 2)
+
+    def test_concurrent_searches_share_a_request(self):
+        search = RegistrySearch(self.docker_client, maxsize=10, ttl=60, stale_ttl=600, limit=25)
+        self.daemon.delay = 0.3
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(search.search('nginx'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([len(r) for r in results], [1] * 4)
+        self.assertEqual(self.daemon.search_log, ['nginx'])
+
+
+class TestImageCatalog(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestImageCatalog, self).setUp()
+        self.client = Client()
+        self.admin = User.objects.create(email="daniel@micropyramid.com", first_name="Daniel", is_superuser=True)
+        self.password = "secret"
+        self.admin.set_password(self.password)
+        self.admin.save()
+        self.daemon.add_image('sha256:' + 'a' * 64, ['ubuntu-upstart:latest', 'ubuntu-upstart:16.04'], size=200000000)
+        self.daemon.add_image('sha256:' + 'b' * 64, ['nginx:latest'], size=100000000)
+
+    def test_sync(self):
+        self.assertEqual(sync_image_catalog(), (3, 0, 0))
+        entry = CatalogImage.objects.get(name='ubuntu-upstart', tag='16.04')
+        self.assertEqual((entry.image_id, entry.size), ('sha256:' + 'a' * 64, 200000000))
+        self.assertEqual(sync_image_catalog(), (0, 0, 0))
+
+        # nginx:latest now points at a new image and 16.04 was removed
+        self.daemon.images = {}
+        self.daemon.add_image('sha256:' + 'a' * 64, ['ubuntu-upstart:latest'], size=200000000)
+        self.daemon.add_image('sha256:' + 'c' * 64, ['nginx:latest'], size=120000000)
+        sync_on_event('image', {'Type': 'image', 'Action': 'delete', 'Actor': {'ID': 'sha256:' + 'b' * 64}})
+        self.assertEqual(sorted(CatalogImage.objects.values_list('name', 'tag', 'size')),
+                         [('nginx', 'latest', 120000000), ('ubuntu-upstart', 'latest', 200000000)])
+
+    def test_images_page_syncs_without_mirror(self):
+        self.client.login(username=self.admin.email, password=self.password)
+        response = self.client.get(reverse("docker_box:docker-images-list"))
+        self.assertEqual(len(response.context['other_images']), 3)
+        self.assertIn(('GET', '/images/json'), self.daemon.requests)
+        # once the mirror follows events the page reads the catalog alone
+        mirror_module._mirror.synced.set()
+        self.daemon.requests = []
+        self.client.get(reverse("docker_box:docker-images-list"))
+        self.assertEqual(self.daemon.requests, [])
+
+    def test_images_page_needs_no_docker(self):
+        sync_image_catalog()
+        Image.objects.create(name="ubuntu-upstart", tag="latest", user=self.admin)
+        self.daemon.stop()
+        self.client.login(username=self.admin.email, password=self.password)
+        response = self.client.get(reverse("docker_box:docker-images-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['images'][0].catalog.size, 200000000)
+        self.assertEqual([str(entry) for entry in response.context['other_images']],
+                         ['nginx:latest', 'ubuntu-upstart:16.04'])
+
+        response = self.client.get(reverse("docker_box:remove_image", kwargs={"name": "ubuntu-upstart"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Size: 200.00')
+
+
+class TestImageCatalogSyncs(StandInMixin, TransactionTestCase):
+    # syncs from several threads, each on its own database connection
+
+    def test_concurrent_syncs(self):
+        self.daemon.add_image('sha256:' + 'a' * 64, ['ubuntu-upstart:latest', 'ubuntu-upstart:16.04'])
+        self.daemon.add_image('sha256:' + 'b' * 64, ['nginx:latest'])
+        failures = []
+
+        def sync():
+            try:
+                for _ in range(5):
+                    sync_image_catalog()
+            except Exception as e:
+                failures.append(e)
+            finally:
+                db_connection.close()
+        threads = [threading.Thread(target=sync) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+        self.assertEqual(CatalogImage.objects.count(), 3)
+
+    def test_images_page_survives_database_errors(self):
+        # a listing the catalog cannot store fails every attempt
+        self.daemon.add_image('sha256:' + 'a' * 64, ['ubuntu-upstart:latest'], size=None)
+        admin = User.objects.create(email="daniel@micropyramid.com", first_name="Daniel", is_superuser=True)
+        admin.set_password('secret')
+        admin.save()
+        client = Client()
+        client.login(username=admin.email, password='secret')
+        self.assertEqual(client.get(reverse("docker_box:docker-images-list")).status_code, 200)
+
+
+class TestPlacement(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestPlacement, self).setUp()
+        self.admin = User.objects.create(email="daniel@micropyramid.com", first_name="Daniel", is_superuser=True)
+        self.image = Image.objects.create(name="ubuntu-upstart", tag="latest", user=self.admin)
+        # an unstarted sampler holding two samples of a four core host
+        self.sampler = stats_module._host_sampler
+        stats_module._host_sampler = HostSampler()
+        stats_module._host_sampler.samples.extend([{'time': time.time(), 'cpus': [90., 10., 40., 0.]},
+                                                   {'time': time.time(), 'cpus': [70., 10., 20., 0.]}])
+        for i, cpuset in enumerate(['2', '2-3']):
+            ip = IP.objects.create(ip_addr="10.0.0.%d" % (i + 1), is_available=False)
+            Container.objects.create(hostname="c%d" % i, container_id=str(i) * 64, image=self.image, ip=ip)
+            self.daemon.add_container(str(i) * 64, cpuset=cpuset)
+
+    def tearDown(self):
+        stats_module._host_sampler = self.sampler
+        super(TestPlacement, self).tearDown()
+
+    def test_choose_cores(self):
+        load = [80., 10., 30., 0.]
+        self.assertEqual(choose_cores(2, load, {}, 'spread'), [1, 3])
+        # core 3 carries two pinned containers, so core 2 goes before it
+        self.assertEqual(choose_cores(2, load, {2: 1, 3: 2}, 'spread'), [1, 3])
+        self.assertEqual(choose_cores(1, load, {3: 3}, 'spread'), [1])
+        # pack fills the busiest pinned core still under the threshold first
+        self.assertEqual(choose_cores(1, load, {2: 1, 3: 1}, 'pack'), [2])
+        self.assertEqual(choose_cores(2, load, {0: 1}, 'pack'), [1, 3])
+        self.assertRaises(ValueError, choose_cores, 5, load, {}, 'spread')
+        self.assertRaises(ValueError, choose_cores, 1, load, {}, 'random')
+
+    def test_place_cores(self):
+        self.assertEqual(parse_cpuset('0-2,5'), [0, 1, 2, 5])
+        self.assertEqual(recent_core_load(), [80., 10., 30., 0.])
+        self.assertEqual(pinned_cores(), {2: 2, 3: 1})
+        placement = place_cores(2, 'spread')
+        self.assertEqual(placement.cores, '1,3')
+        self.assertEqual(json.loads(placement.pinned), [0, 0, 2, 1])
+        placement.save()
+        self.assertEqual(place_cores(1, 'pack').cores, '3')
+        self.assertEqual(Placement.objects.get().requested, 2)
+
+    def test_no_samples_yet(self):
+        stats_module._host_sampler.samples.clear()
+        started = time.monotonic()
+        self.assertEqual(set(recent_core_load()), {0.})
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_edit_is_not_placed(self):
+        form = ContainerForm({'edit_field': 'true', 'cores': 1, 'ram': 200}, ssh_users=[])
+        self.assertTrue(form.is_valid())
+        self.assertIsNone(form.placement)
+        self.assertEqual(self.daemon.requests, [])
+        form = ContainerForm({'hostname': 'new.com', 'ip': IP.objects.first().pk, 'image': self.image.pk,
+                              'cores': 1, 'ram': 200}, ssh_users=[])
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.placement.requested, 1)
+
+
+class TestDockerClient(StandInMixin, TestCase):
+
+    def test_keep_alive(self):
+        for _ in range(5):
+            self.assertEqual(self.docker_client.get('/_ping').status_code, 200)
+        self.assertEqual(self.daemon.connections, 1)
+
+    def test_pool_bounds_connections(self):
+        client = DockerClient('unix', socket_path=self.daemon.socket_path, pool_size=2)
+        self.daemon.delay = 0.1
+        threads = [threading.Thread(target=client.get, args=('/_ping',)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        client.close()
+        self.assertEqual(self.daemon.connections, 2)
+
+
+class TestImageCache(TestCase):
+
+    def test_ref_index(self):
+        cache = ImageCache()
+        cache.put({'Id': 'sha256:a', 'Size': 1}, ['ubuntu:latest', 'ubuntu:16.04'])
+        self.assertEqual(cache.lookup('ubuntu:16.04')['Size'], 1)
+        cache.retag('sha256:a', ['ubuntu:16.04'])
+        self.assertIsNone(cache.lookup('ubuntu:latest'))
+
+        # a newer ubuntu:latest; dropping its only ref drops its data
+        cache.put({'Id': 'sha256:b', 'Size': 2}, ['ubuntu:latest'])
+        self.assertEqual(cache.lookup('ubuntu:latest')['Size'], 2)
+        cache.forget_ref('ubuntu:latest')
+        self.assertIsNone(cache.get('sha256:b'))
+
+        cache.reset([({'Id': 'sha256:c', 'Size': 3}, ['nginx:latest'])])
+        self.assertIsNone(cache.get('sha256:a'))
+        self.assertIsNone(cache.lookup('ubuntu:16.04'))
+        cache.evict('sha256:c')
+        self.assertIsNone(cache.lookup('nginx:latest'))
+
+
+class TestHostSampler(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = metrics_module._metrics_store
+        metrics_module._metrics_store = MetricsStore(archive=MetricsArchive(self.directory))
+
+    def tearDown(self):
+        metrics_module._metrics_store = self.store
+        shutil.rmtree(self.directory)
+
+    def sample(self, now):
+        return {'time': now, 'cpu': 1., 'cpus': [1.], 'memory': 1, 'memTotal': 2, 'net_stats_down': {},
+                'net_stats_up': {}, 'disk': {'Used': 1, 'Unused': 1}}
+
+    def test_ring_buffer(self):
+        sampler = HostSampler(interval=1, size=3)
+        for now in range(5):
+            sampler.add(self.sample(now))
+        self.assertEqual([sample['time'] for sample in sampler.history()], [2, 3, 4])
+        self.assertEqual(sampler.latest()['time'], 4)
+        self.assertEqual(sampler.wait_next(3), (5, sampler.latest()))
+        self.assertEqual(sampler.wait_next(5, timeout=0.01), (5, None))
+
+        timer = threading.Timer(0.05, sampler.add, (self.sample(5),))
+        timer.start()
+        seq, sample = sampler.wait_next(5, timeout=2)
+        self.assertEqual((seq, sample['time']), (6, 5))
+
+
+class TestStatsBroker(TestCase):
+
+    def test_one_collector_per_key(self):
+        feeds = {}
+
+        def samples(feed):
+            for sample in iter(feed.get, None):
+                yield sample
+
+        class Broker(StatsBroker):
+            def source(self, key):
+                feeds[key] = Queue()
+                return samples(feeds[key])
+
+        broker = Broker(queue_size=10)
+        key = ('container', 'a' * 12)
+        first, second = broker.subscribe(key), broker.subscribe(key)
+        self.assertEqual(list(feeds), [key])
+        feeds[key].put({'cpu': 1})
+        self.assertEqual(first.get(timeout=2), {'cpu': 1})
+        self.assertEqual(second.get(timeout=2), {'cpu': 1})
+        # a late subscriber starts from the last sample
+        third = broker.subscribe(key)
+        self.assertEqual(third.get(timeout=2), {'cpu': 1})
+        self.assertEqual(broker.watchers(), {key: 3})
+
+        for subscription in (first, second, third):
+            subscription.close()
+        self.assertEqual(broker.watchers(), {})
+        feeds[key].put({'cpu': 2})
+        first.topic.thread.join(2)
+        self.assertFalse(first.topic.thread.is_alive())
+
+
+class TestContainerStats(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestContainerStats, self).setUp()
+        self.archive_directory = tempfile.mkdtemp()
+        self.store = metrics_module._metrics_store
+        metrics_module._metrics_store = MetricsStore(archive=MetricsArchive(self.archive_directory))
+        self.daemon.stats_interval = 0.05
+        self.daemon.add_container('a' * 64, memory=512 * 1024 * 1024)
+
+    def tearDown(self):
+        metrics_module._metrics_store = self.store
+        shutil.rmtree(self.archive_directory)
+        super(TestContainerStats, self).tearDown()
+
+    def test_stats_stream(self):
+        samples = stream_container_samples('a' * 64)
+        first, second = next(samples), next(samples)
+        samples.close()
+        # 25ms of container time per 1s of system time on two cpus
+        self.assertEqual(second['cpu'], 5.0)
+        self.assertEqual((second['memory'], second['memTotal']), (48.0, 512.0))
+        self.assertEqual(first['netDow'], 0)
+        self.assertGreater(second['netDow'], 0)
+        self.assertTrue(metrics_module._metrics_store.history(('container', 'a' * 12), 0)['time'])
+
+
+class TestRequestContainerState(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestRequestContainerState, self).setUp()
+        self.ids = [str(i) * 64 for i in range(5)]
+        for i, container_id in enumerate(self.ids):
+            self.daemon.add_container(container_id, memory=(i + 1) * 1024 * 1024, cpuset='0,1')
+        self.middleware = RequestStoreMiddleware()
+        self.middleware.process_request(None)
+
+    def tearDown(self):
+        self.middleware.process_response(None, None)
+        super(TestRequestContainerState, self).tearDown()
+
+    def test_one_batch_per_request(self):
+        defer_inspects(container_states(), self.ids)
+        self.assertEqual(self.daemon.requests, [('GET', '/containers/json')])
+        self.assertEqual([container_ram(container_id) for container_id in self.ids], ['1', '2', '3', '4', '5'])
+        self.assertEqual(container_cores(self.ids[0]), 2)
+        inspects = self.daemon.requests[1:]
+        self.assertEqual(sorted(inspects), [('GET', '/containers/%s/json' % i) for i in self.ids])
+
+    def test_vanished_container(self):
+        defer_inspects(container_states(), self.ids)
+        del self.daemon.containers[self.ids[0]]
+        self.assertIsNone(container_ram(self.ids[0]))
+        self.assertEqual(container_ram(self.ids[1]), '2')
+        self.assertEqual(len(self.daemon.requests), 1 + 5)
+
+    def test_no_docker_calls_unless_needed(self):
+        self.middleware.process_response(None, None)
+        self.middleware.process_request(None)
+        self.assertEqual(self.daemon.requests, [])
+
+
+class TestContainerListInspects(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestContainerListInspects, self).setUp()
+        self.client = Client()
+        self.admin = User.objects.create(email="daniel@micropyramid.com", first_name="Daniel", is_superuser=True)
+        self.password = "secret"
+        self.admin.set_password(self.password)
+        self.admin.save()
+        image = Image.objects.create(name="ubuntu-upstart", tag="latest", user=self.admin)
+        for i in range(5):
+            ip = IP.objects.create(ip_addr="10.0.0.%d" % (i + 1), is_available=False)
+            Container.objects.create(hostname="c%d" % i, container_id=str(i) * 64, image=image, ip=ip)
+            # container 4 was removed behind docker-box's back
+            if i < 4:
+                self.daemon.add_container(str(i) * 64, running=i < 3, memory=256 * 1000000, cpuset='0,1',
+                                          ip_addr="10.0.0.%d" % (i + 1))
+
+    def test_cold_mirror(self):
+        self.client.login(username=self.admin.email, password=self.password)
+        response = self.client.get(reverse("docker_box:container-list"))
+        self.assertEqual(response.status_code, 200)
+        active = response.context['active_containers_list']
+        self.assertEqual([(c.hostname, c.memory, c.cores) for c in active],
+                         [('c0', 256, '0,1'), ('c1', 256, '0,1'), ('c2', 256, '0,1')])
+        self.assertEqual([c.hostname for c in response.context['idle_containers_list']], ['c3', 'c4'])
+        # one listing, then a single inspect per container in one batch
+        self.assertEqual(self.daemon.requests.count(('GET', '/containers/json')), 1)
+        inspects = [path for method, path in self.daemon.requests if path != '/containers/json']
+        self.assertEqual(sorted(inspects), ['/containers/%s/json' % (str(i) * 64) for i in range(5)])
+
+
+class TestDockerMirror(StandInMixin, TestCase):
+
+    def setUp(self):
+        super(TestDockerMirror, self).setUp()
+        self.daemon.add_container('a' * 64, memory=256 * 1024 * 1024, cpuset='0')
+        self.daemon.add_image('sha256:' + 'c' * 64, ['ubuntu-upstart:latest'], size=1000)
+        self.mirror = mirror_module.DockerMirror(self.docker_client, retry_interval=0.05).start()
+        self.assertTrue(self.mirror.synced.wait(2))
+        self.assertTrue(self.wait_for(lambda: self.daemon.event_streams))
+
+    def tearDown(self):
+        self.mirror.stop()
+        self.daemon.drop_events()
+        self.mirror.thread.join(2)
+        super(TestDockerMirror, self).tearDown()
+
+    def wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_follow_events_and_resync(self):
+        # the initial sync fills in limits and images
+        self.assertEqual(self.mirror.container('a' * 64)['HostConfig']['CpusetCpus'], '0')
+        self.assertEqual(image_cache.lookup('ubuntu-upstart:latest')['Size'], 1000)
+
+        self.daemon.containers['a' * 64]['State'] = {'Running': False, 'Status': 'exited'}
+        self.daemon.emit('container', 'stop', 'a' * 64)
+        self.assertTrue(self.wait_for(lambda: not self.mirror.container('a' * 64)['State']['Running']))
+
+        # a container created while the stream is down shows up after the resync
+        self.daemon.add_container('b' * 64, cpuset='1')
+        self.daemon.drop_events()
+        self.assertTrue(self.wait_for(lambda: self.mirror.container('b' * 64) is not None))
+        # and the mirror follows the new stream
+        self.assertTrue(self.wait_for(lambda: self.daemon.event_streams))
+        self.daemon.containers['b' * 64]['State'] = {'Running': False, 'Status': 'exited'}
+        self.daemon.emit('container', 'die', 'b' * 64)
+        self.assertTrue(self.wait_for(lambda: not self.mirror.container('b' * 64)['State']['Running']))
+
+    def test_survives_unexpected_events(self):
+        listed = self.daemon.requests.count(('GET', '/containers/json'))
+        self.daemon.emit('container', 'start', None)
+        del self.daemon.event_log[:]
+        self.assertTrue(self.wait_for(lambda: self.daemon.requests.count(('GET', '/containers/json')) > listed))
+        self.assertTrue(self.mirror.synced.wait(2))
+        self.assertTrue(self.mirror.thread.is_alive())
+        self.assertIsNotNone(self.mirror.container('a' * 64))
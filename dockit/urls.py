@@ -1,8 +1,8 @@
 from django.conf.urls import url
 from .views import index, logout_user
-from .views import host_stats
+from .views import host_stats, host_history, container_history, container_live, stream_counters
 from .views import docker_images, search_images, pull_image, pull_image_progress, launch_image, remove_image
-from .views import container_list, container_details, start_container, restart_container, stop_container, edit_container, delete_container, container_stats
+from .views import container_list, bulk_container_action, container_details, start_container, restart_container, stop_container, edit_container, delete_container, container_stats
 from .views import users_list, new_user, edit_user, delete_user, change_password, container_diff, terminal
 from .views import ip_list, new_ip, edit_ip, delete_ip, backup_container, ssh_access, container_top, container_info
 
@@ -11,6 +11,8 @@ urlpatterns = [
     url(r'^logout/$', logout_user, name='logout'),
 
     url(r'^host_stats/$', host_stats, name='host_stats'),
+    url(r'^host_stats/history/$', host_history, name='host_history'),
+    url(r'^host_stats/streams/$', stream_counters, name='stream_counters'),
 
     url(r'^images/$', docker_images, name='docker-images-list'),
     url(r'^images/search$', search_images, name='search-images'),
@@ -20,6 +22,7 @@ urlpatterns = [
     url(r'^images/(?P<name>.+)/remove/$', remove_image, name='remove_image'),
 
     url(r'^container/list/$', container_list, name='container-list'),
+    url(r'^container/bulk/$', bulk_container_action, name='bulk-container-action'),
     url(r'^container/(?P<container_id>[-\w]+)/$', container_details, name='container-details'),
     url(r'^container/(?P<container_id>[-\w]+)/start/$', start_container, name='start-container'),
     url(r'^container/(?P<container_id>[-\w]+)/restart/$', restart_container, name='restart-container'),
@@ -27,6 +30,8 @@ urlpatterns = [
     url(r'^container/(?P<container_id>[-\w]+)/edit/$', edit_container, name='edit_container'),
     url(r'^container/(?P<container_id>[-\w]+)/delete/$', delete_container, name='delete_container'),
     url(r'^container/(?P<container_id>[-\w]+)/stats/$', container_stats, name='container_stats'),
+    url(r'^container/(?P<container_id>[-\w]+)/history/$', container_history, name='container_history'),
+    url(r'^container/(?P<container_id>[-\w]+)/live/$', container_live, name='container_live'),
     url(r'^container/(?P<container_id>[-\w]+)/backup/$', backup_container, name='backup_container'),
     url(r'^container/(?P<container_id>[-\w]+)/change-password/$', change_password, name='change_password'),
     url(r'^container/(?P<container_id>[-\w]+)/ssh-access/$', ssh_access, name='ssh_access'),
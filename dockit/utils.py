@@ -1,10 +1,17 @@
-from subprocess import check_output
 from string import ascii_uppercase, digits
 from random import SystemRandom
 import psutil
-import shutil
 import requests
-from django.conf import settings
+import shutil
+import logging
+import threading
+from django.utils.functional import cached_property
+from dockit.client import get_client
+from dockit.aioclient import fan_out
+from dockit.mirror import get_mirror, compact_container, compact_summary, compact_image
+from dockit.cache import inspect_cache, image_cache
+
+logger = logging.getLogger(__name__)
 
 
 class DHost(object):
@@ -53,35 +60,230 @@ class DHost(object):
             return psutil.cpu_percent(interval=1)
 
 
+def network_ip_addr(networks):
+    if networks.get('dbox_macvlan', None):
+        return networks['dbox_macvlan']['IPAddress']
+    return networks['dbox_bridge']['IPAddress']
+
+
+def inspect_container(container_id):
+    # full inspect result, served from inspect_cache until it expires or
+    # the container changes state
+    inspect = inspect_cache.get(container_id[:12])
+    if inspect is None:
+        response = get_client().get('/containers/' + container_id + '/json')
+        if response.status_code != 200:
+            return None
+        inspect = inspect_cache.set(container_id[:12], response.json())
+    return inspect
+
+
+def invalidate_container(container_id):
+    inspect_cache.invalidate(container_id[:12])
+    get_mirror().forget_container(container_id)
+
+
+def container_state(container_id):
+    # compact inspect from the mirror, or from an inspect when it has none
+    state = get_mirror().container(container_id)
+    if state is None:
+        inspect = inspect_container(container_id)
+        if inspect is None:
+            return None
+        state = get_mirror().put_container(compact_container(inspect))
+    return state
+
+
+def container_states():
+    # every container keyed by short id, from the mirror or one /containers/json call
+    states = get_mirror().container_states()
+    if states is None:
+        response = get_client().get('/containers/json', params={'all': 1})
+        states = dict((summary['Id'][:12], compact_summary(summary)) for summary in response.json())
+    return states
+
+
+def inspect_states(container_ids):
+    # full states for many containers; cache misses are inspected concurrently
+    states = {}
+    missing = []
+    for container_id in container_ids:
+        state = get_mirror().container(container_id)
+        if state is None and inspect_cache.get(container_id[:12]) is not None:
+            state = get_mirror().put_container(compact_container(inspect_cache.get(container_id[:12])))
+        if state is None:
+            missing.append(container_id)
+        else:
+            states[container_id[:12]] = state
+    # a container removed or failing mid-batch is left out rather than
+    # failing the whole batch
+    inspects = fan_out(lambda client, container_id: client.inspect_container(container_id), missing,
+                       return_exceptions=True)
+    for container_id, inspect in zip(missing, inspects):
+        if isinstance(inspect, Exception):
+            logger.warning('inspect of container %s failed: %r', container_id, inspect)
+        elif inspect is not None:
+            inspect_cache.set(container_id[:12], inspect)
+            states[container_id[:12]] = get_mirror().put_container(compact_container(inspect))
+    return states
+
+
+request_store = threading.local()
+
+
+def defer_inspects(states, container_ids):
+    # a view about to render these containers: keep the states it has and
+    # inspect the rest together once one of them needs HostConfig
+    if getattr(request_store, 'containers', None) is not None:
+        request_store.containers.update(states)
+        request_store.pending.update(container_ids)
+
+
+def request_container_state(container_id):
+    # per-request memo: the first lookup that lacks HostConfig inspects it
+    # together with every deferred container in one batch; later lookups
+    # in the same request are free.
+    states = getattr(request_store, 'containers', None)
+    if states is None:
+        return container_state(container_id)
+    state = states.get(container_id[:12])
+    if state is None or state['HostConfig'] is None:
+        pending, request_store.pending = request_store.pending | {container_id}, set()
+        states.update(inspect_states(
+            [i for i in pending if (states.get(i[:12]) or {}).get('HostConfig') is None]))
+        state = states.get(container_id[:12])
+    return state
+
+
+def image_state(name, tag):
+    # resolved through the name:tag index to immutable, ID-keyed data
+    image = image_cache.lookup('%s:%s' % (name, tag))
+    if image is None:
+        image = refresh_image(name, tag)
+    return image
+
+
+def refresh_image(name, tag):
+    encode_name = name.replace('/', '%2F')
+    response = get_client().get('/images/%s:%s/json' % (encode_name, tag))
+    if response.status_code != 200:
+        return None
+    return image_cache.put(compact_image(response.json()), ['%s:%s' % (name, tag)])
+
+
+def container_top(container_id):
+    top_rg = get_client().get('/containers/%s/top' % container_id)
+    if top_rg.status_code == 200:
+        return top_rg.json()
+    return None
+
+
+def container_changes(container_id):
+    diff_rg = get_client().get('/containers/%s/changes' % container_id)
+    if diff_rg.status_code == 200:
+        return diff_rg.json() or []
+    return []
+
+
+def summarize_changes(changes, limit=None):
+    # /changes Kind: 0 modified, 1 added, 2 deleted
+    summary = {'modified': [], 'added': [], 'deleted': []}
+    for file_info in changes:
+        if file_info['Kind'] == 0:
+            summary['modified'].append(file_info['Path'])
+        elif file_info['Kind'] == 1:
+            summary['added'].append(file_info['Path'])
+        elif file_info['Kind'] == 2:
+            summary['deleted'].append(file_info['Path'])
+    if limit is not None:
+        summary = dict((kind, paths[:limit]) for kind, paths in summary.items())
+    return summary
+
+
+def run_container(image, hostname, cores, memory, network, ip_addr, mac_addr=None):
+    # what `docker run -itd` does, as two API calls; returns the full id.
+    # Raises requests.HTTPError, carrying dockerd's message, on failure.
+    body = {
+        'Image': image,
+        'Hostname': hostname,
+        'Tty': True,
+        'OpenStdin': True,
+        'HostConfig': {'CpusetCpus': cores, 'Memory': int(memory) * 1024 * 1024, 'NetworkMode': network},
+        'NetworkingConfig': {'EndpointsConfig': {network: {'IPAMConfig': {'IPv4Address': ip_addr}}}},
+    }
+    if mac_addr:
+        body['MacAddress'] = mac_addr
+    response = get_client().post('/containers/create', json=body)
+    raise_for_docker(response)
+    container_id = response.json()['Id']
+    response = get_client().post('/containers/%s/start' % container_id)
+    if response.status_code not in (204, 304):
+        # don't leave a created but never started container behind
+        get_client().delete('/containers/' + container_id, params={'v': 1, 'force': 1})
+        raise_for_docker(response)
+    return container_id
+
+
+def raise_for_docker(response):
+    if response.status_code >= 400:
+        try:
+            message = response.json()['message']
+        except (ValueError, KeyError, TypeError):
+            message = response.text
+        raise requests.HTTPError('%s: %s' % (response.status_code, message), response=response)
+
+
+PROVISION_SCRIPT = (
+    'set -e; '
+    'if [ -n "$DBOX_SSH_KEYS" ]; then '
+    'mkdir -p /root/.ssh && chmod 700 /root/.ssh && '
+    'printf \'%s\\n\' "$DBOX_SSH_KEYS" >> /root/.ssh/authorized_keys && chmod 600 /root/.ssh/authorized_keys; fi; '
+    'if [ -n "$DBOX_PASSPHRASE" ]; then printf \'root:%s\\n\' "$DBOX_PASSPHRASE" | chpasswd; fi'
+)
+
+
+def generate_passphrase():
+    symbols = '!@#%^&*_-=;:?><,.'
+    return ''.join(SystemRandom().choice(ascii_uppercase+digits+symbols) for _ in range(15))
+
+
+def run_exec(container_id, script, env):
+    # one exec session through the Engine API: create, run to completion,
+    # then check the exit code
+    body = {'Cmd': ['sh', '-c', script], 'Env': ['%s=%s' % item for item in sorted(env.items())],
+            'AttachStdout': True, 'AttachStderr': True}
+    response = get_client().post('/containers/%s/exec' % container_id, json=body)
+    raise_for_docker(response)
+    exec_id = response.json()['Id']
+    output = get_client().post('/exec/%s/start' % exec_id, json={'Detach': False, 'Tty': False})
+    raise_for_docker(output)
+    response = get_client().get('/exec/%s/json' % exec_id)
+    raise_for_docker(response)
+    exit_code = response.json()['ExitCode']
+    if exit_code != 0:
+        raise RuntimeError('exec in %s exited with %s: %r' % (container_id, exit_code, output.content[-200:]))
+
+
 class ImageMixin:
     def run_macvlan(self, cores, memory, ip_addr, mac_addr, hostname):
-        #TODO implement with api, or handle exception
-        run_cmd = 'docker run --cpuset-cpus=%s -m %sM --net=dbox_macvlan \
-                --ip=%s --mac-address %s -h %s -itd %s' % (cores, memory, \
-                ip_addr, mac_addr, hostname, self.name)
-        return check_output(run_cmd, shell=True)[0:12]
+        return run_container(self.name, hostname, cores, memory, 'dbox_macvlan', ip_addr, mac_addr)
 
     def run_bridge(self, cores, memory, ip_addr, hostname):
-        #TODO implement with api, or handle exception
-        run_cmd = 'docker run --cpuset-cpus=%s -m %sM --net=dbox_bridge \
-                --ip=%s -h %s -itd %s' % (cores, memory, ip_addr, hostname, self.name)
-        return check_output(run_cmd, shell=True)[0:12]
+        return run_container(self.name, hostname, cores, memory, 'dbox_bridge', ip_addr)
 
     def remove(self):
-        response = requests.delete('http://localhost:' + settings.DOCKER_API_PORT + '/images/' + self.name)
+        response = get_client().delete('/images/' + self.name)
+        if response.status_code == 200:
+            image_cache.forget_ref('%s:%s' % (self.name, self.tag))
         return response.status_code
 
     def details(self):
-        encode_name = self.name.replace('/', '%2F')
-        details_rg = requests.get('http://localhost:%s/images/%s:%s/json' % (settings.DOCKER_API_PORT, encode_name, self.tag))
-        j_details = details_rg.json()
+        j_details = image_state(self.name, self.tag)
         details_d = {'size': j_details['Size'] / 1000000, 'created': j_details['Created'].split('.')[0].replace('T', ' ')}
         return details_d
 
     def image_id(self):
-        encode_name = self.name.replace('/', '%2F')
-        response = requests.get('http://localhost:%s/images/%s:%s/json' % (settings.DOCKER_API_PORT, encode_name, self.tag))
-        return response.json()['Id']
+        return image_state(self.name, self.tag)['Id']
 
     def has_access(self, user):
         if user.is_superuser or self.user == user:
@@ -98,91 +300,102 @@ class ContainerMixin:
             return False
 
     def start(self):
-        if isinstance(self.container_id, bytes):
-            container_id = self.container_id.decode("utf-8")
-        else:
-            container_id = self.container_id
-        response = requests.post('http://localhost:' + settings.DOCKER_API_PORT + \
-                '/containers/' + container_id + '/start')
+        response = get_client().post('/containers/' + self.container_id + '/start')
+        invalidate_container(self.container_id)
         return response.status_code
 
     def stop(self):
-        if isinstance(self.container_id, bytes):
-            container_id = self.container_id.decode("utf-8")
-        else:
-            container_id = self.container_id
-        response = requests.post('http://localhost:' + settings.DOCKER_API_PORT + \
-                '/containers/' + container_id + '/stop')
+        response = get_client().post('/containers/' + self.container_id + '/stop')
+        invalidate_container(self.container_id)
         return response.status_code
 
     def restart(self):
-        response = requests.post('http://localhost:' + settings.DOCKER_API_PORT + \
-                '/containers/' + self.container_id + '/restart')
+        response = get_client().post('/containers/' + self.container_id + '/restart')
+        invalidate_container(self.container_id)
         return response.status_code
 
     def remove(self):
-        response = requests.delete('http://localhost:' + settings.DOCKER_API_PORT + \
-                '/containers/' + self.container_id + '?v=1?force=1')
+        response = get_client().delete('/containers/' + self.container_id + '?v=1?force=1')
+        invalidate_container(self.container_id)
         return response.status_code
 
     def details(self):
-        details_rg = requests.get('http://localhost:' + settings.DOCKER_API_PORT + \
-                '/containers/' + self.container_id + '/json')
-        j_details = details_rg.json()
+        return self.details_from_state(self.state())
+
+    def details_from_state(self, j_details):
         details_d = {'memory': j_details['HostConfig']['Memory']/1000000}
         details_d['cores'] = j_details['HostConfig']['CpusetCpus']
-
-        net = j_details['NetworkSettings']['Networks']
-        if net.get('dbox_macvlan', None):
-            details_d['ip_addr'] = net['dbox_macvlan']['IPAddress']
-        else:
-            details_d['ip_addr'] = net['dbox_bridge']['IPAddress']
-
+        details_d['ip_addr'] = network_ip_addr(j_details['NetworkSettings']['Networks'])
         details_d['created'] = j_details['Created'].split('.')[0].replace('T', ' ')
         details_d['running'] = j_details['State']['Running']
         return details_d
 
+    def state(self):
+        return container_state(self.container_id)
+
+    def apply_state(self, state):
+        # a state built from /containers/json has no HostConfig; memory and
+        # cores are then fetched lazily on access.
+        self.running = state['State']['Running']
+        self.created = state['Created'].split('.')[0].replace('T', ' ')
+        self.ip_addr = network_ip_addr(state['NetworkSettings']['Networks'])
+        if state['HostConfig'] is not None:
+            self.__dict__.update(self.details_from_state(state))
+
+    @cached_property
+    def inspected(self):
+        # limits for a state built from a summary; None when the container
+        # is gone or could not be inspected
+        state = request_container_state(self.container_id)
+        if state is None or state['HostConfig'] is None:
+            return {'memory': None, 'cores': None}
+        return self.details_from_state(state)
+
+    @cached_property
+    def memory(self):
+        return self.inspected['memory']
+
+    @cached_property
+    def cores(self):
+        return self.inspected['cores']
+
     def running_processes(self):
-        processes = requests.get('http://localhost:' + settings.DOCKER_API_PORT + '/containers/' + self.container_id + '/top')
+        processes = get_client().get('/containers/' + self.container_id + '/top')
         return processes
 
     def json(self):
-        container = requests.get('http://localhost:' + settings.DOCKER_API_PORT + '/containers/' + self.container_id + '/json')
-        return container.json()
+        return inspect_container(self.container_id)
 
     def commit(self, name):
         params = {'container': self.container_id, 'repo': name, 'tag': 'latest'}
-        response = requests.post('http://localhost:%s/commit' % (settings.DOCKER_API_PORT), params=params)
+        response = get_client().post('/commit', params=params)
+        invalidate_container(self.container_id)
+        if response.status_code == 201:
+            image_cache.tag('%s:latest' % name, response.json()['Id'])
         return response.status_code, response.json()
 
-    def set_passphrase(self):
-        symbols = '!@#%^&*_-=;:?><,.'
-        passphrase = ''.join(SystemRandom().choice(ascii_uppercase+digits+symbols) for _ in range(15))
-        if type(self.container_id) == str:
-            cmd = r'''docker exec %s bash -c "echo root:$'%s' | chpasswd"''' % (self.container_id, passphrase)
-        else:
-            cmd = r'''docker exec %s bash -c "echo root:$'%s' | chpasswd"''' % (self.container_id.decode("utf-8"), passphrase)
-        check_output(cmd, shell=True)
+    def provision(self, users=(), set_password=False):
+        """Append the users' SSH public keys to root's authorized_keys and,
+        with ``set_password``, set a new random root password, all in one
+        exec session. Returns the password, or None."""
+        keys = [user.ssh_pub_key.strip() for user in users if user.ssh_pub_key]
+        passphrase = generate_passphrase() if set_password else None
+        if keys or passphrase:
+            # the keys and password travel in the environment, never through a shell command line
+            run_exec(self.container_id, PROVISION_SCRIPT, {
+                'DBOX_SSH_KEYS': '\n'.join(keys),
+                'DBOX_PASSPHRASE': passphrase or '',
+            })
         return passphrase
 
+    def set_passphrase(self):
+        return self.provision(set_password=True)
+
     def copy_ssh_pub_key(self, user):
-        ssh_pub_key = user.ssh_pub_key
-        if type(self.container_id) == str:
-            cmd = r'''docker exec %s bash -c "ls /root/.ssh || mkdir /root/.ssh && echo '%s' >> /root/.ssh/authorized_keys"''' \
-                    % (self.container_id, ssh_pub_key)
-        else:
-            cmd = r'''docker exec %s bash -c "ls /root/.ssh || mkdir /root/.ssh && echo '%s' >> /root/.ssh/authorized_keys"''' \
-                    % (self.container_id.decode('utf-8'), ssh_pub_key)
-        check_output(cmd, shell=True)
+        self.provision([user])
 
     def top(self):
-        top_rg = requests.get('http://localhost:' + settings.DOCKER_API_PORT + '/containers/%s/top' % (self.container_id))
-        if top_rg.status_code == 200:
-            return top_rg.json()
-        return None
+        return container_top(self.container_id)
 
     def diff(self):
-        diff_rg = requests.get('http://localhost:' + settings.DOCKER_API_PORT + '/containers/%s/changes' % (self.container_id))
-        if diff_rg.status_code == 200:
-            return diff_rg.json()
-        return []
+        return container_changes(self.container_id)
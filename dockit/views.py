@@ -1,21 +1,29 @@
-from os import statvfs, uname
+from os import uname
 import time
 from socket import socket
-import psutil
 import uuid
-import json
-import requests
 import subprocess
+import requests
 from django.shortcuts import render, HttpResponse, get_object_or_404, redirect
 from django.http import JsonResponse, HttpResponseRedirect, StreamingHttpResponse, Http404
-from dockit.models import User, IP, Image, Container
+from dockit.models import User, IP, Image, Container, CatalogImage
 from dockit.forms import UserForm, IPForm, ContainerForm
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
 from django.core.urlresolvers import reverse
 from django.views.decorators.http import condition
-from docker_box.settings import BASE_DIR, DOCKER_API_PORT, HOST_IP_ADDR
+from dockit.utils import container_states, defer_inspects, summarize_changes
+from dockit.stats import get_host_sampler, get_stats_broker
+from dockit.streams import (FrameEncoder, stream_frames, stream_format, stream_fields, get_stream_registry,
+                            CONTENT_TYPES, HOST_STREAM_FIELDS, CONTAINER_STREAM_FIELDS)
+from dockit.metrics import get_metrics_store
+from dockit.bulk import BULK_ACTIONS, select_containers, run_bulk_action
+from dockit.pulls import get_pull_progress
+from dockit.catalog import ensure_image_catalog
+from dockit.search import get_registry_search
+from dockit.tasks import start_pull
+from docker_box.settings import BASE_DIR, DOCKER_API_PORT, HOST_IP_ADDR, METRICS_DEFAULT_RANGE
 
 
 def admin_required(function):
@@ -53,37 +61,62 @@ def logout_user(request):
     return HttpResponseRedirect('/')
 
 
+def stats_response(frames, fmt):
+    response = StreamingHttpResponse(frames, content_type=CONTENT_TYPES[fmt])
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 @condition(etag_func=None)
 def host_stats(request):
-    return StreamingHttpResponse(stream_host_stats())
+    fmt = stream_format(request)
+    fields = stream_fields(request, HOST_STREAM_FIELDS)
+    return stats_response(stream_host_stats(fields, fmt, request.user.pk), fmt)
 
 
-def stream_host_stats():
-    while True:
-        net = psutil.net_io_counters(pernic=True)
-        time.sleep(1)
-        net1 = psutil.net_io_counters(pernic=True)
-        net_stat_download = {}
-        net_stat_upload = {}
-        for k, v in net.items():
-            for k1, v1 in net1.items():
-                if k1 == k:
-                    net_stat_download[k] = (v1.bytes_recv - v.bytes_recv) / 1000.
-                    net_stat_upload[k] = (v1.bytes_sent - v.bytes_sent) / 1000.
-        ds = statvfs('/')
-        disk_str = {"Used": ((ds.f_blocks - ds.f_bfree) * ds.f_frsize) / 10 ** 9, "Unused": (ds.f_bavail * ds.f_frsize) / 10 ** 9}
-        yield '[{"cpu":"%s","memory":"%s","memTotal":"%s","net_stats_down":"%s","net_stats_up":"%s","disk":"%s"}],' \
-              % (psutil.cpu_percent(interval=1), psutil.virtual_memory().used, psutil.virtual_memory().free, \
-                 net_stat_download, net_stat_upload, disk_str)
+def stream_host_stats(fields=HOST_STREAM_FIELDS, fmt='sse', user_id=None):
+    return stream_frames(('host',), FrameEncoder('host', fields, fmt), user_id)
+
+
+@login_required
+@admin_required
+def stream_counters(request):
+    counters = get_stream_registry().counters()
+    counters['watchers'] = dict(('-'.join(key), count) for key, count in get_stats_broker().watchers().items())
+    return JsonResponse(counters)
+
+
+def history_range(request):
+    now = time.time()
+    start = float(request.GET.get('start') or now - METRICS_DEFAULT_RANGE)
+    end = float(request.GET.get('end') or now)
+    return start, end
+
+
+@login_required
+def host_history(request):
+    get_host_sampler()
+    start, end = history_range(request)
+    rows = get_metrics_store().history(('host',), start, end)
+    return JsonResponse(rows or {'time': []})
 
 
 @login_required
 @admin_required
 def docker_images(request):
-    images = Image.objects.filter(snapshot=None, is_snapshot=False)
+    # rendered from the image catalog alone; local images nobody launched
+    # from the UI are listed separately
+    ensure_image_catalog()
+    images = list(Image.objects.filter(snapshot=None, is_snapshot=False))
+    catalog = dict(((entry.name, entry.tag), entry) for entry in CatalogImage.objects.all())
+    for image in images:
+        image.catalog = catalog.pop((image.name, image.tag), None)
+    other_images = sorted(catalog.values(), key=lambda entry: (entry.name, entry.tag))
     uuid_token = str(uuid.uuid4())
-    return render(request, "images_list.html", {'images': images, 'uuid_token': uuid_token})
+    return render(request, "images_list.html", {'images': images, 'other_images': other_images,
+                                                'uuid_token': uuid_token})
 
 
 @login_required
@@ -98,26 +131,29 @@ def launch_image(request, name):
                     container_form.cleaned_data['hostname']
                 image_obj = Image.objects.get(id=request.POST['image'])
                 container_obj = container_form.save(commit=False)
-                if container_obj.ip.is_routed:
-                    result = image_obj.run_bridge(cores, memory, container_obj.ip.ip_addr, hostname)
-                else:
-                    result = image_obj.run_macvlan(cores, memory, container_obj.ip.ip_addr, container_obj.ip.mac_addr, hostname)
+                try:
+                    if container_obj.ip.is_routed:
+                        result = image_obj.run_bridge(cores, memory, container_obj.ip.ip_addr, hostname)
+                    else:
+                        result = image_obj.run_macvlan(cores, memory, container_obj.ip.ip_addr, container_obj.ip.mac_addr, hostname)
+                except requests.RequestException as e:
+                    return JsonResponse({'ERROR': str(e)})
                 container_obj.container_id = result
                 container_obj.save()
+                if container_form.placement is not None:
+                    container_form.placement.container = container_obj
+                    container_form.placement.save()
                 for r in request.POST.getlist('user'):
                     container_obj.user.add(r)
                 container_obj.save()
 
-                for ssh_user in request.POST.getlist('ssh_users'):
-                    user_obj = User.objects.get(email=ssh_user)
-                    container_obj.copy_ssh_pub_key(user_obj)
-
-                passphrase = container_obj.set_passphrase()
-                request.session['launched_container_id'] = container_obj.container_id.decode('utf-8')
+                ssh_users = User.objects.filter(email__in=request.POST.getlist('ssh_users'))
+                passphrase = container_obj.provision(ssh_users, set_password=True)
+                request.session['launched_container_id'] = container_obj.container_id
                 ip = IP.objects.get(ip_addr=str(container_obj.ip))
                 ip.is_available = False
                 ip.save()
-                url = reverse('docker_box:container_info', kwargs={'container_id': container_obj.container_id.decode('utf-8')})
+                url = reverse('docker_box:container_info', kwargs={'container_id': container_obj.container_id})
                 return JsonResponse({'success': 'image launched', 'url': url, 'passphrase': passphrase})
 
             return JsonResponse({'FORM_ERRORS': 'true', 'form_errors': container_form.errors})
@@ -140,12 +176,20 @@ def container_list(request):
         containers = Container.objects.all()
     else:
         containers = Container.objects.filter(user=request.user)
+    # rows render from the summaries; memory and cores are inspected in one
+    # batch only once the template shows a row that lacks them
+    states = container_states()
+    defer_inspects(states, [container.container_id for container in containers])
     active_containers_list = []
     idle_containers_list = []
     for container in containers:
-        details_d = container.details()
-        container.__dict__.update(details_d)
-        if details_d['running']:
+        state = states.get(container.container_id[:12])
+        if state is None:
+            container.running = False
+            container.memory = container.cores = container.ip_addr = container.created = None
+        else:
+            container.apply_state(state)
+        if container.running:
             active_containers_list.append(container)
         else:
             idle_containers_list.append(container)
@@ -165,8 +209,8 @@ def container_details(request, container_id):
     container = Container.objects.get_container(container_id, request.user)
     if container:
         images = Image.objects.filter(user=request.user, snapshot=container, is_snapshot=True)
-        return render(request, "container_details.html", {"container": container.json(), 'data': \
-                [['100', 10], ['90', 9], ['80', 8]], 'images': images, 'container_id': container.container_id})
+        return render(request, "container_details.html", {"container": container.state(),
+                      'images': images, 'container_id': container.container_id})
     else:
         return render(request, 'no_access.html')
 
@@ -265,53 +309,25 @@ def delete_ip(request, pk):
 @login_required
 @admin_required
 def search_images(request):
-    term = request.POST['term']
-    images = requests.get('http://localhost:' + DOCKER_API_PORT + '/images/search?term=' + term)
-    return HttpResponse(json.dumps(images.json()),
-                        content_type='application/json')
+    return JsonResponse(get_registry_search().search(request.POST['term']), safe=False)
 
 
 @login_required
 @admin_required
 def pull_image_progress(request, uuid_token):
-    file = open('/tmp/' + uuid_token, 'r')
-    data = file.read()
-    file.close()
-    if data:
-        return JsonResponse(data, safe=False)
-    else:
-        return JsonResponse({"status": "Pulling Please wait..."})
+    # progress is per image, shared by everyone who asked for that pull
+    progress = get_pull_progress('%s:latest' % request.GET.get('imageName', ''))
+    if progress:
+        return JsonResponse(progress)
+    return JsonResponse({"status": "Pulling Please wait..."})
 
 
 @login_required
 @admin_required
 def pull_image(request, uuid_token):
     # TODO userdefined tag
-    params = {'tag': 'latest', 'fromImage': request.POST['imageName']}
-    response = requests.post('http://localhost:' + DOCKER_API_PORT + '/images/create', params=params, stream=True)
-    if response:
-        for line in response.iter_lines():
-            file = open('/tmp/' + uuid_token, 'w')
-            if line:
-                output = json.loads(str(line.decode(encoding='UTF-8')))
-                try:
-                    if output['progressDetail']:
-                        progress = (output['progressDetail']['current'] * 100) / output['progressDetail']['total']
-                        file.write('{"status": "ok","image-status":"' + output['status'] + '","progress":' + str(
-                            int(progress)) + ',"id":"' + output['id'] + '"}')
-                except KeyError:
-                    try:
-                        if 'Digest:' in output['status']:
-                            Image.objects.get_or_create(name=request.POST['imageName'], user=request.user, tag='latest')
-                    except KeyError:
-                        pass
-                    file.close()
-                    file = open('/tmp/progress', 'w')
-                    file.write(str({"status": output['status']}))
-        file.close()
-        return JsonResponse({'status': 'ok'})
-    else:
-        return JsonResponse({'status': 'error'})
+    started = start_pull(request.POST['imageName'], 'latest', request.user.pk)
+    return JsonResponse({'status': 'queued' if started else 'attached'})
 
 
 @login_required
@@ -369,26 +385,57 @@ def restart_container(request, container_id):
     return render(request, 'no_access.html')
 
 
+@login_required
+def bulk_container_action(request):
+    # POST action=start|stop|restart|remove with container_id (repeated)
+    # and/or the state=running|stopped and image=<name> filters
+    if request.method != 'POST':
+        return JsonResponse({'ERROR': 'POST required'}, status=405)
+    action = request.POST.get('action')
+    if action not in BULK_ACTIONS:
+        return JsonResponse({'ERROR': 'Unknown action'}, status=400)
+    container_ids = request.POST.getlist('container_id')
+    state, image = request.POST.get('state'), request.POST.get('image')
+    if not (container_ids or state or image):
+        return JsonResponse({'ERROR': 'No containers selected'}, status=400)
+    if action == 'remove' and not request.user.check_password(request.POST.get('passphrase', '')):
+        return JsonResponse({'perror': True})
+    containers = select_containers(request.user, container_ids, state, image)
+    results = run_bulk_action(containers, action)
+    missing = [container_id for container_id in container_ids if container_id not in results]
+    return JsonResponse({'action': action, 'results': results, 'missing': missing})
+
+
 @login_required
 @condition(etag_func=None)
 def container_stats(request, container_id):
     container = Container.objects.get_container(container_id, request.user)
     if container:
-        return StreamingHttpResponse(stream_response_generator(container))
+        fmt = stream_format(request)
+        fields = stream_fields(request, CONTAINER_STREAM_FIELDS)
+        return stats_response(stream_response_generator(container, fields, fmt, request.user.pk), fmt)
     return render(request, 'no_access.html')
 
 
-def stream_response_generator(container):
-    container_id = container.container_id
-    while True:
-        response = str(subprocess.check_output("docker stats --no-stream " + container_id + "| tail -1", shell=True))
-        response = response.split()
-        if response:
-            yield '[{"cpu":"%s","memory":"%s","memTotal":"%s","netDow":"%s","netDowUnit":"%s",\
-                    "netUp":"%s","netUpUnit":"%s"}],' % (response[1], response[7], response[5], \
-                    response[8], response[9], response[11], response[12])
-        else:
-            yield response
+def container_live(request, container_id):
+    # WebSocket endpoint, served by docker_box.asgi; plain HTTP gets told so
+    response = HttpResponse('This endpoint needs a WebSocket connection.', status=426)
+    response['Upgrade'] = 'websocket'
+    return response
+
+
+@login_required
+def container_history(request, container_id):
+    container = Container.objects.get_container(container_id, request.user)
+    if container:
+        start, end = history_range(request)
+        rows = get_metrics_store().history(('container', container.container_id[:12]), start, end)
+        return JsonResponse(rows or {'time': []})
+    return render(request, 'no_access.html')
+
+
+def stream_response_generator(container, fields=CONTAINER_STREAM_FIELDS, fmt='sse', user_id=None):
+    return stream_frames(('container', container.container_id[:12]), FrameEncoder('container', fields, fmt), user_id)
 
 
 @login_required
@@ -428,9 +475,7 @@ def ssh_access(request, container_id):
                 user_obj = User.objects.get(email=ssh_user)
                 if not user_obj.ssh_pub_key:
                     return JsonResponse({'error': True})
-            for ssh_user in ssh_users:
-                user_obj = User.objects.get(email=ssh_user)
-                container.copy_ssh_pub_key(user_obj)
+            container.provision(User.objects.filter(email__in=ssh_users))
             return JsonResponse({'error': False})
         users = [request.user]
         if request.user.is_superuser:
@@ -454,21 +499,7 @@ def container_top(request, container_id):
 def container_diff(request, container_id, total):
     container = Container.objects.get_container(container_id, request.user)
     if container:
-        diff = container.diff()
-        modified = []
-        added = []
-        deleted = []
-        for file_info in diff:
-            if file_info['Kind'] == 0:
-                modified.append(file_info['Path'])
-            elif file_info['Kind'] == 1:
-                added.append(file_info['Path'])
-            elif file_info['Kind'] == 2:
-                deleted.append(file_info['Path'])
-
-        if total == '0':
-            return JsonResponse({'modified': modified[:10], 'added': added[:10], 'deleted': deleted[:10]})
-        return JsonResponse({'modified': modified, 'added': added, 'deleted': deleted})
+        return JsonResponse(summarize_changes(container.diff(), 10 if total == '0' else None))
     return render(request, 'no_access.html')
 
 
@@ -511,6 +542,7 @@ def remove_image(request, name):
             if request.user.check_password(passphrase):
                 status_code = image.remove()
                 if status_code == 200:
+                    CatalogImage.objects.filter(name=image.name, tag=image.tag).delete()
                     image.delete()
                     return JsonResponse({'success': 'Deleted'})
                 elif status_code == 404:
@@ -520,8 +552,9 @@ def remove_image(request, name):
                 return JsonResponse({'ERROR': 'Unable to remove image'})
             return JsonResponse({'perror': True})
         else:
-            details_d = image.details()
-            image.__dict__.update(details_d)
+            entry = CatalogImage.objects.filter(name=image.name, tag=image.tag).first()
+            if entry is not None:
+                image.size, image.created = entry.size_mb, entry.created
             return render(request, 'remove_image.html', {'image': image})
     return render(request, 'no_access.html')
 
@@ -540,9 +573,7 @@ def edit_container(request, container_id):
                     container_obj.user.add(r)
                 container_obj.save()
 
-                for ssh_user in request.POST.getlist('ssh_users'):
-                    user_obj = User.objects.get(email=ssh_user)
-                    container_obj.copy_ssh_pub_key(user_obj)
+                container_obj.provision(User.objects.filter(email__in=request.POST.getlist('ssh_users')))
                 url = reverse('docker_box:container-list')
                 return JsonResponse({'success': 'image launched', 'url': url})
 
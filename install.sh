@@ -123,6 +123,32 @@ Service=docker.service
 [Install]
 WantedBy=sockets.target" &&
 
+#docker_box needs Python 3.6.1 or later (async generators, the ASGI server);
+#where the distribution has no python3.6 it is built from source into /usr/local.
+python_version=3.6.15 &&
+
+install_python36(){
+    curl https://www.python.org/ftp/python/"$python_version"/Python-"$python_version".tgz -o /tmp/Python-"$python_version".tgz &&
+    tar xzf /tmp/Python-"$python_version".tgz -C /tmp &&
+    (cd /tmp/Python-"$python_version" && ./configure --prefix=/usr/local --enable-shared LDFLAGS="-Wl,-rpath /usr/local/lib" &&
+        make && sudo make altinstall)
+} &&
+
+create_env(){
+    python3.6 -c 'import sys; assert sys.version_info >= (3, 6, 1)' 2> /dev/null ||
+    install_python36 &&
+    python3.6 -m venv "$env_dir"
+} &&
+
+#metrics history lives outside the checkout, owned by the user running docker_box
+metrics_dir=/var/lib/docker_box/metrics &&
+
+configure_metrics_archive(){
+    sudo mkdir -p "$metrics_dir" &&
+    sudo chown -R $(whoami) /var/lib/docker_box &&
+    sed -i "s|\(METRICS_ARCHIVE_DIR\s=\s\).*|\1'$metrics_dir'|g" $project_dir/docker_box/docker_box/settings.py
+} &&
+
 restrict_api_access(){
     iptables -A INPUT -i lo -p tcp --dport 2375 -j ACCEPT &&
     iptables -A INPUT -p tcp --dport 2375 -j DROP
@@ -132,16 +158,16 @@ install(){
     dist_info &&
     case "$lsb_dist" in
         "Ubuntu"|"ubuntu") sudo apt update -y &&
-            sudo apt install -y curl &&
+            sudo apt install -y curl memcached &&
             if ! command_exists docker
             then
                 sudo update-grub &&
                 curl -sSL https://get.docker.com/ | sh &&
                 sudo usermod -aG docker $(whoami)
             fi &&
-            sudo apt install -y python3-dev python-pip git python-virtualenv &&
+            sudo apt install -y git build-essential libssl-dev zlib1g-dev libbz2-dev libreadline-dev libsqlite3-dev libffi-dev &&
             mkdir "$project_dir" &&
-            virtualenv -p python3 "$env_dir" &&
+            create_env &&
             cd "$project_dir" &&
             . db_env/bin/activate &&
             mkdir docker_box && cd docker_box &&
@@ -151,6 +177,8 @@ install(){
             #sed replacement pattern considers ampersand, forward slash and backslash(if seperator)  as special chars.
             secret_key=`python -c 'import random; print("".join([random.SystemRandom().choice("abcdefghijklmnopqrstuvwxyz0123456789!@#$%^*(-_=+)") for i in range(50)]))'`
             sed -i "s/\(SECRET_KEY\s=\s\).*/\1'$secret_key'/g" $project_dir/docker_box/docker_box/settings.py &&
+            configure_metrics_archive &&
+            pip install --upgrade pip &&
             yes | pip install -r requirements.txt &&
     
             python manage.py migrate &&
@@ -206,20 +234,20 @@ install(){
             printf "Enter a port for docker_box: " &&
             read port &&
             echo "Starting docker_box on port "$port"" &&
-            sudo su - $(whoami) -c "cd ${project_dir}/docker_box && . ${env_dir}/bin/activate && python manage.py runserver 0.0.0.0:"$port""
+            sudo su - $(whoami) -c "cd ${project_dir}/docker_box && . ${env_dir}/bin/activate && python manage.py celery worker --detach && uvicorn docker_box.asgi:application --host 0.0.0.0 --port "$port""
             ;;
     
         "Debian"|"debian")
             sudo apt-get update -y &&
-            sudo apt-get install -y curl &&
+            sudo apt-get install -y curl memcached &&
             if ! command_exists docker
             then
                 curl -sSL https://get.docker.com/ | sh &&
                 sudo usermod -aG docker $(whoami)
             fi &&
-            sudo apt-get install -y python3-dev python-pip git python-virtualenv &&
+            sudo apt-get install -y git build-essential libssl-dev zlib1g-dev libbz2-dev libreadline-dev libsqlite3-dev libffi-dev &&
             mkdir "$project_dir" &&
-            virtualenv -p python3 "$env_dir" &&
+            create_env &&
             cd "$project_dir" &&
             . db_env/bin/activate &&
             mkdir docker_box && cd docker_box &&
@@ -229,6 +257,8 @@ install(){
             #sed replacement pattern considers ampersand, forward slash and backslash(if seperator)  as special chars.
             secret_key=`python -c 'import random; print("".join([random.SystemRandom().choice("abcdefghijklmnopqrstuvwxyz0123456789!@#$%^*(-_=+)") for i in range(50)]))'`
             sed -i "s/\(SECRET_KEY\s=\s\).*/\1'$secret_key'/g" $project_dir/docker_box/docker_box/settings.py &&
+            configure_metrics_archive &&
+            pip install --upgrade pip &&
             yes | pip install -r requirements.txt &&
     
             python manage.py migrate &&
@@ -264,23 +294,15 @@ install(){
             printf "Enter a port for docker_box: " &&
             read port &&
             echo "Starting docker_box on port "$port"" &&
-            sudo su - $(whoami) -c "cd ${project_dir}/docker_box && . ${env_dir}/bin/activate && python manage.py runserver 0.0.0.0:"$port""
+            sudo su - $(whoami) -c "cd ${project_dir}/docker_box && . ${env_dir}/bin/activate && python manage.py celery worker --detach && uvicorn docker_box.asgi:application --host 0.0.0.0 --port "$port""
             ;;
     
         "CentOS"|"centos")
             sudo yum update -y &&
-            sudo yum -y install curl &&
-            install_python35(){
-                sudo yum -y groupinstall "Development tools" &&
-                sudo yum -y install zlib-devel bzip2-devel openssl-devel ncurses-devel sqlite-devel readline-devel tk-devel gdbm-devel db4-devel libpcap-devel xz-devel&&
-                curl  https://www.python.org/ftp/python/3.5.2/Python-3.5.2.tgz -o Python-3.5.2.tgz &&
-                tar xvfz Python-3.5.2.tgz &&
-                cd Python-3.5.2 && ./configure --prefix=/usr/local --enable-shared LDFLAGS="-Wl,-rpath /usr/local/lib" &&
-                make && sudo make install
-            } &&
-            python3 -c 'import sys; assert sys.version_info >= (3,5)' 2> /dev/null ||
-            install_python35 &&
-            sudo $(which pip3) install virtualenv &&
+            sudo yum -y install curl memcached &&
+            sudo chkconfig memcached on && sudo service memcached start &&
+            sudo yum -y groupinstall "Development tools" &&
+            sudo yum -y install zlib-devel bzip2-devel openssl-devel ncurses-devel sqlite-devel readline-devel tk-devel gdbm-devel db4-devel libpcap-devel xz-devel libffi-devel &&
 
             if ! command_exists docker
             then
@@ -289,7 +311,7 @@ install(){
             fi &&
 
             mkdir "$project_dir" &&
-            virtualenv -p python3 "$env_dir" &&
+            create_env &&
             cd "$project_dir" &&
             . db_env/bin/activate &&
             mkdir docker_box && cd docker_box &&
@@ -305,6 +327,8 @@ install(){
             #sed replacement pattern considers ampersand, forward slash and backslash(if seperator)  as special chars.
             secret_key=`python -c 'import random; print("".join([random.SystemRandom().choice("abcdefghijklmnopqrstuvwxyz0123456789!@#$%^*(-_=+)") for i in range(50)]))'`
             sed -i "s/\(SECRET_KEY\s=\s\).*/\1'$secret_key'/g" $project_dir/docker_box/docker_box/settings.py &&
+            configure_metrics_archive &&
+            pip install --upgrade pip &&
             yes | pip install -r requirements.txt &&
 
             python manage.py migrate &&
@@ -341,7 +365,7 @@ install(){
             printf "Enter a port for docker_box: " &&
             read port &&
             echo "Starting docker_box on port "$port"" &&
-            sudo su - $(whoami) -c "cd ${project_dir}/docker_box && . ${env_dir}/bin/activate && python manage.py runserver 0.0.0.0:"$port""
+            sudo su - $(whoami) -c "cd ${project_dir}/docker_box && . ${env_dir}/bin/activate && python manage.py celery worker --detach && uvicorn docker_box.asgi:application --host 0.0.0.0 --port "$port""
             ;;
     esac
 }
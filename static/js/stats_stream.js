@@ -0,0 +1,104 @@
+/** ******  stats stream (protocol v1)  *********************** **/
+// Returns a function that folds protocol v1 sample frames into the full,
+// numeric state. Per-key fields (e.g. the per-NIC rates) arrive
+// delta-encoded and are merged; a frame with "key": true replaces them.
+function statsDecoder() {
+    var state = {};
+    return function (frame) {
+        for (var field in frame) {
+            var value = frame[field];
+            if (value !== null && typeof value === 'object' && !frame.key && state[field]) {
+                for (var name in value) {
+                    state[field][name] = value[name];
+                }
+            } else {
+                state[field] = value;
+            }
+        }
+        return state;
+    };
+}
+
+// Opens a host_stats / container_stats event stream and calls onSample with
+// the decoded state for every sample frame. Returns the EventSource so
+// callers can close it. The browser reconnects by itself when a stream
+// reaches its maximum age; streams ended for any other reason stay closed.
+function statsStream(url, fields, onSample) {
+    var decode = statsDecoder();
+    var source = new EventSource(url + (fields ? '?fields=' + fields.join(',') : ''));
+    source.addEventListener('hello', function (e) {
+        var hello = JSON.parse(e.data);
+        if (hello.v !== 1) {
+            source.close();
+        }
+        decode = statsDecoder();
+        source.units = hello.units;
+    });
+    source.addEventListener('sample', function (e) {
+        onSample(decode(JSON.parse(e.data)), source.units || {});
+    });
+    source.addEventListener('end', function (e) {
+        if (JSON.parse(e.data).reason !== 'max_age') {
+            source.close();
+        }
+    });
+    return source;
+}
+
+// Opens a container's live WebSocket, which multiplexes the stats, top and
+// diff channels. handlers.stats gets decoded stats samples, handlers.top and
+// handlers.diff the latest data, which is only pushed when it changes. Call
+// watch([...]), add(channel) or remove(channel) to pick channels. onFail
+// runs instead when the server does not speak WebSocket (e.g. plain WSGI),
+// so the page can fall back to polling.
+function liveSocket(path, handlers, onFail) {
+    var scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+    var socket = new WebSocket(scheme + location.host + path);
+    var live = {watching: [], opened: false};
+    var decode = statsDecoder();
+    var units = {};
+    live.watch = function (channels) {
+        live.watching = channels;
+        if (live.opened) {
+            socket.send(JSON.stringify({watch: channels}));
+        }
+    };
+    live.add = function (channel) {
+        if (live.watching.indexOf(channel) === -1) {
+            live.watch(live.watching.concat([channel]));
+        }
+    };
+    live.remove = function (channel) {
+        live.watch(live.watching.filter(function (c) { return c !== channel; }));
+    };
+    live.close = function () {
+        live.watching = [];
+        socket.close();
+    };
+    socket.onopen = function () {
+        live.opened = true;
+        socket.send(JSON.stringify({watch: live.watching}));
+    };
+    socket.onclose = function () {
+        if (!live.opened && onFail) {
+            onFail(live.watching);
+        }
+    };
+    socket.onmessage = function (e) {
+        var message = JSON.parse(e.data);
+        if (message.channel === 'stats') {
+            var frame = message.frame;
+            if (frame.type === 'hello') {
+                decode = statsDecoder();
+                units = frame.units;
+            } else if (frame.type === 'sample') {
+                handlers.stats(decode(frame), units);
+            } else if (frame.type === 'end' && frame.reason === 'max_age') {
+                live.watch(live.watching);
+            }
+        } else if (message.channel && handlers[message.channel]) {
+            handlers[message.channel](message.data);
+        }
+    };
+    return live;
+}